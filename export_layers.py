@@ -86,8 +86,17 @@ class ExportLayersPlugin(gimpplugin.plugin):
       self.special_settings['image'],
     ]
     
+    self.export_layers_batch_params = [
+      self._create_plugin_param(self.special_settings['run_mode']),
+      (gimpenums.PDB_INT32, b"num_images", b"Number of images"),
+      (gimpenums.PDB_INT32ARRAY, b"images", b"IDs of open images to export layers from"),
+      (gimpenums.PDB_INT32, b"num_filenames", b"Number of filenames"),
+      (gimpenums.PDB_STRINGARRAY, b"filenames", b"Filenames of images to load and export layers from"),
+    ] + self._create_plugin_params(self.export_layers_settings[2:])
+    
     self.export_layers_return_values = []
     self.export_layers_to_return_values = []
+    self.export_layers_batch_return_values = []
   
   def query(self):
     gimp.domain_register(constants.DOMAIN_NAME, constants.LOCALE_PATH)
@@ -121,6 +130,23 @@ class ExportLayersPlugin(gimpplugin.plugin):
       self._create_plugin_params(self.export_layers_to_return_values)
     )
     
+    gimp.install_procedure(
+      "plug_in_export_layers_batch",
+      _("Export layers from multiple images with the same settings"),
+      _("Images can be specified as open images, filenames of images to load, or "
+        "both. Layers of each image are exported to a subdirectory of the output "
+        "directory named after the image. In the \"RUN-WITH-LAST-VALS\" run mode, "
+        "the settings from the last run are used instead of the specified ones."),
+      "khalim19 <khalim19@gmail.com>",
+      "khalim19",
+      "2013",
+      "",
+      "",
+      gimpenums.PLUGIN,
+      self.export_layers_batch_params,
+      self._create_plugin_params(self.export_layers_batch_return_values)
+    )
+    
     gimp.menu_register("plug_in_export_layers", "<Image>/File/Export")
     gimp.menu_register("plug_in_export_layers_to", "<Image>/File/Export")
   
@@ -147,24 +173,73 @@ class ExportLayersPlugin(gimpplugin.plugin):
     else:
       self._run_with_last_vals(image)
   
+  def plug_in_export_layers_batch(self, run_mode, num_images, image_ids, num_filenames, filenames,
+                                  *args):
+    self.special_settings['run_mode'].value = run_mode
+    
+    open_images = {image.ID: image for image in gimp.image_list()}
+    images = []
+    for image_id in image_ids:
+      if image_id not in open_images:
+        raise ValueError("invalid image ID: {0}".format(image_id))
+      images.append(open_images[image_id])
+    
+    images.extend(filename.decode() if isinstance(filename, bytes) else filename
+                  for filename in filenames)
+    
+    if run_mode == gimpenums.RUN_WITH_LAST_VALS:
+      self._load_last_vals()
+    else:
+      run_mode = gimpenums.RUN_NONINTERACTIVE
+      self._set_main_settings_from_args(args)
+    
+    self.main_settings.streamline(force=True)
+    
+    batch_layer_exporter = exportlayers.BatchLayerExporter(
+      run_mode,
+      images,
+      self.main_settings,
+      overwrite_chooser=overwrite.NoninteractiveOverwriteChooser(self.main_settings['overwrite_mode'].value),
+      progress_updater=None
+    )
+    try:
+      batch_layer_exporter.export_images()
+    except exportlayers.ExportLayersCancelError as e:
+      print(e.message)
+    
+    self._save_settings()
+    
+    failed_results = [result for result in batch_layer_exporter.results if result.error is not None]
+    for result in failed_results:
+      print(result.source + ": " + result.error)
+    
+    if failed_results:
+      raise exportlayers.ExportLayersError(
+        "export failed for {0} of {1} images".format(len(failed_results), len(images)))
+  
   def _run_noninteractive(self, image, args):
     # Start with the third parameter - run_mode and image are already set.
-    for setting, arg in zip(self.export_layers_settings[2:], args[2:]):
+    self._set_main_settings_from_args(args[2:])
+    
+    self._run_plugin_noninteractive(gimpenums.RUN_NONINTERACTIVE, image)
+  
+  def _set_main_settings_from_args(self, args):
+    for setting, arg in zip(self.export_layers_settings[2:], args):
       if isinstance(arg, bytes):
         arg = arg.decode()
       setting.value = arg
-    
-    self._run_plugin_noninteractive(gimpenums.RUN_NONINTERACTIVE, image)
   
   def _run_with_last_vals(self, image):
+    self._load_last_vals()
+    self._run_plugin_noninteractive(gimpenums.RUN_WITH_LAST_VALS, image)
+  
+  def _load_last_vals(self):
     self.setting_persistor.read_setting_streams.append(self.config_file_stream)
     status = self.setting_persistor.load(self.main_settings)
     self.setting_persistor.read_setting_streams.pop()
     
     if status == self.setting_persistor.READ_FAIL:
       print(self.setting_persistor.status_message)
-    
-    self._run_plugin_noninteractive(gimpenums.RUN_WITH_LAST_VALS, image)
   
   def _run_export_layers_interactive(self, image):
     gui_plugin.export_layers_gui(image, self.main_settings, self.special_settings,
@@ -191,6 +266,9 @@ class ExportLayersPlugin(gimpplugin.plugin):
       print(e.message)
       raise
     
+    self._save_settings()
+  
+  def _save_settings(self):
     self.special_settings['first_run'].value = False
     self.setting_persistor.save(self.main_settings, [self.special_settings['first_run']])
   
@@ -0,0 +1,294 @@
+#-------------------------------------------------------------------------------
+#
+# This file is part of Export Layers.
+#
+# Copyright (C) 2013, 2014 khalim19 <khalim19@gmail.com>
+#
+# Export Layers is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Export Layers is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Export Layers.  If not, see <http://www.gnu.org/licenses/>.
+#
+#-------------------------------------------------------------------------------
+
+"""
+This module provides a command-line interface to export layers from images
+without the GUI. It is meant to be run from the GIMP batch mode, e.g.:
+  
+  gimp -i --batch-interpreter python-fu-eval --quit \
+    -b "import sys; sys.path.append(gimp.directory + '/plug-ins'); from export_layers import cli; cli.main(['--file-extension', 'png', '--output-directory', 'out', 'image.xcf'])"
+
+`main()` makes the batch command fail if the export fails. GIMP then exits
+with a non-zero status, provided that GIMP is quit by the `--quit` option
+rather than by a `pdb.gimp_quit` batch command, which always exits with zero
+status. To obtain the exact exit status (see `run()`), call `run()` instead
+and check the returned value.
+
+Main settings are specified as named options (run with `--help` for the list of
+options). Images can be specified as arguments or in a queue file (one
+filename per line), which allows each worker in a render farm to process its
+own queue of files in a single GIMP instance. A machine-readable summary of the
+export in the JSON format is written to the standard output or to the file
+specified by `--summary`.
+"""
+
+#===============================================================================
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+str = unicode
+
+#===============================================================================
+
+import sys
+import json
+import time
+import argparse
+import gettext
+
+import __builtin__
+
+from export_layers import constants
+
+# The GIMP batch mode does not install `gettext` functions used in the settings.
+if '_' not in __builtin__.__dict__:
+  gettext.install(constants.DOMAIN_NAME, constants.LOCALE_PATH, unicode=True)
+
+import gimpenums
+
+from export_layers.pylibgimpplugin import settings
+from export_layers.pylibgimpplugin import overwrite
+
+from export_layers import settings_plugin
+from export_layers import exportlayers
+
+#===============================================================================
+
+__EXIT_STATUSES = EXIT_SUCCESS, EXIT_FAILURE, EXIT_INVALID_ARGUMENTS = (0, 1, 2)
+
+#===============================================================================
+
+def create_argument_parser(main_settings):
+  """
+  Create an `argparse.ArgumentParser` instance with options for the specified
+  main settings. Option names are setting names with '_' replaced by '-'.
+  """
+  
+  parser = argparse.ArgumentParser(
+    prog=constants.PLUGIN_PROGRAM_NAME,
+    description="Export layers as separate images from the specified images.")
+  
+  parser.add_argument(
+    'filenames', nargs='*', metavar='FILENAME', help="image to export layers from")
+  parser.add_argument(
+    '--queue', metavar='FILE',
+    help="file containing filenames of images, one per line ('-' for standard input)")
+  parser.add_argument(
+    '--summary', metavar='FILE', help="write the export summary to FILE instead of standard output")
+  parser.add_argument(
+    '--no-image-subdirectories', dest='image_subdirectories', action='store_false',
+    help="export layers of all images directly to the output directory")
+  parser.add_argument(
+    '--stop-on-error', action='store_true', help="stop at the first image that fails to export")
+  parser.add_argument(
+    '--incremental', action='store_true', help="skip layers not changed since the last export")
+  parser.add_argument(
+    '--encode-in-process', dest='in_process_file_extensions', action='append', default=[],
+    metavar='EXTENSION', choices=['png', 'data'],
+    help="encode files with the given extension in the plug-in process instead of by GIMP")
+  parser.add_argument(
+    '--write-behind', action='store_true',
+    help="write files encoded in the plug-in process in background threads "
+         "(requires --encode-in-process)")
+  
+  settings_group = parser.add_argument_group("settings")
+  for setting in main_settings:
+    if not setting.can_be_registered_to_pdb:
+      continue
+    
+    option_name = '--' + setting.name.replace('_', '-')
+    
+    if isinstance(setting, settings.BoolSetting):
+      settings_group.add_argument(
+        option_name, dest=setting.name, action='store_true', default=None,
+        help=setting.display_name)
+      settings_group.add_argument(
+        '--no-' + setting.name.replace('_', '-'), dest=setting.name, action='store_false',
+        default=None)
+    elif isinstance(setting, settings.EnumSetting):
+      settings_group.add_argument(
+        option_name, dest=setting.name, choices=list(setting.options.keys()),
+        help=setting.display_name)
+    else:
+      settings_group.add_argument(
+        option_name, dest=setting.name, metavar='VALUE', help=setting.display_name)
+  
+  return parser
+
+
+def apply_options(main_settings, options):
+  """
+  Assign values of the parsed command-line options to the main settings.
+  Settings whose options were not specified keep their current values.
+  
+  Raises:
+  
+  * `settings.SettingValueError` - An option value is invalid for the setting.
+  """
+  
+  for setting in main_settings:
+    value = getattr(options, setting.name, None)
+    if value is None:
+      continue
+    
+    if isinstance(setting, settings.EnumSetting):
+      value = setting.options[value]
+    else:
+      value = _decode(value)
+    
+    setting.value = value
+
+
+def read_queue(queue_file):
+  """
+  Return a list of non-empty lines from the specified file object, stripped of
+  leading and trailing whitespace.
+  """
+  
+  filenames = []
+  for line in queue_file:
+    line = _decode(line).strip()
+    if line:
+      filenames.append(line)
+  
+  return filenames
+
+
+def main(args):
+  """
+  Export layers from images according to the specified command-line arguments
+  (see `run()`). If the export fails, exit with the exit status, which makes the
+  GIMP batch command fail.
+  
+  On success, this function returns normally, since exiting the batch
+  interpreter, even with zero status, is regarded by GIMP as a failed batch
+  command.
+  """
+  
+  status = run(args)
+  if status != EXIT_SUCCESS:
+    sys.exit(status)
+
+
+def run(args):
+  """
+  Export layers from images according to the specified command-line arguments
+  and return the exit status - `EXIT_SUCCESS`, `EXIT_FAILURE` if any image
+  failed to export, or `EXIT_INVALID_ARGUMENTS`.
+  """
+  
+  main_settings = settings_plugin.MainSettings()
+  parser = create_argument_parser(main_settings)
+  
+  try:
+    options = parser.parse_args(args)
+  except SystemExit as e:
+    return e.code
+  
+  if options.write_behind and not options.in_process_file_extensions:
+    print("--write-behind requires --encode-in-process", file=sys.stderr)
+    return EXIT_INVALID_ARGUMENTS
+  
+  try:
+    apply_options(main_settings, options)
+  except settings.SettingValueError as e:
+    print(e.message, file=sys.stderr)
+    return EXIT_INVALID_ARGUMENTS
+  
+  filenames = [_decode(filename) for filename in options.filenames]
+  if options.queue is not None:
+    try:
+      if options.queue == '-':
+        filenames.extend(read_queue(sys.stdin))
+      else:
+        with open(options.queue, 'r') as queue_file:
+          filenames.extend(read_queue(queue_file))
+    except (IOError, OSError) as e:
+      print("Could not read queue file: " + str(e), file=sys.stderr)
+      return EXIT_INVALID_ARGUMENTS
+  
+  main_settings.streamline(force=True)
+  
+  batch_layer_exporter = exportlayers.BatchLayerExporter(
+    gimpenums.RUN_NONINTERACTIVE,
+    filenames,
+    main_settings,
+    overwrite_chooser=overwrite.NoninteractiveOverwriteChooser(main_settings['overwrite_mode'].value),
+    progress_updater=None,
+    use_image_subdirectories=options.image_subdirectories,
+    stop_on_error=options.stop_on_error,
+    incremental=options.incremental,
+    in_process_file_extensions=options.in_process_file_extensions,
+    write_behind=options.write_behind
+  )
+  
+  status = 'success'
+  start_time = time.time()
+  try:
+    batch_layer_exporter.export_images()
+  except exportlayers.ExportLayersCancelError:
+    status = 'cancelled'
+  except exportlayers.ExportLayersError:
+    status = 'failure'
+  
+  results = batch_layer_exporter.results
+  if status == 'success' and any(result.error is not None for result in results):
+    status = 'failure'
+  
+  summary = get_summary(status, results, time.time() - start_time)
+  if options.summary is not None:
+    with open(options.summary, 'w') as summary_file:
+      json.dump(summary, summary_file, indent=2)
+  else:
+    print(json.dumps(summary, indent=2))
+  
+  return EXIT_SUCCESS if status == 'success' else EXIT_FAILURE
+
+
+def get_summary(status, results, elapsed_time):
+  """
+  Return a JSON-serializable dict summarizing the export from the list of
+  `exportlayers.ImageExportResult` instances.
+  """
+  
+  return {
+    'status': status,
+    'time': elapsed_time,
+    'num_images': len(results),
+    'num_failed_images': len([result for result in results if result.error is not None]),
+    'num_exported_layers': sum(len(result.exported_layer_names) for result in results),
+    'images': [
+      {'source': result.source,
+       'output_directory': result.output_directory,
+       'exported_layers': result.exported_layer_names,
+       'error': result.error}
+      for result in results],
+  }
+
+
+def _decode(value):
+  if isinstance(value, bytes):
+    return value.decode(sys.getfilesystemencoding())
+  else:
+    return value
@@ -82,5 +82,7 @@ DOMAIN_NAME = PLUGIN_PROGRAM_NAME
 LOCALE_DIRNAME = "locale"
 LOCALE_PATH = os.path.join(PLUGINS_DIRECTORY, PLUGIN_PROGRAM_NAME, LOCALE_DIRNAME)
 
+EXPORT_MANIFEST_FILENAME = "." + PLUGIN_PROGRAM_NAME + "_manifest.json"
+
 PLUGINS_LOG_STDOUT_PATH = os.path.join(PLUGIN_PATH, PLUGIN_PROGRAM_NAME + '.log')
 PLUGINS_LOG_STDERR_PATH = os.path.join(PLUGIN_PATH, PLUGIN_PROGRAM_NAME + '_error.log')
@@ -24,6 +24,8 @@ This module:
 * is the core of the plug-in
 * defines a class that exports layers as individual images
 * defines filter rules for layers
+* defines a manifest of exported files used to skip unchanged layers
+* defines a cache of merged background layers persisting across plug-in runs
 """
 
 #===============================================================================
@@ -37,11 +39,16 @@ str = unicode
 
 #===============================================================================
 
+import sys
 import os
+import json
+import hashlib
+import operator
 from collections import defaultdict
 
 import gimp
 import gimpenums
+import gimpshelf
 
 from export_layers import constants
 
@@ -49,7 +56,11 @@ from export_layers.pylibgimpplugin import libfiles
 from export_layers.pylibgimpplugin import pylibgimp
 from export_layers.pylibgimpplugin import itemdata
 from export_layers.pylibgimpplugin import objectfilter
+from export_layers.pylibgimpplugin import overwrite
 from export_layers.pylibgimpplugin import progress
+from export_layers.pylibgimpplugin import profiling
+from export_layers.pylibgimpplugin import encoders
+from export_layers.pylibgimpplugin import writebehind
 
 #===============================================================================
 
@@ -71,7 +82,7 @@ class OverwriteHandler(object):
   """
   This class handles conflicting files using the specified `OverwriteChooser`
   class with the following choices available:
-  
+    
     * Replace
     * Skip
     * Rename new file
@@ -82,10 +93,34 @@ class OverwriteHandler(object):
   __OVERWRITE_MODES = REPLACE, SKIP, RENAME_NEW, RENAME_EXISTING, CANCEL = (0, 1, 2, 3, 4)
   
   @classmethod
-  def handle(cls, filename, overwrite_chooser):
+  def handle(cls, filename, overwrite_chooser, dry_run=False, directory_cache=None):
+    """
+    If a file with the specified filename exists, let `overwrite_chooser`
+    choose how to handle it.
+    
+    If `dry_run` is True, existing files are not renamed.
+    
+    If `directory_cache` (a `libfiles.DirectoryCache` object) is specified,
+    check for existing files through the cache and record renamed files in it.
+    In a dry run, the names existing files would be renamed to are recorded
+    instead.
+    
+    Returns:
+      
+      * `should_skip` - True if the file should not be saved, False otherwise.
+      
+      * `filename` - Filename to save the file to.
+    
+    Raises:
+    
+    * `ExportLayersCancelError` - The user chose to cancel.
+    """
+    
     should_skip = False
     
-    if os.path.exists(filename):
+    exists = directory_cache.exists if directory_cache is not None else os.path.exists
+    
+    if exists(filename):
       overwrite_chooser.choose(filename=os.path.basename(filename))
       if overwrite_chooser.overwrite_mode == cls.SKIP:
         should_skip = True
@@ -93,56 +128,426 @@ class OverwriteHandler(object):
         # Nothing needs to be done here.
         pass
       elif overwrite_chooser.overwrite_mode in (cls.RENAME_NEW, cls.RENAME_EXISTING):
-        uniq_filename = libfiles.uniquify_filename(filename)
+        uniq_filename = libfiles.uniquify_filename(filename, directory_cache)
         if overwrite_chooser.overwrite_mode == cls.RENAME_NEW:
           filename = uniq_filename
-        else:
-          os.rename(filename, uniq_filename)
+        elif not dry_run:
+          cls._rename_existing_file(filename, uniq_filename, directory_cache)
+        elif directory_cache is not None:
+          directory_cache.add(uniq_filename)
       elif overwrite_chooser.overwrite_mode == cls.CANCEL:
         raise ExportLayersCancelError("cancelled")
     
     return should_skip, filename
+  
+  @classmethod
+  def _rename_existing_file(cls, filename, uniq_filename, directory_cache):
+    # The renamed file must never replace a file created by others in the
+    # meantime. In that case, the next unique filename is used.
+    while True:
+      try:
+        if directory_cache is not None:
+          directory_cache.rename(filename, uniq_filename)
+        else:
+          libfiles.rename_without_overwriting(filename, uniq_filename)
+      except OSError as e:
+        if e.errno != os.errno.EEXIST:
+          raise
+        if directory_cache is not None:
+          directory_cache.add(uniq_filename)
+        uniq_filename = libfiles.uniquify_filename(filename, directory_cache)
+      else:
+        break
 
 #===============================================================================
 
+class ExportManifest(object):
+  
+  """
+  This class stores fingerprints of files exported to a directory, allowing to
+  determine whether a file needs to be exported again.
+  
+  The manifest is stored as a JSON file in the directory. Files are identified
+  by their path relative to the directory.
+  
+  Attributes:
+  
+  * `directory` (read-only) - Directory containing the exported files and the
+    manifest file.
+  
+  * `filename` (read-only) - Full path to the manifest file.
+  
+  * `directory_cache` (read-only) - `libfiles.DirectoryCache` object to check
+    for existing files through. If None, the file system is queried directly.
+  """
+  
+  def __init__(self, directory, directory_cache=None):
+    self._directory = directory
+    self._directory_cache = directory_cache
+    self._filename = os.path.join(directory, constants.EXPORT_MANIFEST_FILENAME)
+    
+    # key: file path relative to `directory`
+    # value: fingerprint of the file contents (before it was exported)
+    self._fingerprints = {}
+  
+  @property
+  def directory(self):
+    return self._directory
+  
+  @property
+  def filename(self):
+    return self._filename
+  
+  @property
+  def directory_cache(self):
+    return self._directory_cache
+  
+  def load(self):
+    """
+    Load fingerprints from the manifest file. If the file does not exist or is
+    not a valid manifest file, start with an empty manifest.
+    """
+    
+    try:
+      with open(self._filename, 'r') as manifest_file:
+        fingerprints = json.load(manifest_file)
+    except (IOError, OSError, ValueError):
+      fingerprints = {}
+    
+    if not isinstance(fingerprints, dict):
+      fingerprints = {}
+    
+    self._fingerprints = fingerprints
+  
+  def save(self):
+    """
+    Save fingerprints to the manifest file.
+    
+    Raises:
+    
+    * `ExportLayersError` - Could not write to the manifest file.
+    """
+    
+    temp_filename = libfiles.get_temp_filename(self._filename)
+    try:
+      with open(temp_filename, 'w') as manifest_file:
+        json.dump(self._fingerprints, manifest_file, indent=1, sort_keys=True)
+      libfiles.replace_file(temp_filename, self._filename)
+    except (IOError, OSError):
+      if os.path.exists(temp_filename):
+        os.remove(temp_filename)
+      raise ExportLayersError(
+        _("Could not write export manifest to file \"{0}\".").format(self._filename)
+      )
+  
+  def is_up_to_date(self, filename, fingerprint):
+    """
+    Return True if the file exists and was exported from contents with the
+    specified fingerprint, otherwise return False.
+    """
+    
+    if self._fingerprints.get(self._get_key(filename)) != fingerprint:
+      return False
+    
+    if self._directory_cache is not None:
+      return self._directory_cache.exists(filename)
+    else:
+      return os.path.isfile(filename)
+  
+  def update(self, filename, fingerprint):
+    self._fingerprints[self._get_key(filename)] = fingerprint
+  
+  def remove(self, filename):
+    self._fingerprints.pop(self._get_key(filename), None)
+  
+  def _get_key(self, filename):
+    return os.path.relpath(filename, self._directory).replace(os.sep, '/')
+
+#===============================================================================
+
+class BackgroundLayerCache(object):
+  
+  """
+  This class caches merged background layers for the duration of the GIMP
+  session, so that subsequent exports from the same image do not have to merge
+  the background layers again if they did not change.
+  
+  Since each plug-in run is a separate process, the merged background layer is
+  stored in a separate image without a display, whose ID is stored in the GIMP
+  shelf. One background layer is cached per image. Cached layers for images that
+  are no longer opened are deleted.
+  """
+  
+  _SHELF_KEY = (constants.SHELF_PREFIX + "background_layer_cache").encode()
+  
+  def get(self, image, key):
+    """
+    Return the cached background layer for the specified image, or None if the
+    cache contains no layer for the image or the layer was cached under a
+    different key.
+    
+    The returned layer belongs to the cache and must not be modified.
+    """
+    
+    cache_entries = self._get_cache_entries()
+    
+    if image.ID in cache_entries:
+      cached_key, cache_image_id = cache_entries[image.ID]
+      if cached_key == key:
+        cache_image = self._get_image(cache_image_id)
+        if cache_image is not None and cache_image.layers:
+          return cache_image.layers[0]
+    
+    return None
+  
+  def set(self, image, key, background_layer):
+    """
+    Store a copy of the specified background layer for the specified image under
+    the specified key, replacing the previously cached layer for the image.
+    """
+    
+    cache_entries = self._get_cache_entries()
+    
+    if image.ID in cache_entries:
+      self._delete_cache_image(cache_entries[image.ID][1])
+    
+    cache_image = pdb.gimp_image_new(image.width, image.height, image.base_type)
+    pdb.gimp_image_undo_disable(cache_image)
+    
+    cached_layer = pdb.gimp_layer_new_from_drawable(background_layer, cache_image)
+    pdb.gimp_image_insert_layer(cache_image, cached_layer, None, 0)
+    
+    cache_entries[image.ID] = (key, cache_image.ID)
+    gimpshelf.shelf[self._SHELF_KEY] = cache_entries
+  
+  def _get_cache_entries(self):
+    """
+    Return a dict of cache entries, removing the entries (and deleting cached
+    layers) for images that are no longer opened.
+    
+    key: image ID
+    value: tuple (key, ID of the image containing the cached layer)
+    """
+    
+    try:
+      cache_entries = gimpshelf.shelf[self._SHELF_KEY]
+    except KeyError:
+      cache_entries = {}
+    
+    current_image_ids = set([image.ID for image in gimp.image_list()])
+    for image_id in list(cache_entries.keys()):
+      if image_id not in current_image_ids:
+        self._delete_cache_image(cache_entries[image_id][1])
+        del cache_entries[image_id]
+    
+    return cache_entries
+  
+  def _get_image(self, image_id):
+    for image in gimp.image_list():
+      if image.ID == image_id:
+        return image
+    return None
+  
+  def _delete_cache_image(self, cache_image_id):
+    cache_image = self._get_image(cache_image_id)
+    if cache_image is not None:
+      pdb.gimp_image_delete(cache_image)
+
+#===============================================================================
+
+class _LayerBulkFilterRules(object):
+  
+  """
+  Bulk rule functions for `LayerFilterRules`, evaluating rules for all layers
+  in an `itemdata.ItemDataColumns` object at once.
+  """
+  
+  @staticmethod
+  def is_item_type(columns, item_type):
+    return map(operator.eq, columns.item_types, [item_type] * len(columns))
+  
+  @staticmethod
+  def is_layer(columns):
+    return _LayerBulkFilterRules.is_item_type(columns, columns.ITEM)
+  
+  @staticmethod
+  def is_nonempty_group(columns):
+    return _LayerBulkFilterRules.is_item_type(columns, columns.NONEMPTY_GROUP)
+  
+  @staticmethod
+  def is_empty_group(columns):
+    return _LayerBulkFilterRules.is_item_type(columns, columns.EMPTY_GROUP)
+  
+  @staticmethod
+  def is_top_level(columns):
+    return map(operator.not_, columns.levels)
+  
+  @staticmethod
+  def is_path_visible(columns):
+    return columns.path_visible
+  
+  @staticmethod
+  def has_file_extension(columns):
+    return map(operator.contains, columns.names, ['.'] * len(columns))
+  
+  @staticmethod
+  def has_matching_file_extension(columns, file_extension):
+    return map(
+      operator.eq, columns.get_name_attribute_column(libfiles.get_file_extension),
+      [file_extension.lower()] * len(columns))
+  
+  @staticmethod
+  def is_enclosed_in_square_brackets(columns):
+    names = columns.names
+    return map(
+      operator.and_,
+      map(operator.methodcaller('startswith', "["), names),
+      map(operator.methodcaller('endswith', "]"), names))
+  
+  @staticmethod
+  def is_not_enclosed_in_square_brackets(columns):
+    return map(operator.not_, _LayerBulkFilterRules.is_enclosed_in_square_brackets(columns))
+
+
 class LayerFilterRules(object):
   
   @staticmethod
+  @objectfilter.bulk_rule(_LayerBulkFilterRules.is_layer)
   def is_layer(layer_elem):
     return layer_elem.item_type == layer_elem.ITEM
   
   @staticmethod
+  @objectfilter.bulk_rule(_LayerBulkFilterRules.is_nonempty_group)
   def is_nonempty_group(layer_elem):
     return layer_elem.item_type == layer_elem.NONEMPTY_GROUP
   
   @staticmethod
+  @objectfilter.bulk_rule(_LayerBulkFilterRules.is_empty_group)
   def is_empty_group(layer_elem):
     return layer_elem.item_type == layer_elem.EMPTY_GROUP
   
   @staticmethod
+  @objectfilter.bulk_rule(_LayerBulkFilterRules.is_top_level)
   def is_top_level(layer_elem):
     return layer_elem.level == 0
   
   @staticmethod
+  def has_top_level_children(layer_elem):
+    # Children of layer groups are never at the top level.
+    return False
+  
+  @staticmethod
+  @objectfilter.subtree_rule
+  @objectfilter.bulk_rule(_LayerBulkFilterRules.is_path_visible)
   def is_path_visible(layer_elem):
     return layer_elem.path_visible
   
+  # Rules depending on the layer name use values computed once per name, since
+  # the filter is applied to each layer multiple times during the export.
+  
   @staticmethod
+  @objectfilter.bulk_rule(_LayerBulkFilterRules.has_file_extension)
   def has_file_extension(layer_elem):
-    index_ = layer_elem.name.rfind('.')
-    return index_ != -1
+    return layer_elem.get_name_attribute(LayerFilterRules._has_period)
   
   @staticmethod
+  @objectfilter.bulk_rule(_LayerBulkFilterRules.has_matching_file_extension)
   def has_matching_file_extension(layer_elem, file_extension):
     return layer_elem.get_file_extension() == file_extension.lower()
   
   @staticmethod
+  @objectfilter.bulk_rule(_LayerBulkFilterRules.is_enclosed_in_square_brackets)
   def is_enclosed_in_square_brackets(layer_elem):
-    return layer_elem.name.startswith("[") and layer_elem.name.endswith("]")
+    return layer_elem.get_name_attribute(LayerFilterRules._is_enclosed_in_square_brackets)
   
   @staticmethod
+  @objectfilter.bulk_rule(_LayerBulkFilterRules.is_not_enclosed_in_square_brackets)
   def is_not_enclosed_in_square_brackets(layer_elem):
-    return not LayerFilterRules.is_enclosed_in_square_brackets(layer_elem)
+    return not layer_elem.get_name_attribute(LayerFilterRules._is_enclosed_in_square_brackets)
+  
+  @staticmethod
+  def _has_period(name):
+    return name.rfind('.') != -1
+  
+  @staticmethod
+  def _is_enclosed_in_square_brackets(name):
+    return name.startswith("[") and name.endswith("]")
+
+#===============================================================================
+
+class ExportJob(object):
+  
+  """
+  This class describes how a single layer is exported (or how a directory for
+  an empty layer group is created). Export jobs are created by `LayerExporter`
+  before any layer is processed.
+  
+  Attributes:
+  
+  * `layer_elem` (read-only) - `_ItemDataElement` object to export.
+  
+  * `operations` (read-only) - List of operations to perform on the copy of the
+    layer before saving it, in the order of their execution. Possible
+    operations:
+    
+    * `INSERT_BACKGROUND` - insert background layers into the image,
+    * `COPY_LAYER` - insert a copy of the layer into the image,
+    * `SHOW_LAYER` - make the copied layer visible,
+    * `MERGE_LAYER_GROUP` - merge the copied layer group into one layer,
+    * `SET_ACTIVE_LAYER` - make the copied layer the active layer,
+    * `IGNORE_LAYER_MODE` - set the layer mode to Normal,
+    * `RESIZE_IMAGE_TO_LAYERS` - resize the image canvas to fit all layers,
+    * `AUTOCROP` - autocrop the image to the layer,
+    * `AUTOCROP_LAYER` - autocrop the layer (the image canvas is not cropped),
+    * `AUTOCROP_BACKGROUND` - autocrop the background layer,
+    * `MERGE_BACKGROUND` - merge the layer with the background,
+    * `RESIZE_LAYER_TO_IMAGE` - resize the layer to the image size,
+    * `CREATE_DIRECTORY` - create the `output_filename` directory. No other
+      operations are performed and no file is saved.
+  
+  * `output_filename` - Full path of the file to save the layer to. For
+    `CREATE_DIRECTORY`, this is the path of the directory to create.
+  
+  * `file_extension` - File extension determining the file format.
+  
+  * `file_export_func` - PDB procedure to save the layer with. For
+    `CREATE_DIRECTORY`, this is None.
+  
+  * `overwrite_mode` - In a dry run (see `LayerExporter.dry_run`), the
+    overwrite mode the `OverwriteChooser` would apply (its current mode) if a
+    file with the same name as `output_filename` already exists. If there is no
+    conflict, this is None.
+  """
+  
+  __OPERATIONS = (
+    INSERT_BACKGROUND, COPY_LAYER, SHOW_LAYER, MERGE_LAYER_GROUP, SET_ACTIVE_LAYER,
+    IGNORE_LAYER_MODE, RESIZE_IMAGE_TO_LAYERS, AUTOCROP, AUTOCROP_LAYER,
+    AUTOCROP_BACKGROUND, MERGE_BACKGROUND, RESIZE_LAYER_TO_IMAGE, CREATE_DIRECTORY
+  ) = (
+    'insert_background', 'copy_layer', 'show_layer', 'merge_layer_group', 'set_active_layer',
+    'ignore_layer_mode', 'resize_image_to_layers', 'autocrop', 'autocrop_layer',
+    'autocrop_background', 'merge_background', 'resize_layer_to_image', 'create_directory'
+  )
+  
+  def __init__(self, layer_elem, operations, output_filename, file_extension=None,
+               file_export_func=None):
+    self._layer_elem = layer_elem
+    self._operations = operations
+    self.output_filename = output_filename
+    self.file_extension = file_extension
+    self.file_export_func = file_export_func
+    self.overwrite_mode = None
+  
+  @property
+  def layer_elem(self):
+    return self._layer_elem
+  
+  @property
+  def operations(self):
+    return self._operations
+  
+  def __repr__(self):
+    return "<ExportJob '{0}' {1}>".format(self.output_filename, self._operations)
 
 #===============================================================================
 
@@ -153,6 +558,10 @@ class LayerExporter(object):
   * exports layers as separate images
   * validates layer names
   
+  The export is performed in two phases. First, the main settings and the
+  filtered layers are compiled into a list of export jobs (`ExportJob`
+  instances) - the export plan. Then, the export plan is executed.
+  
   Attributes:
   
   * `initial_run_mode` - The run mode to use for the first layer exported.
@@ -176,6 +585,75 @@ class LayerExporter(object):
   
   * `exported_layers` - List of layers that were successfully exported. Includes
     layers which were skipped (when files with the same names already exist).
+  
+  * `export_plan` (read-only) - List of `ExportJob` instances created during the
+    last export.
+  
+  * `dry_run` - If True, only create the export plan and determine how
+    conflicting files would be handled, without processing the layers or
+    writing anything to disk. The results are available in `export_plan`.
+    Conflicts are resolved with the current overwrite mode of
+    `overwrite_chooser` without letting the user choose.
+  
+  * `incremental` - If True, skip layers that have not changed since they were
+    last exported to the output directory with the same settings. Skipped
+    layers are still regarded as exported. Fingerprints of exported layers are
+    stored in an `ExportManifest` in the output directory. The manifest is only
+    updated if the export finishes successfully.
+  
+  * `cache_background_layer` - If True, store the merged background layers in
+    a `BackgroundLayerCache` and reuse them in subsequent exports from the same
+    image in the current GIMP session as long as the background layers and the
+    settings affecting them do not change. Detecting changes requires reading
+    the pixel data of all background layers in each export, which only pays off
+    if merging the background layers is slower (e.g. for many large background
+    layers). The cached layer is kept in a hidden image until the original image
+    is closed. Disabled by default.
+  
+  * `profiler` - `profiling.Profiler` instance that records the wall time and
+    the number of calls of the export stages (category 'stages'), layer
+    operations (category 'operations') and PDB procedures (category 'pdb').
+    The profiler is reset at the beginning of each export. If
+    `profiler.record_per_item` is True, the statistics are also recorded per
+    layer (by the original layer name). If None, no profiling is performed.
+  
+  * `layer_assignments` - If not None, a dict of <layer tattoo, output
+    filename> pairs. Only layers whose tattoos are in the dict are exported,
+    to the assigned output filenames, and no directories for empty layer groups
+    are created. This allows multiple processes to export disjoint parts of
+    the same export plan (see the `farm` module). The assigned output filenames
+    are never changed - existing files are replaced (conflicts must be resolved
+    when assigning the filenames) and if a layer cannot be saved with its file
+    extension, `ExportLayersError` is raised instead of using the default file
+    extension.
+  
+  * `in_process_file_extensions` - List of file extensions whose files are
+    encoded in the plug-in process (see `encoders`) instead of being saved by
+    the GIMP file procedures. This avoids a PDB call and a file plug-in run for
+    each layer. No export dialog is displayed for these file formats and only
+    the options of the in-process encoders are used. Only the "png" and "data"
+    file extensions are supported, others are ignored. Indexed layers are always
+    saved by the GIMP file procedures.
+  
+  * `write_behind` - If True, files encoded in the plug-in process (see
+    `in_process_file_extensions`) are encoded and written in background threads
+    while the next layers are being processed. Errors while writing a file are
+    reported by raising `ExportLayersError` with the name of the layer when
+    processing one of the next layers or at the end of the export. The layer is
+    then removed from `exported_layers`. `ValueError` is raised on export if
+    `in_process_file_extensions` contains no supported file extension, since
+    write-behind would have no effect.
+  
+  * `lazy_layer_data` - If True, obtain the children of a layer group from the
+    image only when they are first needed, which avoids processing the contents
+    of layer groups that are not exported (see `itemdata.LayerData.is_lazy`).
+  
+  * `use_bulk_filtering` - If True, match all layers against the layer filters
+    at once instead of matching each layer separately (see
+    `itemdata.LayerData.use_bulk_filtering`).
+  
+  * `num_skipped_make_dirs_calls` (read-only) - Number of directory creations
+    skipped during the last export because the directories were known to exist.
   """
   
   __EXPORT_STATUSES = (
@@ -183,6 +661,17 @@ class LayerExporter(object):
     _USE_DEFAULT_FILE_EXTENSION
   ) = (0, 1, 2, 3)
   
+  # Encoders for file extensions whose files can be written in the plug-in
+  # process.
+  _IN_PROCESS_ENCODERS = {
+    'data': encoders.encode_raw,
+    'png': encoders.encode_png,
+  }
+  
+  WRITE_BEHIND_NUM_THREADS = 2
+  # Maximum number of rendered layers waiting to be written.
+  WRITE_BEHIND_MAX_QUEUED_WRITES = 4
+  
   class _LayerFileExtensionProperties(object):
     """
     This class contains additional data about a file extension. The file
@@ -202,63 +691,215 @@ class LayerExporter(object):
       self.is_valid = True
       self.processed_count = 0
   
-  def __init__(self, initial_run_mode, image, main_settings, overwrite_chooser, progress_updater):
+  def __init__(self, initial_run_mode, image, main_settings, overwrite_chooser, progress_updater,
+               dry_run=False, incremental=False, cache_background_layer=False, profiler=None,
+               layer_assignments=None, in_process_file_extensions=None, write_behind=False,
+               lazy_layer_data=True, use_bulk_filtering=True):
     
     self.initial_run_mode = initial_run_mode
     self.image = image
     self.main_settings = main_settings
     self.overwrite_chooser = overwrite_chooser
     self.progress_updater = progress_updater
+    self.dry_run = dry_run
+    self.incremental = incremental
+    self.cache_background_layer = cache_background_layer
+    self.profiler = profiler
+    self.layer_assignments = layer_assignments
+    self.in_process_file_extensions = (
+      in_process_file_extensions if in_process_file_extensions is not None else [])
+    self.write_behind = write_behind
+    self.lazy_layer_data = lazy_layer_data
+    self.use_bulk_filtering = use_bulk_filtering
+    
+    self._background_layer_cache = BackgroundLayerCache()
     
     self.should_stop = False
     self._exported_layers = []
+    self._export_plan = []
+    self._directory_creator = libfiles.DirectoryCreator()
     
-    # This dict cannot be initialized on the class level, because GIMP would
-    # prevent the plug-in from loading. PDB attributes or methods apparently
-    # can't be accessed when plug-in modules are being imported.
-    self._FILE_EXPORT_PROCEDURES = defaultdict(lambda: pdb.gimp_file_save)
-    # Raw format doesn't seem to work with `pdb.gimp_file_save`, hence the
-    # special handling.
-    self._FILE_EXPORT_PROCEDURES['data'] = pdb.file_raw_save
+    self._OPERATION_FUNCS = {
+      ExportJob.INSERT_BACKGROUND: self._insert_background,
+      ExportJob.COPY_LAYER: self._copy_layer,
+      ExportJob.SHOW_LAYER: self._show_layer,
+      ExportJob.MERGE_LAYER_GROUP: self._merge_layer_group,
+      ExportJob.SET_ACTIVE_LAYER: self._set_active_layer,
+      ExportJob.IGNORE_LAYER_MODE: self._ignore_layer_mode,
+      ExportJob.RESIZE_IMAGE_TO_LAYERS: self._resize_image_to_layers,
+      ExportJob.AUTOCROP: self._autocrop,
+      ExportJob.AUTOCROP_LAYER: self._autocrop_layer,
+      ExportJob.AUTOCROP_BACKGROUND: self._autocrop_background,
+      ExportJob.MERGE_BACKGROUND: self._merge_background,
+      ExportJob.RESIZE_LAYER_TO_IMAGE: self._resize_layer_to_image,
+    }
   
   @property
   def exported_layers(self):
     return self._exported_layers
   
+  @property
+  def export_plan(self):
+    return self._export_plan
+  
+  @property
+  def num_skipped_make_dirs_calls(self):
+    return self._directory_creator.num_avoided_calls
+  
   def export_layers(self):
     """
     Export layers as separate images from the specified image.
+    
+    If `dry_run` is True, only create the export plan (see `export_plan`).
     """
     
+    if self.profiler is None:
+      self._export_layers_main()
+    else:
+      self._export_layers_profiled()
+  
+  def _export_layers_main(self):
     self._init_attributes()
     self._set_layer_filters()
+    self._export_plan = self._create_export_plan()
+    if self.layer_assignments is not None:
+      self._export_plan = self._get_assigned_export_plan()
+    
+    if self.dry_run:
+      self._handle_overwrites_dry_run()
+      return
+    
+    if self.incremental:
+      self._export_manifest = ExportManifest(self._output_directory, self._directory_cache)
+      self._export_manifest.load()
     
     self._setup()
     try:
+      if self.write_behind:
+        self._write_behind_queue = writebehind.WriteBehindQueue(
+          self.WRITE_BEHIND_NUM_THREADS, self.WRITE_BEHIND_MAX_QUEUED_WRITES)
+      
       self._export_layers()
+      self._finish_writes()
     finally:
+      self._close_write_behind_queue()
       self._cleanup()
+    
+    # The manifest is not saved if the export failed, so that an error while
+    # saving it does not hide the original error. Layers are then exported
+    # again in the next export.
+    if self._export_manifest is not None:
+      self._export_manifest.save()
+  
+  def _export_layers_profiled(self):
+    """
+    Perform the export with the stages, layer operations and PDB procedures
+    wrapped to be recorded by `profiler`. The wrappers are only installed for
+    the duration of the export so that exports without a profiler are not
+    slowed down.
+    """
+    
+    profiler = self.profiler
+    profiler.reset()
+    
+    def _wrap_stage(name, sets_current_item=False):
+      func = profiler.wrap('stages', name, getattr(self, name))
+      if sets_current_item:
+        def _set_current_item_and_call(job, *args, **kwargs):
+          profiler.current_item = job.layer_elem.orig_name
+          return func(job, *args, **kwargs)
+        
+        setattr(self, name, _set_current_item_and_call)
+      else:
+        setattr(self, name, func)
+    
+    stage_names = [
+      '_init_attributes', '_set_layer_filters', '_create_export_plan',
+      '_handle_overwrites_dry_run', '_setup', '_cleanup']
+    job_stage_names = ['_get_job_fingerprint', '_process_layer', '_export_layer']
+    
+    orig_operation_funcs = self._OPERATION_FUNCS
+    
+    modules = [sys.modules[__name__], pylibgimp, itemdata]
+    
+    with profiling.profile_pdb(profiler, modules):
+      try:
+        for name in stage_names:
+          _wrap_stage(name)
+        for name in job_stage_names:
+          _wrap_stage(name, sets_current_item=True)
+        
+        self._OPERATION_FUNCS = {
+          operation: profiler.wrap('operations', operation, func)
+          for operation, func in orig_operation_funcs.items()}
+        
+        with profiler.stage('stages', 'export_layers'):
+          self._export_layers_main()
+      finally:
+        for name in stage_names + job_stage_names:
+          delattr(self, name)
+        self._OPERATION_FUNCS = orig_operation_funcs
+        profiler.current_item = None
   
   def _init_attributes(self):
     self.should_stop = False
     
     self._exported_layers = []
+    self._export_plan = []
     
     self._output_directory = self.main_settings['output_directory'].value
     self._default_file_extension = self.main_settings['file_extension'].value
     self._include_item_path = self.main_settings['layer_groups_as_directories'].value
+    self._use_image_size = self.main_settings['use_image_size'].value
+    self._ignore_layer_modes = self.main_settings['ignore_layer_modes'].value
+    self._autocrop_enabled = self.main_settings['autocrop'].value
+    self._crop_to_background = self.main_settings['crop_to_background'].value
     
     self._image_copy = None
-    self._layer_data = itemdata.LayerData(self.image, is_filtered=True)
+    self._layer_data = itemdata.LayerData(
+      self.image, is_filtered=True, is_lazy=self.lazy_layer_data,
+      use_bulk_filtering=self.use_bulk_filtering)
     self._background_layer_elems = []
     # Layer containing all background layers merged into one. This layer is not
     # inserted into the image, but rather its copies (for each layer to be exported).
     self._background_layer = None
     
+    # Layers in `self._image_copy` that the operations of the current export
+    # job are performed on.
+    self._current_layer_copy = None
+    self._current_background_layer = None
+    
+    self._export_manifest = None
+    self._background_fingerprint = None
+    self._write_behind_queue = None
+    
+    self._in_process_encoders = {}
+    for file_extension in self.in_process_file_extensions:
+      file_extension = file_extension.lstrip('.').lower()
+      if file_extension in self._IN_PROCESS_ENCODERS:
+        self._in_process_encoders[file_extension] = self._IN_PROCESS_ENCODERS[file_extension]
+    
+    if self.write_behind and not self._in_process_encoders:
+      raise ValueError(
+        "write-behind requires in-process file extensions, supported extensions: {0}".format(
+          ", ".join(sorted(self._IN_PROCESS_ENCODERS))))
+    
+    # Existence checks of output files go through this cache so that each
+    # output directory is listed only once per export.
+    self._directory_cache = libfiles.DirectoryCache()
+    self._directory_creator = libfiles.DirectoryCreator()
+    
     if self.progress_updater is None:
       self.progress_updater = progress.ProgressUpdater(None)
     self.progress_updater.reset()
     
+    # This dict cannot be initialized on the class level, because GIMP would
+    # prevent the plug-in from loading. PDB attributes or methods apparently
+    # can't be accessed when plug-in modules are being imported. The dict is
+    # created for each export so that the export procedures are obtained from
+    # the current `pdb` (which may be replaced, e.g. by a tracing proxy).
+    self._FILE_EXPORT_PROCEDURES = self._get_file_export_procedures()
+    
     self._layer_file_extension_properties = defaultdict(self._LayerFileExtensionProperties)
     self._default_file_extension = self._default_file_extension.lstrip('.').lower()
     self._current_file_extension = self._default_file_extension
@@ -282,6 +923,7 @@ class LayerExporter(object):
     
     if self.main_settings['merge_layer_groups'].value:
       self._layer_data.filter.add_rule(LayerFilterRules.is_top_level)
+      self._layer_data.group_filter.add_rule(LayerFilterRules.has_top_level_children)
       self._layer_data.filter['layer_types'].add_rule(LayerFilterRules.is_nonempty_group)
     
     if self.main_settings['ignore_invisible'].value:
@@ -319,47 +961,265 @@ class LayerExporter(object):
         self.main_settings['file_ext_mode'].options['only_matching_file_extension']):
       self._layer_data.filter.add_rule(LayerFilterRules.has_matching_file_extension, self._default_file_extension)
   
-  def _export_layers(self):
-    with self._layer_data.filter['layer_types'].remove_rule_temp(LayerFilterRules.is_empty_group,
-                                                                 raise_if_not_found=False):
-      self.progress_updater.num_total_tasks = len(self._layer_data)
+  def _create_export_plan(self):
+    """
+    Create a list of export jobs from the filtered layers and the main settings.
+    
+    Layer names are validated and made unique, and output filenames are
+    determined. No PDB procedure is called and no file is written.
+    """
+    
+    if self._use_image_size:
+      # Remove background layers outside the image canvas, since they wouldn't
+      # be visible anyway and because we need to avoid `RuntimeError`
+      # when `pdb.gimp_image_merge_visible_layers` with the `CLIP_TO_IMAGE`
+      # option tries to merge layers that are all outside the image canvas.
+      self._background_layer_elems = [
+        bg_elem for bg_elem in self._background_layer_elems
+        if pylibgimp.is_layer_inside_image(self.image, bg_elem.item)
+      ]
     
-    libfiles.make_dirs(self._output_directory)
+    layer_operations = self._get_layer_operations(has_background=bool(self._background_layer_elems))
+    
+    export_plan = []
     
     for layer_elem in self._layer_data:
-      if self.should_stop:
-        raise ExportLayersCancelError("export stopped by user")
-      
       if layer_elem.item_type in (layer_elem.ITEM, layer_elem.NONEMPTY_GROUP):
-        layer = layer_elem.item
-        layer_copy = self._process_layer(layer)
-        
         layer_elem.validate_name()
         self._strip_file_extension(layer_elem)
         self._set_file_extension_and_update_file_export_func(layer_elem)
         self._layer_data.uniquify_name(layer_elem, self._include_item_path,
                                        place_before_file_extension=True)
         
-        self._export_layer(layer_elem, self._image_copy, layer_copy)
+        operations = list(layer_operations)
+        copy_layer_index = operations.index(ExportJob.COPY_LAYER)
+        if layer_elem.item_type == layer_elem.NONEMPTY_GROUP:
+          operations.insert(copy_layer_index + 1, ExportJob.MERGE_LAYER_GROUP)
+        if not layer_elem.path_visible:
+          # This is necessary for file formats which flatten the image (such as JPG).
+          # Layer copies retain the visibility of the original layer, hence
+          # visible layers do not need to be shown. Layer groups are shown before
+          # merging, since the merged layer retains the visibility of the group.
+          operations.insert(copy_layer_index + 1, ExportJob.SHOW_LAYER)
+        
+        export_plan.append(
+          ExportJob(layer_elem, operations,
+                    layer_elem.get_filepath(self._output_directory, self._include_item_path),
+                    self._current_file_extension, self._file_export_func)
+        )
+      else:
+        layer_elem.validate_name()
+        self._layer_data.uniquify_name(layer_elem, self._include_item_path,
+                                       place_before_file_extension=False)
+        export_plan.append(
+          ExportJob(layer_elem, [ExportJob.CREATE_DIRECTORY],
+                    layer_elem.get_filepath(self._output_directory, self._include_item_path))
+        )
+    
+    self._current_file_extension = self._default_file_extension
+    self._file_export_func = self._get_file_export_func(self._default_file_extension)
+    
+    return export_plan
+  
+  def _get_assigned_export_plan(self):
+    export_plan = []
+    for job in self._export_plan:
+      if ExportJob.CREATE_DIRECTORY in job.operations:
+        continue
+      
+      tattoo = job.layer_elem.item.tattoo
+      if tattoo in self.layer_assignments:
+        job.output_filename = self.layer_assignments[tattoo]
+        export_plan.append(job)
+    
+    return export_plan
+  
+  def _get_layer_operations(self, has_background):
+    """
+    Return the list of operations to perform on each layer (except merging
+    layer groups, which depends on the layer) according to the main settings.
+    """
+    
+    operations = []
+    
+    if has_background:
+      operations.append(ExportJob.INSERT_BACKGROUND)
+    
+    operations.append(ExportJob.COPY_LAYER)
+    
+    if self._ignore_layer_modes:
+      operations.append(ExportJob.IGNORE_LAYER_MODE)
+    
+    if not self._use_image_size:
+      operations.append(ExportJob.RESIZE_IMAGE_TO_LAYERS)
+      if self._crop_to_background:
+        if has_background:
+          operations.append(ExportJob.MERGE_BACKGROUND)
+        if self._autocrop_enabled:
+          operations.extend([ExportJob.SET_ACTIVE_LAYER, ExportJob.AUTOCROP])
+      else:
+        if self._autocrop_enabled:
+          operations.extend([ExportJob.SET_ACTIVE_LAYER, ExportJob.AUTOCROP])
+        if has_background:
+          operations.append(ExportJob.MERGE_BACKGROUND)
+    else:
+      if self._crop_to_background and has_background:
+        if self._autocrop_enabled:
+          operations.append(ExportJob.AUTOCROP_BACKGROUND)
+      else:
+        if self._autocrop_enabled:
+          operations.extend([ExportJob.SET_ACTIVE_LAYER, ExportJob.AUTOCROP_LAYER])
+      
+      if has_background:
+        operations.append(ExportJob.MERGE_BACKGROUND)
+      
+      operations.append(ExportJob.RESIZE_LAYER_TO_IMAGE)
+    
+    return operations
+  
+  def _export_layers(self):
+    self.progress_updater.num_total_tasks = len(
+      [job for job in self._export_plan if ExportJob.CREATE_DIRECTORY not in job.operations])
+    
+    # Create the whole output directory tree at once rather than one directory
+    # per exported layer.
+    self._directory_creator.make_all_dirs(
+      [self._output_directory] +
+      [job.output_filename if ExportJob.CREATE_DIRECTORY in job.operations
+       else os.path.dirname(job.output_filename) for job in self._export_plan])
+    
+    for job in self._export_plan:
+      if self.should_stop:
+        raise ExportLayersCancelError("export stopped by user")
+      
+      if ExportJob.CREATE_DIRECTORY not in job.operations:
+        layer_elem = job.layer_elem
+        
+        if not self._layer_file_extension_properties[job.file_extension].is_valid:
+          # The file extension was found invalid after the export plan had been
+          # created.
+          self._update_job_file_extension(job)
+        
+        self._current_file_extension = job.file_extension
+        self._file_export_func = job.file_export_func
+        
+        fingerprint = None
+        if self._export_manifest is not None:
+          fingerprint = self._get_job_fingerprint(job)
+          if self._export_manifest.is_up_to_date(job.output_filename, fingerprint):
+            self.progress_updater.update_tasks(1)
+            self._exported_layers.append(layer_elem.item)
+            continue
+        
+        layer_copy = self._process_layer(job)
+        
+        self._export_layer(job, self._image_copy, layer_copy)
         if self._current_layer_export_status == self._USE_DEFAULT_FILE_EXTENSION:
-          self._set_file_extension_and_update_file_export_func(layer_elem)
-          self._layer_data.uniquify_name(layer_elem, self._include_item_path,
-                                         place_before_file_extension=True)
-          self._export_layer(layer_elem, self._image_copy, layer_copy)
+          self._update_job_file_extension(job)
+          self._export_layer(job, self._image_copy, layer_copy)
         
         self.progress_updater.update_tasks(1)
         if not self._is_current_layer_skipped:
           # Append the original layer, not the copy, since the copy is going to
           # be destroyed.
-          self._exported_layers.append(layer)
+          self._exported_layers.append(layer_elem.item)
           self._layer_file_extension_properties[self._current_file_extension].processed_count += 1
+          if self._export_manifest is not None:
+            self._export_manifest.update(job.output_filename, fingerprint)
         pdb.gimp_image_remove_layer(self._image_copy, layer_copy)
       else:
-        layer_elem.validate_name()
-        self._layer_data.uniquify_name(layer_elem, self._include_item_path,
-                                       place_before_file_extension=False)
-        empty_directory = layer_elem.get_filepath(self._output_directory, self._include_item_path)
-        libfiles.make_dirs(empty_directory)
+        self._directory_creator.make_dirs(job.output_filename)
+  
+  def _handle_overwrites_dry_run(self):
+    # An interactive chooser must not prompt the user during a dry run.
+    overwrite_chooser = overwrite.NoninteractiveOverwriteChooser(
+      self.overwrite_chooser.overwrite_mode)
+    
+    for job in self._export_plan:
+      if ExportJob.CREATE_DIRECTORY not in job.operations:
+        should_skip = False
+        if self._directory_cache.exists(job.output_filename):
+          should_skip, job.output_filename = OverwriteHandler.handle(
+            job.output_filename, overwrite_chooser, dry_run=True,
+            directory_cache=self._directory_cache)
+          job.overwrite_mode = overwrite_chooser.overwrite_mode
+        
+        # Record the file as if it was exported so that conflicts with files
+        # exported later are predicted as in the real export.
+        if not should_skip:
+          self._directory_cache.add(job.output_filename)
+  
+  def _get_job_fingerprint(self, job):
+    """
+    Return a hexadecimal digest of everything the file exported by the specified
+    export job depends on - the layer, the background layers, the operations,
+    the file extension, the encoder and its options and the image size.
+    """
+    
+    fingerprint_components = [
+      pylibgimp.get_layer_fingerprint(job.layer_elem.item),
+      ",".join(job.operations),
+      job.file_extension,
+      self._get_job_encoder(job),
+      str((self.image.width, self.image.height)),
+    ]
+    
+    if ExportJob.INSERT_BACKGROUND in job.operations:
+      fingerprint_components.append(self._get_background_fingerprint())
+    
+    return hashlib.sha1(" ".join(fingerprint_components).encode('utf-8')).hexdigest()
+  
+  def _get_job_encoder(self, job):
+    """
+    Return a string identifying how the file of the specified export job is
+    written - the in-process encoder or the GIMP file procedure. The options of
+    a file procedure cannot be obtained, hence the initial run mode is included
+    as it determines whether the user can change the options.
+    """
+    
+    if job.file_extension in self._in_process_encoders and not job.layer_elem.item.is_indexed:
+      return "in-process:" + self._in_process_encoders[job.file_extension].__name__
+    else:
+      return "pdb:" + str(self.initial_run_mode)
+  
+  def _get_background_fingerprint(self):
+    if self._background_fingerprint is None:
+      self._background_fingerprint = ",".join(
+        pylibgimp.get_layer_fingerprint(bg_elem.item) for bg_elem in self._background_layer_elems)
+    
+    return self._background_fingerprint
+  
+  def _get_background_layer_cache_key(self):
+    return hashlib.sha1(
+      " ".join([
+        self._get_background_fingerprint(),
+        str((self._use_image_size, self._ignore_layer_modes, self.image.width, self.image.height))
+      ]).encode('utf-8')
+    ).hexdigest()
+  
+  def _update_job_file_extension(self, job):
+    if self.layer_assignments is not None:
+      raise ExportLayersError(
+        _("Could not export \"{0}\" with the file extension \"{1}\".").format(
+          job.output_filename, job.file_extension))
+    
+    # The name already counts as uniquified with the original file extension.
+    # Without removing it first, the name with the new file extension would not
+    # be uniquified again and could be identical to the name of another layer.
+    self._layer_data.remove_uniquified_name(job.layer_elem)
+    self._set_file_extension_and_update_file_export_func(job.layer_elem)
+    self._layer_data.uniquify_name(
+      job.layer_elem, self._include_item_path, place_before_file_extension=True,
+      reserved_names=self._get_planned_output_names(job))
+    job.output_filename = job.layer_elem.get_filepath(self._output_directory, self._include_item_path)
+    job.file_extension = self._current_file_extension
+    job.file_export_func = self._file_export_func
+  
+  def _get_planned_output_names(self, job):
+    output_dirname = os.path.dirname(job.output_filename)
+    return [
+      os.path.basename(other_job.output_filename) for other_job in self._export_plan
+      if other_job is not job and os.path.dirname(other_job.output_filename) == output_dirname]
   
   def _setup(self):
     # Save context just in case. No need for undo groups or undo freeze here.
@@ -367,6 +1227,9 @@ class LayerExporter(object):
     # Perform subsequent operations on a new image so that the original image
     # and its soon-to-be exported layers are left intact.
     self._image_copy = pylibgimp.duplicate(self.image, remove_items=True)
+    # Layers are repeatedly inserted into and removed from the image copy. Undo
+    # history is not needed and would only slow down the processing.
+    pdb.gimp_image_undo_disable(self._image_copy)
     
     if constants.DEBUG_IMAGE_PROCESSING:
       self._display_id = pdb.gimp_display_new(self._image_copy)
@@ -389,93 +1252,88 @@ class LayerExporter(object):
   def _add_square_brackets(self, layer_elem):
     layer_elem.name = "[" + layer_elem.name + "]"
   
-  def _process_layer(self, layer):
-    background_layer = self._insert_background()
-    
-    layer_copy = pdb.gimp_layer_new_from_drawable(layer, self._image_copy)
-    pdb.gimp_image_insert_layer(self._image_copy, layer_copy, None, 0)
-    # This is necessary for file formats which flatten the image (such as JPG).
-    pdb.gimp_item_set_visible(layer_copy, True)
-    if pdb.gimp_item_is_group(layer_copy):
-      layer_copy = pylibgimp.merge_layer_group(self._image_copy, layer_copy)
-    
-    if self.main_settings['ignore_layer_modes'].value:
-      layer_copy.mode = gimpenums.NORMAL_MODE
-    
-    self._image_copy.active_layer = layer_copy
-    
-    layer_copy = self._crop_and_merge(layer_copy, background_layer)
-    
-    return layer_copy
-  
-  def _insert_background(self):
-    if self._background_layer_elems:
-      if self._background_layer is None:
-        if self.main_settings['use_image_size'].value:
-          # Remove background layers outside the image canvas, since they wouldn't
-          # be visible anyway and because we need to avoid `RuntimeError`
-          # when `pdb.gimp_image_merge_visible_layers` with the `CLIP_TO_IMAGE`
-          # option tries to merge layers that are all outside the image canvas.
-          self._background_layer_elems = [
-            bg_elem for bg_elem in self._background_layer_elems
-            if pylibgimp.is_layer_inside_image(self._image_copy, bg_elem.item)
-          ]
-          
-          if not self._background_layer_elems:
-            return
-        
-        for i, bg_elem in enumerate(self._background_layer_elems):
-          bg_layer_copy = pdb.gimp_layer_new_from_drawable(bg_elem.item, self._image_copy)
-          pdb.gimp_image_insert_layer(self._image_copy, bg_layer_copy, None, i)
-          pdb.gimp_item_set_visible(bg_layer_copy, True)
-          if self.main_settings['ignore_layer_modes'].value:
-            bg_layer_copy.mode = gimpenums.NORMAL_MODE
-          if pdb.gimp_item_is_group(bg_layer_copy):
-            bg_layer_copy = pylibgimp.merge_layer_group(self._image_copy, bg_layer_copy)
-        
-        if self.main_settings['use_image_size'].value:
-          background_layer = pdb.gimp_image_merge_visible_layers(self._image_copy, gimpenums.CLIP_TO_IMAGE)
-        else:
-          background_layer = pdb.gimp_image_merge_visible_layers(self._image_copy, gimpenums.EXPAND_AS_NECESSARY)
-        
-        self._background_layer = pdb.gimp_layer_copy(background_layer, True)
-        return background_layer
-      else:
-        background_layer_copy = pdb.gimp_layer_copy(self._background_layer, True)
-        pdb.gimp_image_insert_layer(self._image_copy, background_layer_copy, None, 0)
-        return background_layer_copy
+  def _process_layer(self, job):
+    """
+    Perform the operations of the export job and return the resulting layer,
+    inserted in `self._image_copy`.
+    """
     
-    return None
+    self._current_layer_copy = None
+    self._current_background_layer = None
+    
+    for operation in job.operations:
+      self._OPERATION_FUNCS[operation](job.layer_elem)
+    
+    return self._current_layer_copy
   
-  def _crop_and_merge(self, layer, background_layer):
-    if not self.main_settings['use_image_size'].value:
-      pdb.gimp_image_resize_to_layers(self._image_copy)
-      if self.main_settings['crop_to_background'].value:
-        if background_layer is not None:
-          layer = pdb.gimp_image_merge_visible_layers(self._image_copy, gimpenums.CLIP_TO_IMAGE)
-        if self.main_settings['autocrop'].value:
-          pdb.plug_in_autocrop(self._image_copy, layer)
-      else:
-        if self.main_settings['autocrop'].value:
-          pdb.plug_in_autocrop(self._image_copy, layer)
-        if background_layer is not None:
-          layer = pdb.gimp_image_merge_visible_layers(self._image_copy, gimpenums.CLIP_TO_IMAGE)
-    else:
-      if self.main_settings['crop_to_background'].value and background_layer is not None:
-        if self.main_settings['autocrop'].value:
-          self._image_copy.active_layer = background_layer
-          pdb.plug_in_autocrop_layer(self._image_copy, background_layer)
-          self._image_copy.active_layer = layer
+  def _insert_background(self, layer_elem):
+    if self._background_layer is None and self.cache_background_layer:
+      cached_background_layer = self._background_layer_cache.get(
+        self.image, self._get_background_layer_cache_key())
+      if cached_background_layer is not None:
+        self._background_layer = pdb.gimp_layer_new_from_drawable(cached_background_layer, self._image_copy)
+    
+    if self._background_layer is None:
+      for i, bg_elem in enumerate(self._background_layer_elems):
+        bg_layer_copy = pdb.gimp_layer_new_from_drawable(bg_elem.item, self._image_copy)
+        pdb.gimp_image_insert_layer(self._image_copy, bg_layer_copy, None, i)
+        pdb.gimp_item_set_visible(bg_layer_copy, True)
+        if self._ignore_layer_modes:
+          bg_layer_copy.mode = gimpenums.NORMAL_MODE
+        if pdb.gimp_item_is_group(bg_layer_copy):
+          bg_layer_copy = pylibgimp.merge_layer_group(self._image_copy, bg_layer_copy)
+      
+      if self._use_image_size:
+        background_layer = pdb.gimp_image_merge_visible_layers(self._image_copy, gimpenums.CLIP_TO_IMAGE)
       else:
-        if self.main_settings['autocrop'].value:
-          pdb.plug_in_autocrop_layer(self._image_copy, layer)
+        background_layer = pdb.gimp_image_merge_visible_layers(self._image_copy, gimpenums.EXPAND_AS_NECESSARY)
       
-      if background_layer is not None:
-        layer = pdb.gimp_image_merge_visible_layers(self._image_copy, gimpenums.CLIP_TO_IMAGE)
+      self._background_layer = pdb.gimp_layer_copy(background_layer, True)
+      self._current_background_layer = background_layer
       
-      pdb.gimp_layer_resize_to_image_size(layer)
-    
-    return layer
+      if self.cache_background_layer:
+        self._background_layer_cache.set(
+          self.image, self._get_background_layer_cache_key(), background_layer)
+    else:
+      background_layer_copy = pdb.gimp_layer_copy(self._background_layer, True)
+      pdb.gimp_image_insert_layer(self._image_copy, background_layer_copy, None, 0)
+      self._current_background_layer = background_layer_copy
+  
+  def _copy_layer(self, layer_elem):
+    self._current_layer_copy = pdb.gimp_layer_new_from_drawable(layer_elem.item, self._image_copy)
+    pdb.gimp_image_insert_layer(self._image_copy, self._current_layer_copy, None, 0)
+  
+  def _show_layer(self, layer_elem):
+    pdb.gimp_item_set_visible(self._current_layer_copy, True)
+  
+  def _merge_layer_group(self, layer_elem):
+    self._current_layer_copy = pylibgimp.merge_layer_group(self._image_copy, self._current_layer_copy)
+  
+  def _set_active_layer(self, layer_elem):
+    self._image_copy.active_layer = self._current_layer_copy
+  
+  def _ignore_layer_mode(self, layer_elem):
+    self._current_layer_copy.mode = gimpenums.NORMAL_MODE
+  
+  def _resize_image_to_layers(self, layer_elem):
+    pdb.gimp_image_resize_to_layers(self._image_copy)
+  
+  def _autocrop(self, layer_elem):
+    pdb.plug_in_autocrop(self._image_copy, self._current_layer_copy)
+  
+  def _autocrop_layer(self, layer_elem):
+    pdb.plug_in_autocrop_layer(self._image_copy, self._current_layer_copy)
+  
+  def _autocrop_background(self, layer_elem):
+    self._image_copy.active_layer = self._current_background_layer
+    pdb.plug_in_autocrop_layer(self._image_copy, self._current_background_layer)
+    self._image_copy.active_layer = self._current_layer_copy
+  
+  def _merge_background(self, layer_elem):
+    self._current_layer_copy = pdb.gimp_image_merge_visible_layers(self._image_copy, gimpenums.CLIP_TO_IMAGE)
+  
+  def _resize_layer_to_image(self, layer_elem):
+    pdb.gimp_layer_resize_to_image_size(self._current_layer_copy)
   
   def _strip_file_extension(self, layer_elem):
     if self.main_settings['strip_mode'].value in (
@@ -501,12 +1359,19 @@ class LayerExporter(object):
         self._current_file_extension = self._default_file_extension
       
       self._file_export_func = self._get_file_export_func(self._current_file_extension)
-      
+    
     elif (self.main_settings['file_ext_mode'].value ==
           self.main_settings['file_ext_mode'].options['no_special_handling']):
       
       layer_elem.name += '.' + self._default_file_extension
   
+  def _get_file_export_procedures(self):
+    file_export_procedures = defaultdict(lambda: pdb.gimp_file_save)
+    # Raw format doesn't seem to work with `pdb.gimp_file_save`, hence the
+    # special handling.
+    file_export_procedures['data'] = pdb.file_raw_save
+    return file_export_procedures
+  
   def _get_file_export_func(self, file_extension):
     return self._FILE_EXPORT_PROCEDURES[file_extension]
   
@@ -519,17 +1384,24 @@ class LayerExporter(object):
     else:
       return self.initial_run_mode
   
-  def _export_layer(self, layer_elem, image, layer):
-    output_filename = layer_elem.get_filepath(self._output_directory, self._include_item_path)
-    self._is_current_layer_skipped, output_filename = OverwriteHandler.handle(output_filename, self.overwrite_chooser)
-    self.progress_updater.update_text(_("Saving '{0}'").format(output_filename))
+  def _export_layer(self, job, image, layer):
+    if self.layer_assignments is None:
+      self._is_current_layer_skipped, job.output_filename = OverwriteHandler.handle(
+        job.output_filename, self.overwrite_chooser, directory_cache=self._directory_cache)
+    else:
+      self._is_current_layer_skipped = False
+    self.progress_updater.update_text(_("Saving '{0}'").format(job.output_filename))
     
     if not self._is_current_layer_skipped:
-      self._export(image, layer, output_filename)
+      self._export(job.layer_elem, image, layer, job.output_filename)
   
-  def _export(self, image, layer, output_filename):
+  def _export(self, layer_elem, image, layer, output_filename):
     run_mode = self._get_run_mode()
-    libfiles.make_dirs(os.path.dirname(output_filename))
+    self._directory_creator.make_dirs(os.path.dirname(output_filename))
+    
+    if self._can_export_in_process(layer):
+      self._export_in_process(layer_elem, layer, output_filename)
+      return
     
     self._export_once(run_mode, image, layer, output_filename)
     
@@ -539,11 +1411,17 @@ class LayerExporter(object):
   def _export_once(self, run_mode, image, layer, output_filename):
     self._current_layer_export_status = self._NOT_EXPORTED_YET
     
+    # The file is saved under a temporary name and renamed once complete, so
+    # that a partially saved file never appears under the output filename.
+    temp_filename = libfiles.get_temp_filename(output_filename, self._current_file_extension)
+    
     try:
-      self._file_export_func(image, layer, output_filename.encode(),
+      self._file_export_func(image, layer, temp_filename.encode(),
                              os.path.basename(output_filename).encode(),
                              run_mode=run_mode)
     except RuntimeError as e:
+      self._remove_temp_file(temp_filename)
+      
       # HACK: Since `RuntimeError` could indicate anything, including
       # `pdb.gimp_file_save` failure, this is the only way to intercept the
       # "cancel" operation.
@@ -566,4 +1444,283 @@ class LayerExporter(object):
               error_message += '.'
             raise ExportLayersError(error_message)
     else:
+      self._rename_temp_file(temp_filename, output_filename)
       self._current_layer_export_status = self._EXPORT_SUCCESSFUL
+      self._directory_cache.add(output_filename)
+  
+  def _rename_temp_file(self, temp_filename, output_filename):
+    try:
+      libfiles.replace_file(temp_filename, output_filename)
+    except OSError as e:
+      self._remove_temp_file(temp_filename)
+      if e.errno == os.errno.ENOENT:
+        # The file procedure reported success without creating any file.
+        reason = _("The file procedure did not create the file")
+      else:
+        reason = e
+      raise ExportLayersError(
+        self._get_write_error_message(self._current_file_extension, output_filename, reason))
+  
+  def _remove_temp_file(self, temp_filename):
+    if os.path.exists(temp_filename):
+      os.remove(temp_filename)
+  
+  def _can_export_in_process(self, layer):
+    return self._current_file_extension in self._in_process_encoders and not layer.is_indexed
+  
+  def _export_in_process(self, layer_elem, layer, output_filename):
+    """
+    Read the pixel data of the layer once and encode and write the file in the
+    plug-in process. If the write-behind queue is used, let the queue encode and
+    write the file and report errors of writes finished in the meantime.
+    """
+    
+    file_extension = self._current_file_extension
+    write_args = (
+      output_filename, self._in_process_encoders[file_extension],
+      pylibgimp.get_pixel_data(layer), layer.width, layer.height, layer.bpp)
+    
+    if self._write_behind_queue is not None:
+      self._handle_finished_writes()
+      self._write_behind_queue.put(
+        (layer_elem, output_filename, file_extension), encoders.write_image_file, *write_args)
+    else:
+      try:
+        encoders.write_image_file(*write_args)
+      except EnvironmentError as e:
+        raise ExportLayersError(self._get_write_error_message(file_extension, output_filename, e))
+    
+    self._current_layer_export_status = self._EXPORT_SUCCESSFUL
+    self._directory_cache.add(output_filename)
+  
+  def _finish_writes(self):
+    if self._write_behind_queue is not None:
+      self._write_behind_queue.join()
+      self._handle_finished_writes()
+  
+  def _close_write_behind_queue(self):
+    if self._write_behind_queue is not None:
+      self._write_behind_queue.close()
+      # The export is already being terminated, only clean up after failed writes.
+      self._handle_finished_writes(raise_errors=False)
+      self._write_behind_queue = None
+  
+  def _handle_finished_writes(self, raise_errors=True):
+    """
+    Remove layers whose writes failed from the exported layers and their files
+    from the export manifest and the directory cache. If `raise_errors` is True,
+    raise `ExportLayersError` for the first failed write.
+    """
+    
+    error_message = None
+    
+    finished_writes = self._write_behind_queue.get_finished()
+    for (layer_elem, output_filename, file_extension), exception in finished_writes:
+      if exception is None:
+        continue
+      
+      if layer_elem.item in self._exported_layers:
+        self._exported_layers.remove(layer_elem.item)
+      
+      if self._export_manifest is not None:
+        self._export_manifest.remove(output_filename)
+      
+      # Files are written under a temporary name, hence a file existing before
+      # the export is left intact.
+      if not os.path.exists(output_filename):
+        self._directory_cache.remove(output_filename)
+      
+      if error_message is None:
+        error_message = (
+          layer_elem.orig_name + ": " +
+          self._get_write_error_message(file_extension, output_filename, exception))
+    
+    if raise_errors and error_message is not None:
+      raise ExportLayersError(error_message)
+  
+  def _get_write_error_message(self, file_extension, output_filename, exception):
+    if isinstance(exception, EnvironmentError) and exception.strerror:
+      reason = exception.strerror
+    else:
+      reason = str(exception)
+    
+    error_message = (
+      '"' + file_extension + '": ' +
+      _("Could not write file \"{0}\": {1}").format(output_filename, reason))
+    if not error_message.endswith('.'):
+      error_message += '.'
+    
+    return error_message
+
+#===============================================================================
+
+class ImageExportResult(object):
+  
+  """
+  This class holds the result of exporting layers from one image in
+  `BatchLayerExporter`.
+  
+  Attributes:
+  
+  * `source` - Filename the image was loaded from, or the image name if the
+    image was already open.
+  
+  * `output_directory` - Directory the layers of the image were exported to.
+  
+  * `exported_layer_names` - Names of the layers that were successfully
+    exported.
+  
+  * `error` - Error message if the export of the image failed, None otherwise.
+  """
+  
+  def __init__(self, source, output_directory):
+    self.source = source
+    self.output_directory = output_directory
+    self.exported_layer_names = []
+    self.error = None
+  
+  def __repr__(self):
+    return "<{0} {1}>".format(type(self).__name__, repr(self.source))
+
+
+class BatchLayerExporter(object):
+  
+  """
+  This class exports layers from multiple images with the same main settings,
+  using one `LayerExporter`. This avoids the overhead of invoking the plug-in,
+  loading settings and streamlining them for each image.
+  
+  Attributes:
+  
+  * `initial_run_mode`, `main_settings`, `overwrite_chooser`,
+    `progress_updater` - See `LayerExporter`.
+  
+  * `images` - List of images to export layers from. Items can also be
+    filenames of images, in which case each image is loaded before its export
+    and closed afterwards.
+  
+  * `use_image_subdirectories` - If True, export the layers of each image to a
+    subdirectory of the output directory named after the image (without the
+    file extension), so that layers with the same name in different images do
+    not conflict. Subdirectory names are made unique.
+  
+  * `stop_on_error` - If True, raise `ExportLayersError` as soon as the export
+    of an image fails. If False, continue with the next image. In both cases,
+    the error is recorded in `results`.
+  
+  * `should_stop` - Can be used to stop the export prematurely. If True,
+    the export is stopped after exporting the currently processed layer.
+  
+  * `layer_exporter` (read-only) - `LayerExporter` instance used for each
+    image. Additional keyword arguments passed to this class are passed to the
+    `LayerExporter` instance.
+  
+  * `results` (read-only) - List of `ImageExportResult` instances, one for each
+    image processed during the last export.
+  """
+  
+  def __init__(self, initial_run_mode, images, main_settings, overwrite_chooser, progress_updater,
+               use_image_subdirectories=True, stop_on_error=False, **layer_exporter_kwargs):
+    
+    self.initial_run_mode = initial_run_mode
+    self.images = images
+    self.main_settings = main_settings
+    self.overwrite_chooser = overwrite_chooser
+    self.progress_updater = progress_updater
+    self.use_image_subdirectories = use_image_subdirectories
+    self.stop_on_error = stop_on_error
+    
+    self._layer_exporter = LayerExporter(
+      initial_run_mode, None, main_settings, overwrite_chooser, progress_updater,
+      **layer_exporter_kwargs)
+    
+    self._results = []
+  
+  @property
+  def should_stop(self):
+    return self._layer_exporter.should_stop
+  
+  @should_stop.setter
+  def should_stop(self, value):
+    self._layer_exporter.should_stop = value
+  
+  @property
+  def layer_exporter(self):
+    return self._layer_exporter
+  
+  @property
+  def results(self):
+    return self._results
+  
+  def export_images(self):
+    """
+    Export layers from each image in `images`.
+    
+    Raises:
+    
+    * `ExportLayersCancelError` - The export was stopped by the user.
+    
+    * `ExportLayersError` - The export of an image failed and `stop_on_error`
+      is True.
+    """
+    
+    self._results = []
+    self.should_stop = False
+    
+    output_directory = self.main_settings['output_directory'].value
+    subdirectory_names = []
+    
+    try:
+      for image_or_filename in self.images:
+        if self.should_stop:
+          raise ExportLayersCancelError("export stopped by user")
+        
+        self._export_image(image_or_filename, output_directory, subdirectory_names)
+    finally:
+      self.main_settings['output_directory'].value = output_directory
+  
+  def _export_image(self, image_or_filename, output_directory, subdirectory_names):
+    if isinstance(image_or_filename, (bytes, str)):
+      filename = image_or_filename.decode() if isinstance(image_or_filename, bytes) else image_or_filename
+      source = filename
+    else:
+      filename = None
+      source = image_or_filename.name.decode()
+    
+    if self.use_image_subdirectories:
+      subdirectory_name = libfiles.uniquify_string(
+        os.path.splitext(os.path.basename(source))[0], subdirectory_names)
+      subdirectory_names.append(subdirectory_name)
+      image_output_directory = os.path.join(output_directory, subdirectory_name)
+    else:
+      image_output_directory = output_directory
+    
+    result = ImageExportResult(source, image_output_directory)
+    self._results.append(result)
+    
+    image = None
+    try:
+      if filename is not None:
+        image = pdb.gimp_file_load(gimpenums.RUN_NONINTERACTIVE, filename.encode(), filename.encode())
+      else:
+        image = image_or_filename
+      
+      self.main_settings['output_directory'].value = image_output_directory
+      self._layer_exporter.image = image
+      try:
+        self._layer_exporter.export_layers()
+      finally:
+        result.exported_layer_names = [
+          layer.name.decode() for layer in self._layer_exporter.exported_layers]
+    except ExportLayersCancelError as e:
+      result.error = e.message
+      raise
+    except (ExportLayersError, RuntimeError) as e:
+      # `RuntimeError` is raised if the image could not be loaded.
+      result.error = e.message
+      if self.stop_on_error:
+        raise ExportLayersError(source + ": " + e.message)
+    finally:
+      if filename is not None and image is not None:
+        pdb.gimp_image_delete(image)
+      self._layer_exporter.image = None
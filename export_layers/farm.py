@@ -0,0 +1,339 @@
+#-------------------------------------------------------------------------------
+#
+# This file is part of Export Layers.
+#
+# Copyright (C) 2013, 2014 khalim19 <khalim19@gmail.com>
+#
+# Export Layers is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Export Layers is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Export Layers.  If not, see <http://www.gnu.org/licenses/>.
+#
+#-------------------------------------------------------------------------------
+
+"""
+This module exports layers from one image using multiple GIMP processes
+running in the batch mode ("workers") to utilize multiple processor cores.
+
+`FarmCoordinator` must itself be run in a GIMP process, e.g. in the GIMP batch
+mode:
+  
+  import sys
+  sys.path.append(gimp.directory + '/plug-ins')
+  
+  from export_layers import farm
+  from export_layers import settings_plugin
+  
+  main_settings = settings_plugin.MainSettings()
+  main_settings['file_extension'].value = 'png'
+  main_settings['output_directory'].value = 'output'
+  
+  farm.FarmCoordinator('image.xcf', main_settings, num_workers=4).export_layers()
+"""
+
+#===============================================================================
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+str = unicode
+
+#===============================================================================
+
+import os
+import json
+import shutil
+import tempfile
+import subprocess
+import gettext
+
+import __builtin__
+
+from export_layers import constants
+
+# The GIMP batch mode does not install `gettext` functions used in the settings.
+if '_' not in __builtin__.__dict__:
+  gettext.install(constants.DOMAIN_NAME, constants.LOCALE_PATH, unicode=True)
+
+import gimp
+import gimpenums
+
+from export_layers.pylibgimpplugin import libfiles
+from export_layers.pylibgimpplugin import settings
+from export_layers.pylibgimpplugin import overwrite
+
+from export_layers import settings_plugin
+from export_layers import exportlayers
+
+#===============================================================================
+
+pdb = gimp.pdb
+
+#===============================================================================
+
+SETTINGS_FILENAME = "settings.json"
+WORKER_JOB_FILENAME_FORMAT = "worker_{0}.json"
+WORKER_RESULT_FILENAME_FORMAT = "worker_{0}_result.json"
+
+#===============================================================================
+
+class FarmCoordinator(object):
+  
+  """
+  This class exports layers from one image by splitting the layers to export
+  into shards and exporting each shard in a separate GIMP worker process.
+  
+  The export plan (see `exportlayers.LayerExporter.export_plan`) is created
+  once by the coordinator, with the layer filters from the main settings
+  applied and with unique output filenames. Conflicts with existing files are
+  also resolved by the coordinator according to the overwrite mode in the main
+  settings. Each worker is assigned its layers along with their output
+  filenames (see `exportlayers.LayerExporter.layer_assignments`), which the
+  workers never change, so that the output files of the workers never
+  conflict.
+  
+  Attributes:
+  
+  * `filename` - Filename of the image to export layers from.
+  
+  * `main_settings` - `MainSettings` instance containing the main settings of
+    the plug-in. This class treats them as read-only.
+  
+  * `num_workers` - Maximum number of worker processes.
+  
+  * `gimp_command` - Command to start GIMP as a list of arguments, without the
+    arguments to run GIMP in the batch mode.
+  
+  * `exported_layer_names` (read-only) - Names of layers successfully exported
+    by all workers during the last export.
+  
+  * `errors` (read-only) - List of error messages from workers that failed
+    during the last export.
+  """
+  
+  def __init__(self, filename, main_settings, num_workers, gimp_command=None):
+    self.filename = filename
+    self.main_settings = main_settings
+    self.num_workers = num_workers
+    self.gimp_command = gimp_command if gimp_command is not None else ["gimp"]
+    
+    self._exported_layer_names = []
+    self._errors = []
+  
+  @property
+  def exported_layer_names(self):
+    return self._exported_layer_names
+  
+  @property
+  def errors(self):
+    return self._errors
+  
+  def export_layers(self):
+    """
+    Export layers from the image in `filename` using up to `num_workers` worker
+    processes and wait until all workers finish.
+    
+    Raises:
+    
+    * `exportlayers.ExportLayersError` - At least one worker failed. The
+      results of the other workers are still available.
+    
+    * `exportlayers.ExportLayersCancelError` - The overwrite mode is "Cancel"
+      and a file conflicts with an existing file. No worker is started.
+    """
+    
+    self._exported_layer_names = []
+    self._errors = []
+    
+    image = pdb.gimp_file_load(gimpenums.RUN_NONINTERACTIVE, self.filename.encode(),
+                               self.filename.encode())
+    try:
+      export_plan = self.create_export_plan(image)
+    finally:
+      pdb.gimp_image_delete(image)
+    
+    libfiles.DirectoryCreator().make_all_dirs(
+      job.output_filename for job in export_plan
+      if exportlayers.ExportJob.CREATE_DIRECTORY in job.operations)
+    
+    self.rename_existing_files(export_plan)
+    
+    shards = self.create_shards(export_plan)
+    
+    temp_directory = tempfile.mkdtemp(prefix=constants.PLUGIN_PROGRAM_NAME + "_")
+    try:
+      self._run_workers(shards, temp_directory)
+    finally:
+      shutil.rmtree(temp_directory, ignore_errors=True)
+    
+    if self._errors:
+      raise exportlayers.ExportLayersError("\n".join(self._errors))
+  
+  def create_export_plan(self, image):
+    """
+    Return the export plan for the specified image as `exportlayers.ExportJob`
+    instances.
+    
+    Output filenames conflicting with existing files are resolved according to
+    the overwrite mode in the main settings. Layers whose files would be skipped
+    are left out of the plan. Existing files that are to be renamed are not
+    renamed yet (see `rename_existing_files()`).
+    
+    Raises:
+    
+    * `exportlayers.ExportLayersCancelError` - The overwrite mode is "Cancel"
+      and a file conflicts with an existing file.
+    """
+    
+    layer_exporter = exportlayers.LayerExporter(
+      gimpenums.RUN_NONINTERACTIVE, image, self.main_settings, self._get_overwrite_chooser(), None,
+      dry_run=True)
+    layer_exporter.export_layers()
+    
+    return [job for job in layer_exporter.export_plan
+            if job.overwrite_mode != exportlayers.OverwriteHandler.SKIP]
+  
+  def rename_existing_files(self, export_plan):
+    """
+    Rename existing files conflicting with the output filenames in the export
+    plan if the overwrite mode in the main settings is "Rename existing file".
+    """
+    
+    directory_cache = libfiles.DirectoryCache()
+    overwrite_chooser = self._get_overwrite_chooser()
+    
+    for job in export_plan:
+      if job.overwrite_mode == exportlayers.OverwriteHandler.RENAME_EXISTING:
+        exportlayers.OverwriteHandler.handle(
+          job.output_filename, overwrite_chooser, directory_cache=directory_cache)
+  
+  def create_shards(self, export_plan):
+    """
+    Split the layers from the export plan into at most `num_workers` shards.
+    Return a list of shards, each being a list of
+    (layer tattoo, output filename) pairs.
+    
+    Layers are distributed in turns, so that layers adjacent in the image (which
+    tend to be of similar size) end up in different shards.
+    """
+    
+    layer_jobs = [job for job in export_plan
+                  if exportlayers.ExportJob.CREATE_DIRECTORY not in job.operations]
+    num_shards = max(min(self.num_workers, len(layer_jobs)), 1)
+    
+    shards = [[] for unused_ in range(num_shards)]
+    for i, job in enumerate(layer_jobs):
+      shards[i % num_shards].append((job.layer_elem.item.tattoo, job.output_filename))
+    
+    return [shard for shard in shards if shard]
+  
+  def get_worker_command(self, job_filename):
+    """
+    Return the command to run a worker processing the specified job file.
+    """
+    
+    python_code = (
+      "import sys; sys.path.append({0}); "
+      "from export_layers import farm; farm.run_worker({1})").format(
+        repr(constants.PLUGINS_DIRECTORY.encode()), repr(job_filename.encode()))
+    
+    return self.gimp_command + [
+      "-i", "--batch-interpreter", "python-fu-eval", "-b", python_code, "-b", "pdb.gimp_quit(1)"]
+  
+  def _get_overwrite_chooser(self):
+    return overwrite.NoninteractiveOverwriteChooser(self.main_settings['overwrite_mode'].value)
+  
+  def _run_workers(self, shards, temp_directory):
+    settings_filename = os.path.join(temp_directory, SETTINGS_FILENAME)
+    settings.JSONFileSettingStream(settings_filename).write(self.main_settings)
+    
+    processes = []
+    for worker_index, shard in enumerate(shards):
+      job_filename = os.path.join(temp_directory, WORKER_JOB_FILENAME_FORMAT.format(worker_index))
+      result_filename = os.path.join(
+        temp_directory, WORKER_RESULT_FILENAME_FORMAT.format(worker_index))
+      
+      with open(job_filename, 'w') as job_file:
+        json.dump({
+          'filename': self.filename,
+          'settings_filename': settings_filename,
+          'result_filename': result_filename,
+          'layer_assignments': shard}, job_file)
+      
+      processes.append((subprocess.Popen(self.get_worker_command(job_filename)), result_filename))
+    
+    for worker_index, (process, result_filename) in enumerate(processes):
+      return_code = process.wait()
+      self._merge_worker_result(worker_index, return_code, result_filename)
+  
+  def _merge_worker_result(self, worker_index, return_code, result_filename):
+    try:
+      with open(result_filename, 'r') as result_file:
+        result = json.load(result_file)
+    except (IOError, OSError, ValueError):
+      self._errors.append(
+        "worker {0} exited with status {1} without a result".format(worker_index, return_code))
+      return
+    
+    self._exported_layer_names.extend(result['exported_layer_names'])
+    if result['error'] is not None:
+      self._errors.append("worker {0}: {1}".format(worker_index, result['error']))
+
+#===============================================================================
+
+def run_worker(job_filename):
+  """
+  Export the layers assigned by `FarmCoordinator` in the specified job file and
+  write the result to the result file specified in the job file.
+  
+  This function is meant to be called in a GIMP worker process started by
+  `FarmCoordinator`.
+  """
+  
+  if isinstance(job_filename, bytes):
+    job_filename = job_filename.decode()
+  
+  with open(job_filename, 'r') as job_file:
+    job = json.load(job_file)
+  
+  result = {'exported_layer_names': [], 'error': None}
+  
+  try:
+    main_settings = settings_plugin.MainSettings()
+    settings.JSONFileSettingStream(job['settings_filename']).read(main_settings)
+    main_settings.streamline(force=True)
+    
+    layer_assignments = {tattoo: output_filename
+                         for tattoo, output_filename in job['layer_assignments']}
+    
+    image = pdb.gimp_file_load(gimpenums.RUN_NONINTERACTIVE, job['filename'].encode(),
+                               job['filename'].encode())
+    try:
+      # Conflicting files were handled by the coordinator, the assigned output
+      # files are replaced.
+      layer_exporter = exportlayers.LayerExporter(
+        gimpenums.RUN_NONINTERACTIVE, image, main_settings,
+        overwrite.NoninteractiveOverwriteChooser(exportlayers.OverwriteHandler.REPLACE), None,
+        layer_assignments=layer_assignments)
+      try:
+        layer_exporter.export_layers()
+      finally:
+        result['exported_layer_names'] = [
+          layer.name.decode() for layer in layer_exporter.exported_layers]
+    finally:
+      pdb.gimp_image_delete(image)
+  except (exportlayers.ExportLayersError, settings.SettingStreamError, RuntimeError) as e:
+    result['error'] = e.message
+  
+  with open(job['result_filename'], 'w') as result_file:
+    json.dump(result, result_file)
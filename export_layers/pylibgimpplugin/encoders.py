@@ -0,0 +1,134 @@
+#-------------------------------------------------------------------------------
+#
+# This file is part of pylibgimpplugin.
+#
+# Copyright (C) 2014 khalim19 <khalim19@gmail.com>
+#
+# pylibgimpplugin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pylibgimpplugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pylibgimpplugin.  If not, see <http://www.gnu.org/licenses/>.
+#
+#-------------------------------------------------------------------------------
+
+"""
+This module contains functions encoding pixel data into image files in the
+plug-in process, without calling GIMP file procedures.
+"""
+
+#===============================================================================
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+str = unicode
+
+#===============================================================================
+
+import os
+import struct
+import zlib
+
+from . import libfiles
+
+#===============================================================================
+
+# PNG color types for the numbers of channels
+_PNG_COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+#===============================================================================
+
+def encode_raw(pixel_data, width, height, num_channels):
+  """
+  Return the pixel data in the raw format - pixels stored row by row, channels
+  interleaved, with no header. This is the format produced by the "raw image
+  data" GIMP file procedure for RGB and grayscale images.
+  
+  Parameters:
+  
+  * `pixel_data` - String of bytes containing the pixels row by row, as obtained
+    from a GIMP pixel region.
+  
+  * `width`, `height` - Image dimensions in pixels.
+  
+  * `num_channels` - Number of bytes per pixel (1 - grayscale, 2 - grayscale
+    with alpha, 3 - RGB, 4 - RGBA).
+  """
+  
+  return pixel_data
+
+
+def encode_png(pixel_data, width, height, num_channels, compression_level=9):
+  """
+  Return the pixel data encoded as a non-interlaced 8-bit PNG image.
+  
+  Only the chunks required to display the image are written - no resolution,
+  gamma or creation time is stored.
+  
+  The parameters are the same as for `encode_raw()`. `compression_level` is the
+  zlib compression level from 0 (no compression) to 9 (best compression, the
+  default in GIMP).
+  """
+  
+  row_size = width * num_channels
+  # Each row is prepended with the filter type "None". Other filter types would
+  # produce smaller files, but require processing each pixel in Python.
+  filtered_rows = b"\x00" + b"\x00".join(
+    pixel_data[row_start:row_start + row_size]
+    for row_start in range(0, row_size * height, row_size))
+  
+  return b"".join([
+    _PNG_SIGNATURE,
+    _get_png_chunk(
+      b"IHDR",
+      struct.pack(b">IIBBBBB", width, height, 8, _PNG_COLOR_TYPES[num_channels], 0, 0, 0)),
+    _get_png_chunk(b"IDAT", zlib.compress(filtered_rows, compression_level)),
+    _get_png_chunk(b"IEND", b""),
+  ])
+
+
+def _get_png_chunk(chunk_type, chunk_data):
+  return b"".join([
+    struct.pack(b">I", len(chunk_data)),
+    chunk_type,
+    chunk_data,
+    struct.pack(b">I", zlib.crc32(chunk_type + chunk_data) & 0xffffffff),
+  ])
+
+
+def write_image_file(filename, encode_func, pixel_data, width, height, num_channels):
+  """
+  Encode the pixel data using `encode_func` (one of the `encode_*` functions)
+  and write the result to the specified file.
+  
+  The file is written to a temporary file first, which is then renamed to
+  `filename`. If writing fails, the temporary file is removed.
+  
+  Raises:
+  
+  * `IOError`, `OSError` - The file could not be written.
+  """
+  
+  encoded_data = encode_func(pixel_data, width, height, num_channels)
+  
+  temp_filename = libfiles.get_temp_filename(filename)
+  try:
+    with open(temp_filename, 'wb') as image_file:
+      image_file.write(encoded_data)
+    libfiles.replace_file(temp_filename, filename)
+  except (IOError, OSError):
+    if os.path.exists(temp_filename):
+      os.remove(temp_filename)
+    raise
@@ -50,9 +50,9 @@ str = unicode
 
 import os
 import abc
+import itertools
 
 from collections import OrderedDict
-from collections import namedtuple
 
 import gimp
 
@@ -91,9 +91,27 @@ class ItemData(object):
   * `is_filtered` - If True, ignore items that do not match the filter
     (`ObjectFilter`) in this object when iterating.
   
+  * `use_bulk_filtering` - If True, filter all items at once using
+    `ObjectFilter.get_match_mask()` with an `ItemDataColumns` object, instead of
+    matching each item separately. This is faster for large item trees if most
+    filter rules have a bulk rule function (see `objectfilter.bulk_rule`).
+  
   * `filter` (read-only) - `ObjectFilter` instance where you can add or remove
     filter rules or subfilters to filter items.
   
+  * `group_filter` (read-only) - `ObjectFilter` instance applied to item groups.
+    If `is_filtered` is True, the children of item groups not matching this
+    filter are skipped along with all their descendants, regardless of
+    `filter`. Use it to skip whole subtrees whose items cannot match `filter`.
+    Descendants of item groups not matching subtree rules in `filter` (see
+    `objectfilter.subtree_rule`) are skipped as well.
+  
+  * `is_lazy` (read-only) - If False, all items are obtained from the image
+    when this object is created. If True, the children of an item group are
+    obtained only when they are first needed, which avoids processing item
+    groups skipped by `group_filter`. Accessing items by name or iterating over
+    all items obtains all items.
+  
   Methods:
   
   * `__getitem__` - Access an `_ItemDataElement` object by its `orig_name`
@@ -107,7 +125,7 @@ class ItemData(object):
   
   * `__iter__` - If `is_filtered` is False, iterate over all items. If
     `is_filtered` is True, iterate only over items that match the filter in this
-    object.
+    object and are not inside skipped item groups (see `group_filter`).
   
   * `uniquify_name` - Make the `name` attribute in the specified
     `_ItemDataElement` object unique among all other, already uniquified
@@ -116,38 +134,78 @@ class ItemData(object):
   
   __metaclass__ = abc.ABCMeta
   
-  def __init__(self, image, is_filtered=False, filter_match_type=objectfilter.ObjectFilter.MATCH_ALL):
+  def __init__(self, image, is_filtered=False, filter_match_type=objectfilter.ObjectFilter.MATCH_ALL,
+               is_lazy=False, use_bulk_filtering=False):
     
     self.image = image
     
     self.is_filtered = is_filtered
     
+    self.use_bulk_filtering = use_bulk_filtering
+    
     # Filters applied to all items in self._itemdata
     self._filter = objectfilter.ObjectFilter(filter_match_type)
     
-    # Contains all items (including item groups) in the item tree.
+    self._group_filter = objectfilter.ObjectFilter(objectfilter.ObjectFilter.MATCH_ALL)
+    
+    self._is_lazy = is_lazy
+    
+    # Contains all items (including item groups) obtained so far from the item
+    # tree. Once all items are obtained, the items are in the order of iteration.
     # key: `_ItemDataElement.orig_name` (derived from `gimp.Item.name`, which is unique)
     # value: `_ItemDataElement` object
     self._itemdata = OrderedDict()
     
+    # key: `_ItemDataElement` object (item group) or None (root of the item tree)
+    # value: list of `_ItemDataElement` objects (immediate children)
+    self._child_itemdata = {}
+    
+    self._has_all_itemdata = False
+    
     # key `_ItemDataElement` object (parent) or None (root of the item tree)
-    # value: set of `_ItemDataElement` objects
+    # value: `_UniquifiedNames` object containing uniquified children
     self._uniquified_itemdata = {}
     
-    self._fill_item_data()
+    # Names uniquified if the item path is not taken into account.
+    self._uniquified_names_without_item_path = None
+    
+    # `_ItemDataElement` objects matching the filter. The list is valid as long
+    # as the filter revision and the number of changes of item names are equal
+    # to `self._filtered_itemdata_revision`.
+    self._filtered_itemdata = None
+    self._filtered_itemdata_revision = None
+    
+    if not self._is_lazy:
+      self._fill_item_data()
   
   @property
   def filter(self):
     return self._filter
   
+  @property
+  def group_filter(self):
+    return self._group_filter
+  
+  @property
+  def is_lazy(self):
+    return self._is_lazy
+  
   def __getitem__(self, name):
+    if name not in self._itemdata:
+      self._fill_item_data()
     return self._itemdata[name]
   
   def __contains__(self, name):
+    if name not in self._itemdata:
+      self._fill_item_data()
     return name in self._itemdata
   
   def __len__(self):
-    return len([item_elem for item_elem in self])
+    if not self.is_filtered:
+      self._fill_item_data()
+      return len(self._itemdata)
+    else:
+      return len(self._get_filtered_itemdata())
   
   def __iter__(self):
     """
@@ -160,12 +218,12 @@ class ItemData(object):
     """
     
     if not self.is_filtered:
+      self._fill_item_data()
       for item_elem in self._itemdata.values():
         yield item_elem
     else:
-      for item_elem in self._itemdata.values():
-        if self._filter.is_match(item_elem):
-          yield item_elem
+      for item_elem in self._get_filtered_itemdata():
+        yield item_elem
   
   def _items(self):
     """
@@ -173,14 +231,40 @@ class ItemData(object):
     """
     
     if not self.is_filtered:
+      self._fill_item_data()
       for name, item_elem in self._itemdata.items():
         yield name, item_elem
     else:
-      for name, item_elem in self._itemdata.items():
-        if self._filter.is_match(item_elem):
-          yield name, item_elem
+      for item_elem in self._get_filtered_itemdata():
+        yield item_elem.orig_name, item_elem
   
-  def uniquify_name(self, item_elem, include_item_path=True, place_before_file_extension=False):
+  def _get_filtered_itemdata(self):
+    """
+    Return a list of `_ItemDataElement` objects matching the filter. Filter the
+    items again only if the filter, the group filter or any item name changed
+    since the last call.
+    """
+    
+    def _is_group_expanded(item_elem):
+      return self._group_filter.is_match(item_elem) and self._filter.can_match_descendants(item_elem)
+    
+    revision = (
+      self._filter.revision, self._group_filter.revision, _ItemDataElement.num_name_changes)
+    if self._filtered_itemdata is None or self._filtered_itemdata_revision != revision:
+      if self.use_bulk_filtering:
+        item_elems = list(self._iter_item_tree(_is_group_expanded))
+        self._filtered_itemdata = list(itertools.compress(
+          item_elems, self._filter.get_match_mask(item_elems, ItemDataColumns(item_elems))))
+      else:
+        is_match = self._filter.compile()
+        self._filtered_itemdata = [
+          item_elem for item_elem in self._iter_item_tree(_is_group_expanded) if is_match(item_elem)]
+      self._filtered_itemdata_revision = revision
+    
+    return self._filtered_itemdata
+  
+  def uniquify_name(self, item_elem, include_item_path=True, place_before_file_extension=False,
+                    reserved_names=None):
     """
     Make the `name` attribute in the specified `_ItemDataElement` object
     unique among all other, already uniquified `_ItemDataElement` objects.
@@ -200,6 +284,11 @@ class ItemData(object):
       the " (<number>)" string that makes the name unique is placed before the
       file extension if the item name has one. This parameter does not apply to
       the item path components (parents).
+    
+    * `reserved_names` - Names the name of `item_elem` must differ from in
+      addition to the names of the already uniquified objects. The names are not
+      added to the uniquified names. This parameter does not apply to the item
+      path components (parents).
     """
     
     if include_item_path:
@@ -207,58 +296,129 @@ class ItemData(object):
         parent = elem.parent
         
         if parent not in self._uniquified_itemdata:
-          self._uniquified_itemdata[parent] = set()
+          self._uniquified_itemdata[parent] = _UniquifiedNames()
+        
+        uniquified_names = self._uniquified_itemdata[parent]
         
-        if elem not in self._uniquified_itemdata[parent]:
-          item_names = set([elem_.name for elem_ in self._uniquified_itemdata[parent]])
-          if elem.name not in item_names:
-            self._uniquified_itemdata[parent].add(elem)
+        if elem not in uniquified_names:
+          # Don't apply `place_before_file_extension` to any parents.
+          if elem == item_elem:
+            place_before_file_ext = place_before_file_extension
           else:
-            # Don't apply `place_before_file_extension` to any parents.
-            if elem == item_elem:
-              place_before_file_ext = place_before_file_extension
-            else:
-              place_before_file_ext = False
-            
-            elem.name = libfiles.uniquify_string(
-              elem.name, item_names, place_before_file_ext
-            )
-            self._uniquified_itemdata[parent].add(elem)
+            place_before_file_ext = False
+          
+          if elem == item_elem:
+            elem.name = self._uniquify_with_reserved_names(
+              uniquified_names, elem.name, place_before_file_ext, reserved_names)
+          else:
+            elem.name = uniquified_names.uniquify(elem.name, place_before_file_ext)
+          uniquified_names.add(elem)
     else:
-      # Use None as the root of the item tree.
-      parent = None
-      
-      if parent not in self._uniquified_itemdata:
-        self._uniquified_itemdata[parent] = set()
+      if self._uniquified_names_without_item_path is None:
+        self._uniquified_names_without_item_path = _UniquifiedNames()
       
-      item_elem.name = libfiles.uniquify_string(
-        item_elem.name, self._uniquified_itemdata[parent],
-        place_before_file_extension
-      )
-      self._uniquified_itemdata[parent].add(item_elem.name)
+      item_elem.name = self._uniquify_with_reserved_names(
+        self._uniquified_names_without_item_path, item_elem.name,
+        place_before_file_extension, reserved_names)
+      self._uniquified_names_without_item_path.add_name(item_elem.name)
+  
+  def remove_uniquified_name(self, item_elem):
+    """
+    Make the specified `_ItemDataElement` object no longer count as uniquified
+    among the objects having the same parent so that its name can be uniquified
+    again by `uniquify_name` after it changes.
+    
+    This method only applies to objects uniquified with `include_item_path` set
+    to True. Names uniquified without the item path cannot be removed and
+    `uniquify_name` always uniquifies them again.
+    """
+    
+    if item_elem._uniquified_names is not None:
+      item_elem._uniquified_names.remove(item_elem)
+  
+  def _uniquify_with_reserved_names(self, uniquified_names, name, place_before_file_extension,
+                                    reserved_names):
+    if not reserved_names:
+      return uniquified_names.uniquify(name, place_before_file_extension)
+    
+    for reserved_name in reserved_names:
+      uniquified_names.add_name(reserved_name)
+    
+    try:
+      return uniquified_names.uniquify(name, place_before_file_extension)
+    finally:
+      for reserved_name in reserved_names:
+        uniquified_names.remove_name(reserved_name)
   
   def _fill_item_data(self):
     """
     Fill the _itemdata dictionary, containing
-    <gimp.Item.name, _ItemDataElement> pairs.
+    <gimp.Item.name, _ItemDataElement> pairs, with all items in the order of
+    iteration.
+    """
+    
+    if self._has_all_itemdata:
+      return
+    
+    if not self._child_itemdata:
+      for unused_ in self._iter_item_tree():
+        pass
+    else:
+      # Items may have been obtained in a different order if item groups were
+      # skipped during iteration.
+      self._itemdata = OrderedDict(
+        (item_elem.orig_name, item_elem) for item_elem in self._iter_item_tree())
+    
+    self._has_all_itemdata = True
+  
+  def _iter_item_tree(self, is_group_expanded=None):
+    """
+    Iterate over the items in the item tree, obtaining the children of item
+    groups from the image if they were not obtained yet.
+    
+    Item groups are processed depth-first, each group yielding all its
+    immediate children at once.
+    
+    If `is_group_expanded` is not None, it is a function called for each item
+    group once the group and its siblings are yielded. If the function returns
+    False, the children of the group are not obtained or yielded.
     """
     
-    _ItemTreeNode = namedtuple('_ItemTreeNode', ['children', 'parents'])
-    item_tree = [_ItemTreeNode(self._get_children_from_image(self.image), [])]
+    # Item groups are pushed to the stack in the reverse order so that they are
+    # popped in the original order.
+    item_tree = [None]
     
     while item_tree:
-      node = item_tree.pop(0)
+      parent_elem = item_tree.pop()
       
-      index = 0
-      for item in node.children:
-        parents = list(node.parents)
-        item_elem = _ItemDataElement(item, parents)
-        
-        if pdb.gimp_item_is_group(item):
-          item_tree.insert(index, _ItemTreeNode(self._get_children_from_item(item), parents + [item_elem]))
-          index += 1
-        
+      child_elems = self._get_child_itemdata(parent_elem)
+      for item_elem in child_elems:
+        yield item_elem
+      
+      item_tree.extend(
+        item_elem for item_elem in reversed(child_elems)
+        if (item_elem.item_type != item_elem.ITEM
+            and (is_group_expanded is None or is_group_expanded(item_elem))))
+  
+  def _get_child_itemdata(self, parent_elem):
+    """
+    Return a list of `_ItemDataElement` objects for the immediate children of
+    the specified item group, or of the image if `parent_elem` is None.
+    """
+    
+    if parent_elem not in self._child_itemdata:
+      if parent_elem is not None:
+        items = self._get_children_from_item(parent_elem.item)
+      else:
+        items = self._get_children_from_image(self.image)
+      
+      child_elems = [_ItemDataElement(item, parent_elem) for item in items]
+      for item_elem in child_elems:
         self._itemdata[item_elem.orig_name] = item_elem
+      
+      self._child_itemdata[parent_elem] = child_elems
+    
+    return self._child_itemdata[parent_elem]
   
   @abc.abstractmethod
   def _get_children_from_image(self, image):
@@ -320,7 +480,8 @@ class _ItemDataElement(object):
   * `item` (read-only) - `gimp.Item` object.
   
   * `parents` (read-only) - List of `_ItemDataElement` parents for this item,
-    sorted from the topmost parent to the bottommost (immediate) parent.
+    sorted from the topmost parent to the bottommost (immediate) parent. Only
+    the immediate parent is stored, the list is created on each access.
   
   * `level` (read-only) - Integer indicating which level in the item tree is
     the item positioned at. 0 means the item is at the top level. The higher
@@ -338,6 +499,10 @@ class _ItemDataElement(object):
      attribute. Modify this attribute instead of `gimp.Item.name` to avoid
      modifying the original item.
   
+  * `num_name_changes` (class attribute) - Total number of changes
+    of the `name` attribute in all objects of this class. `ItemData` uses this
+    number to determine whether filtered items must be filtered again.
+  
   * `orig_name` (read-only) - original `gimp.Item.name` as a `unicode` string.
   
   * `path_visible` (read-only) - Visibility of all item's parents and this
@@ -346,6 +511,9 @@ class _ItemDataElement(object):
   
   Methods:
   
+  * `get_name_attribute` - Return a value derived from the item name, computed
+    only once for each name.
+  
   * `get_file_extension` - Get file extension from the item name.
   
   * `set_file_extension` - Set file extension in the item name.
@@ -360,18 +528,21 @@ class _ItemDataElement(object):
   
   __ITEM_TYPES = ITEM, NONEMPTY_GROUP, EMPTY_GROUP = (0, 1, 2)
   
-  def __init__(self, item, parents=None):
+  num_name_changes = 0
+  
+  # Item data may contain tens of thousands of elements, hence no per-instance
+  # dictionaries.
+  __slots__ = (
+    '_item', '_parent', '_level', '_item_type', '_name', '_orig_name',
+    '_name_attributes', '_uniquified_names', '_path_visible')
+  
+  def __init__(self, item, parent=None):
     if item is None:
       raise TypeError("item cannot be None")
     
     self._item = item
-    self._parents = parents if parents is not None else []
-    self._level = len(self._parents)
-    
-    if self._parents:
-      self._parent = self._parents[-1]
-    else:
-      self._parent = None
+    self._parent = parent
+    self._level = parent.level + 1 if parent is not None else 0
     
     if pdb.gimp_item_is_group(self._item):
       if self._item.children:
@@ -381,8 +552,14 @@ class _ItemDataElement(object):
     else:
       self._item_type = self.ITEM
     
-    self.name = self._item.name.decode()
-    self._orig_name = self.name
+    self._name = self._item.name.decode()
+    self._orig_name = self._name
+    
+    # Values derived from `name`, created on first use of `get_name_attribute()`.
+    self._name_attributes = None
+    
+    # `_UniquifiedNames` object this element was added to, if any.
+    self._uniquified_names = None
     
     self._path_visible = self._get_path_visibility()
   
@@ -392,7 +569,13 @@ class _ItemDataElement(object):
   
   @property
   def parents(self):
-    return self._parents
+    parents = []
+    parent = self._parent
+    while parent is not None:
+      parents.append(parent)
+      parent = parent._parent
+    parents.reverse()
+    return parents
   
   @property
   def level(self):
@@ -406,6 +589,19 @@ class _ItemDataElement(object):
   def item_type(self):
     return self._item_type
   
+  @property
+  def name(self):
+    return self._name
+  
+  @name.setter
+  def name(self, name):
+    if self._uniquified_names is not None:
+      self._uniquified_names.rename(self._name, name)
+    
+    self._name = name
+    self._name_attributes = None
+    _ItemDataElement.num_name_changes += 1
+  
   @property
   def orig_name(self):
     return self._orig_name
@@ -414,6 +610,26 @@ class _ItemDataElement(object):
   def path_visible(self):
     return self._path_visible
   
+  def get_name_attribute(self, attribute_func):
+    """
+    Return `attribute_func(name)`. The function is called only once until
+    `name` changes, subsequent calls return the stored result.
+    
+    `attribute_func` must only depend on the name passed to it. Filter rules
+    evaluated repeatedly can use this method to avoid processing the same name
+    multiple times.
+    """
+    
+    if self._name_attributes is None:
+      self._name_attributes = {}
+    
+    try:
+      return self._name_attributes[attribute_func]
+    except KeyError:
+      value = attribute_func(self._name)
+      self._name_attributes[attribute_func] = value
+      return value
+  
   def get_file_extension(self):
     """
     Get file extension from the `name` attribute.
@@ -421,7 +637,7 @@ class _ItemDataElement(object):
     If `name` has no file extension, return an empty string.
     """
     
-    return libfiles.get_file_extension(self.name)
+    return self.get_name_attribute(libfiles.get_file_extension)
   
   def set_file_extension(self, file_extension):
     """
@@ -479,7 +695,7 @@ class _ItemDataElement(object):
     """
     
     self.name = libfiles.FilenameValidator.validate(self.name)
-    for parent in self._parents:
+    for parent in self.parents:
       parent.name = libfiles.FilenameValidator.validate(parent.name)
   
   def _get_path_visibility(self):
@@ -488,12 +704,187 @@ class _ItemDataElement(object):
     return False.
     """
     
-    path_visible = True
-    if not self._item.visible:
-      path_visible = False
+    # The visibility of the parents is already determined in the immediate parent.
+    if self._parent is not None:
+      return bool(self._item.visible) and self._parent.path_visible
     else:
-      for parent in self._parents:
-        if not parent.item.visible:
-          path_visible = False
-          break
-    return path_visible
+      return bool(self._item.visible)
+
+#===============================================================================
+
+class ItemDataColumns(object):
+  
+  """
+  This class provides attributes of a list of `_ItemDataElement` objects as
+  lists ("columns"), allowing bulk filter rules to process all items at once
+  (see `objectfilter.bulk_rule`). Columns of attributes that do not change are
+  created on first access and then reused, columns depending on item names are
+  created on each access.
+  
+  Attributes:
+  
+  * `item_elems` (read-only) - List of `_ItemDataElement` objects.
+  
+  * `levels` (read-only) - `level` attribute of each item.
+  
+  * `item_types` (read-only) - `item_type` attribute of each item.
+  
+  * `path_visible` (read-only) - `path_visible` attribute of each item.
+  
+  * `names` (read-only) - `name` attribute of each item.
+  
+  * `ITEM`, `NONEMPTY_GROUP`, `EMPTY_GROUP` - Item types, see `_ItemDataElement`.
+  
+  Methods:
+  
+  * `get_name_attribute_column` - Return the result of
+    `_ItemDataElement.get_name_attribute()` for each item.
+  """
+  
+  ITEM, NONEMPTY_GROUP, EMPTY_GROUP = (
+    _ItemDataElement.ITEM, _ItemDataElement.NONEMPTY_GROUP, _ItemDataElement.EMPTY_GROUP)
+  
+  def __init__(self, item_elems):
+    self._item_elems = item_elems
+    
+    self._levels = None
+    self._item_types = None
+    self._path_visible = None
+  
+  def __len__(self):
+    return len(self._item_elems)
+  
+  @property
+  def item_elems(self):
+    return self._item_elems
+  
+  @property
+  def levels(self):
+    if self._levels is None:
+      self._levels = [item_elem._level for item_elem in self._item_elems]
+    return self._levels
+  
+  @property
+  def item_types(self):
+    if self._item_types is None:
+      self._item_types = [item_elem._item_type for item_elem in self._item_elems]
+    return self._item_types
+  
+  @property
+  def path_visible(self):
+    if self._path_visible is None:
+      self._path_visible = [item_elem._path_visible for item_elem in self._item_elems]
+    return self._path_visible
+  
+  @property
+  def names(self):
+    return [item_elem._name for item_elem in self._item_elems]
+  
+  def get_name_attribute_column(self, attribute_func):
+    return [item_elem.get_name_attribute(attribute_func) for item_elem in self._item_elems]
+
+#===============================================================================
+
+class _UniquifiedNames(object):
+  
+  """
+  This class indexes names of already uniquified `_ItemDataElement` objects
+  having the same parent, or arbitrary names if `add_name` is used.
+  
+  Names of added `_ItemDataElement` objects are kept up to date if the `name`
+  attribute of the objects changes.
+  
+  The result of `uniquify` is identical to `libfiles.uniquify_string`. For each
+  name, the number in the " (<number>)" string found last is remembered, so
+  uniquifying many identical names does not test the same numbers repeatedly.
+  
+  Methods:
+  
+  * `__contains__` - Return True if the specified `_ItemDataElement` object was
+    added, False otherwise.
+  
+  * `add` - Add an `_ItemDataElement` object and its name.
+  
+  * `add_name` - Add a name.
+  
+  * `remove` - Remove an `_ItemDataElement` object and its name.
+  
+  * `remove_name` - Remove one occurrence of a name.
+  
+  * `rename` - Replace one occurrence of a name with a new name.
+  
+  * `uniquify` - Return a name unique among all added names.
+  """
+  
+  def __init__(self):
+    # key: name
+    # value: number of added objects having that name
+    self._names = {}
+    self._elems = set()
+    
+    # key: (name without the " (<number>)" string, file extension)
+    # value: number from which to start searching for a unique name; all lower
+    # numbers are known to produce already added names
+    self._next_numbers = {}
+  
+  def __contains__(self, elem):
+    return elem in self._elems
+  
+  def add(self, elem):
+    if elem in self._elems:
+      return
+    
+    self._elems.add(elem)
+    self.add_name(elem.name)
+    elem._uniquified_names = self
+  
+  def add_name(self, name):
+    self._names[name] = self._names.get(name, 0) + 1
+  
+  def remove(self, elem):
+    if elem not in self._elems:
+      return
+    
+    self._elems.remove(elem)
+    self.remove_name(elem.name)
+    elem._uniquified_names = None
+  
+  def remove_name(self, name):
+    self._names[name] -= 1
+    if self._names[name] == 0:
+      del self._names[name]
+      # The removed name may have been one of the numbered names skipped so far.
+      self._next_numbers.clear()
+  
+  def rename(self, old_name, new_name):
+    self.remove_name(old_name)
+    self.add_name(new_name)
+  
+  def uniquify(self, name, place_before_file_extension=False):
+    """
+    If `name` was already added, return a unique name by appending
+    " (<number>)" to `name`. Otherwise return `name`.
+    
+    If `place_before_file_extension` is True, place the " (<number>)" string
+    before the file extension if `name` has one.
+    """
+    
+    if name not in self._names:
+      return name
+    
+    root, file_extension = name, ""
+    if place_before_file_extension:
+      name_root, name_file_extension = os.path.splitext(name)
+      name_file_extension = name_file_extension.lstrip('.')
+      if name_file_extension:
+        root, file_extension = name_root, '.' + name_file_extension
+    
+    number = self._next_numbers.get((root, file_extension), 1)
+    uniq_name = '{0} ({1}){2}'.format(root, number, file_extension)
+    while uniq_name in self._names:
+      number += 1
+      uniq_name = '{0} ({1}){2}'.format(root, number, file_extension)
+    
+    self._next_numbers[(root, file_extension)] = number
+    
+    return uniq_name
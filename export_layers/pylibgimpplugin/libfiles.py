@@ -38,6 +38,7 @@ str = unicode
 import os
 import re
 import abc
+import uuid
 
 #===============================================================================
 
@@ -90,16 +91,22 @@ def uniquify_string(str_, existing_strings, place_before_file_extension=False):
       return _uniquify_without_extension(str_, existing_strings)
 
 
-def uniquify_filename(filename):
+def uniquify_filename(filename, directory_cache=None):
   """
   If a file with a specified filename already exists, return a unique filename.
+  
+  If `directory_cache` (a `DirectoryCache` object) is specified, use it to check
+  for existing files instead of querying the file system for each attempted
+  filename.
   """
   
-  if os.path.exists(filename):
+  exists = directory_cache.exists if directory_cache is not None else os.path.exists
+  
+  if exists(filename):
     root, ext = os.path.splitext(filename)
     i = 1
     uniq_filename = ''.join((root, " (", str(i), ")", ext))
-    while os.path.exists(uniq_filename):
+    while exists(uniq_filename):
       i += 1
       uniq_filename = ''.join((root, " (", str(i), ")", ext))
     return uniq_filename
@@ -155,6 +162,73 @@ def make_dirs(path):
       raise
 
 
+def get_temp_filename(filename, file_extension=None):
+  """
+  Return a filename in the directory of `filename` to write a file to before
+  renaming it to `filename` (see `replace_file()`). This way, a partially
+  written file never appears under `filename`.
+  
+  The returned filename starts with "." and contains ".tmp" followed by a
+  random string, which makes it unique and allows programs watching the
+  directory to ignore it. If `file_extension` is specified, it is appended to
+  the filename, since the file format is often determined from the file
+  extension.
+  """
+  
+  dirname, basename = os.path.split(filename)
+  temp_basename = "." + basename + ".tmp" + uuid.uuid4().hex[:8]
+  if file_extension:
+    temp_basename += "." + file_extension
+  
+  return os.path.join(dirname, temp_basename)
+
+
+def replace_file(filename, new_filename):
+  """
+  Rename `filename` to `new_filename`, replacing `new_filename` if it exists.
+  
+  On POSIX systems, the replacement is atomic - `new_filename` always refers to
+  either the old or the new file. On Windows, the existing file is removed
+  first.
+  """
+  
+  if os.name == 'nt' and os.path.exists(new_filename):
+    os.remove(new_filename)
+  
+  os.rename(filename, new_filename)
+
+
+def rename_without_overwriting(filename, new_filename):
+  """
+  Rename `filename` to `new_filename` unless `new_filename` exists.
+  
+  If the file system supports hard links, checking for the existence of
+  `new_filename` and renaming are a single atomic operation, so a file created
+  under `new_filename` by others in the meantime is never overwritten.
+  
+  Raises:
+  
+  * `OSError` - `new_filename` already exists (with `errno` set to `EEXIST`)
+    or the file could not be renamed.
+  """
+  
+  if hasattr(os, 'link'):
+    try:
+      os.link(filename, new_filename)
+    except OSError as exc:
+      if exc.errno == os.errno.EEXIST:
+        raise
+      # The file system does not support hard links.
+    else:
+      os.remove(filename)
+      return
+  
+  if os.path.exists(new_filename):
+    raise OSError(os.errno.EEXIST, os.strerror(os.errno.EEXIST), new_filename)
+  
+  os.rename(filename, new_filename)
+
+
 def split_path(path):
   """
   Split the specified path into separate path components.
@@ -177,6 +251,159 @@ def split_path(path):
 
 #===============================================================================
 
+class DirectoryCache(object):
+  
+  """
+  This class keeps listings of directory contents to check whether files exist
+  without querying the file system for each file. Each directory is listed only
+  once, when a file in that directory is checked for the first time.
+  
+  The cache does not detect changes made to the directories by others. Files
+  created, removed or renamed through the cache owner must be recorded via
+  `add()`, `remove()` or `rename()`.
+  
+  Attributes:
+  
+  * `num_listed_directories` (read-only) - Number of directories listed so far.
+  
+  Methods:
+  
+  * `exists()` - Return True if the specified file exists, False otherwise.
+  
+  * `add()` - Record that the specified file was created.
+  
+  * `remove()` - Record that the specified file was removed.
+  
+  * `rename()` - Rename the specified file without overwriting existing files
+    (see `rename_without_overwriting()`) and record the change.
+  """
+  
+  def __init__(self):
+    # key: normalized directory path; value: set of normalized filenames
+    self._directory_contents = {}
+  
+  @property
+  def num_listed_directories(self):
+    return len(self._directory_contents)
+  
+  def exists(self, filename):
+    dirname, basename = self._split(filename)
+    contents = self._get_directory_contents(dirname) if basename else None
+    if contents is None:
+      return os.path.exists(filename)
+    
+    return basename in contents
+  
+  def add(self, filename):
+    dirname, basename = self._split(filename)
+    contents = self._get_directory_contents(dirname) if basename else None
+    if contents is not None:
+      contents.add(basename)
+  
+  def remove(self, filename):
+    dirname, basename = self._split(filename)
+    contents = self._get_directory_contents(dirname) if basename else None
+    if contents is not None:
+      contents.discard(basename)
+  
+  def rename(self, filename, new_filename):
+    rename_without_overwriting(filename, new_filename)
+    self.remove(filename)
+    self.add(new_filename)
+  
+  def _split(self, filename):
+    dirname, basename = os.path.split(os.path.abspath(filename))
+    return os.path.normcase(dirname), os.path.normcase(basename)
+  
+  def _get_directory_contents(self, dirname):
+    try:
+      return self._directory_contents[dirname]
+    except KeyError:
+      try:
+        contents = set(os.path.normcase(name) for name in os.listdir(dirname))
+      except OSError:
+        if os.path.isdir(dirname):
+          # The directory cannot be listed, files have to be checked one by one.
+          contents = None
+        else:
+          contents = set()
+      self._directory_contents[dirname] = contents
+      return contents
+
+
+class DirectoryCreator(object):
+  
+  """
+  This class creates directories via `make_dirs()` and remembers which
+  directories already exist, so that creating the same directory (or any of
+  its parent directories) again requires no file system calls.
+  
+  The directories are not checked again after they have been created. If a
+  directory is removed by others in the meantime, it is not created again.
+  
+  Attributes:
+  
+  * `num_avoided_calls` (read-only) - Number of `make_dirs()` calls avoided
+    because the directory was known to exist.
+  
+  Methods:
+  
+  * `make_dirs()` - Create the specified directory and its parent directories
+    unless they are known to exist.
+  
+  * `make_all_dirs()` - Create all specified directories at once.
+  """
+  
+  def __init__(self):
+    self._existing_dirpaths = set()
+    self._num_avoided_calls = 0
+  
+  @property
+  def num_avoided_calls(self):
+    return self._num_avoided_calls
+  
+  def make_dirs(self, path):
+    dirpath = self._normalize(path)
+    if dirpath in self._existing_dirpaths:
+      self._num_avoided_calls += 1
+      return
+    
+    make_dirs(path)
+    self._add_existing_dirpath(dirpath)
+  
+  def make_all_dirs(self, paths):
+    """
+    Create the specified directories. Since creating a directory also creates
+    its parent directories, only the directories not being a parent of any
+    other specified directory are created.
+    """
+    
+    paths_to_create = {}
+    for path in paths:
+      dirpath = self._normalize(path)
+      if dirpath in paths_to_create or dirpath in self._existing_dirpaths:
+        self._num_avoided_calls += 1
+      else:
+        paths_to_create[dirpath] = path
+    
+    # Deeper directories come first so that their parent directories are
+    # already marked as existing when processed.
+    for dirpath in sorted(paths_to_create, key=len, reverse=True):
+      self.make_dirs(paths_to_create[dirpath])
+  
+  def _normalize(self, path):
+    return os.path.normcase(os.path.abspath(path))
+  
+  def _add_existing_dirpath(self, dirpath):
+    while dirpath not in self._existing_dirpaths:
+      self._existing_dirpaths.add(dirpath)
+      parent_dirpath = os.path.dirname(dirpath)
+      if parent_dirpath == dirpath:
+        break
+      dirpath = parent_dirpath
+
+#===============================================================================
+
 class StringValidator(object):
   
   """
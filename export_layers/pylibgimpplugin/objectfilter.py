@@ -35,10 +35,51 @@ str = unicode
 #===============================================================================
 
 import inspect
+import itertools
+import operator
+import timeit
 from contextlib import contextmanager
 
 #===============================================================================
 
+# Revisions are unique across all filters, so that a filter never returns to
+# a revision it had before.
+_revisions = itertools.count(1)
+
+#===============================================================================
+
+def subtree_rule(rule_func):
+  """
+  Mark the specified rule function as a subtree rule and return the function.
+  
+  A subtree rule is a rule that, if not matched by an object, is not matched by
+  any descendant of the object either (e.g. items inside an item group). This
+  allows to skip descendants of objects without evaluating the filter for each
+  descendant (see `ObjectFilter.can_match_descendants()`).
+  """
+  
+  rule_func.is_subtree_rule = True
+  return rule_func
+
+
+def bulk_rule(bulk_rule_func):
+  """
+  Return a decorator attaching `bulk_rule_func` to a rule function.
+  
+  `bulk_rule_func` evaluates the rule for many objects at once (see
+  `ObjectFilter.get_match_mask()`). It takes the `columns` argument of
+  `get_match_mask()` followed by the rule arguments and returns a list of
+  booleans, one for each object.
+  """
+  
+  def _set_bulk_rule_func(rule_func):
+    rule_func.bulk_rule_func = bulk_rule_func
+    return rule_func
+  
+  return _set_bulk_rule_func
+
+#===============================================================================
+
 class ObjectFilter(object):
   
   """
@@ -55,23 +96,71 @@ class ObjectFilter(object):
     * MATCH_ANY - For `is_match()` to return True, the object must match
       at least one rule.
   
+  * `revision` (read-only) - Number that changes whenever a rule or a subfilter
+    is added to or removed from this filter or any of its subfilters. This
+    allows to cache the results of filtering until the filter changes.
+  
+  * `optimize_rule_order` (read-only) - If True and `match_type` is
+    `MATCH_ALL`, collect statistics of the rules (and subfilters with a
+    different match type) when matching objects after the filter changes, and
+    then evaluate the rules in the order of their cost (see `RuleStatistics`).
+    The result of matching does not depend on the order, as long as the rules
+    have no side effects.
+  
+  * `rule_statistics` (read-only) - Dictionary of statistics collected if
+    `optimize_rule_order` is True. The keys are rule functions or subfilter
+    names and the values are `RuleStatistics` objects. Rules of subfilters with
+    the same match type are included.
+  
   For better flexibility, the filter can also contain nested `ObjectFilter`
   objects, called "subfilters", each with their own set of rules and match type.
+  
+  Before matching objects, the rules and subfilters are compiled into a single
+  function (see `compile()`). The filter is compiled again automatically after
+  it changes.
   """
   
   __MATCH_TYPES = MATCH_ALL, MATCH_ANY = (0, 1)
   
-  def __init__(self, match_type):
+  NUM_STATISTICS_SAMPLES = 200
+  
+  def __init__(self, match_type, optimize_rule_order=False):
     self._match_type = match_type
+    self._optimize_rule_order = optimize_rule_order
     
     # Key: function (rule_func)
     # Value: tuple (rule_func_args)
     self._filter_items = {}
+    
+    # Filters containing this filter as a subfilter. Their revision is updated
+    # along with the revision of this filter.
+    self._parent_filters = []
+    
+    self._revision = next(_revisions)
+    
+    self._compiled_is_match = None
+    self._compiled_revision = None
+    
+    # key: rule function or subfilter name
+    # value: `RuleStatistics` object
+    self._rule_statistics = {}
   
   @property
   def match_type(self):
     return self._match_type
   
+  @property
+  def optimize_rule_order(self):
+    return self._optimize_rule_order
+  
+  @property
+  def rule_statistics(self):
+    return self._rule_statistics
+  
+  @property
+  def revision(self):
+    return self._revision
+  
   def has_rule(self, rule_func):
     return rule_func in self._filter_items
   
@@ -111,6 +200,7 @@ class ObjectFilter(object):
       raise TypeError("Function must have at least one argument (the object to match)")
     
     self._filter_items[rule_func] = rule_func_args
+    self._update_revision()
   
   def remove_rule(self, rule_func, raise_if_not_found=True):
     """
@@ -131,6 +221,7 @@ class ObjectFilter(object):
     
     if self.has_rule(rule_func):
       del self._filter_items[rule_func]
+      self._update_revision()
     else:
       if raise_if_not_found:
         raise ValueError(str(rule_func) + " not found in filter")
@@ -225,6 +316,8 @@ class ObjectFilter(object):
       raise ValueError("subfilter named \"" + str(subfilter_name) + "\" already exists in the filter")
     
     self._filter_items[subfilter_name] = subfilter
+    subfilter._parent_filters.append(self)
+    self._update_revision()
   
   def __getitem__(self, subfilter_name):
     """
@@ -264,7 +357,10 @@ class ObjectFilter(object):
     """
     
     if self.has_subfilter(subfilter_name):
-      del self._filter_items[subfilter_name]
+      subfilter = self._filter_items.pop(subfilter_name)
+      if isinstance(subfilter, ObjectFilter):
+        subfilter._parent_filters.remove(self)
+      self._update_revision()
     else:
       if raise_if_not_found:
         raise ValueError("subfilter named \"" + str(subfilter_name) + "\" not found in filter")
@@ -337,38 +433,304 @@ class ObjectFilter(object):
     If no filter rules are specified, return True.
     """
     
+    return self.compile()(object_to_match)
+  
+  def compile(self):
+    """
+    Return a function taking an object to match as its only argument and
+    returning the same result as `is_match()` for the current rules and
+    subfilters. The function is created again only if the filter changed since
+    the last call.
+    
+    Subfilters having the same match type as this filter are merged with this
+    filter. Rules without arguments are evaluated first, followed by rules with
+    arguments and then subfilters with a different match type. The evaluation
+    stops as soon as the result is known.
+    
+    Use this method instead of `is_match()` to match many objects in a loop. The
+    returned function does not reflect changes made to the filter afterwards.
+    """
+    
+    if self._compiled_revision != self._revision:
+      self._compiled_is_match = self._compile()
+      self._compiled_revision = self._revision
+    
+    return self._compiled_is_match
+  
+  def can_match_descendants(self, object_to_match):
+    """
+    Return False if no descendant of `object_to_match` can match the filter
+    because `object_to_match` does not match subtree rules (see `subtree_rule`)
+    in this filter or its subfilters. Otherwise return True.
+    
+    Only subtree rules are evaluated for `object_to_match`.
+    """
+    
     if not self._filter_items:
       return True
     
     if self._match_type == self.MATCH_ALL:
-      return self._is_match_all(object_to_match)
+      for key, value in self._filter_items.items():
+        if isinstance(value, ObjectFilter):
+          if not value.can_match_descendants(object_to_match):
+            return False
+        elif getattr(key, 'is_subtree_rule', False) and not key(object_to_match, *value):
+          return False
+      
+      return True
     elif self._match_type == self.MATCH_ANY:
-      return self._is_match_any(object_to_match)
+      for key, value in self._filter_items.items():
+        if isinstance(value, ObjectFilter):
+          if value.can_match_descendants(object_to_match):
+            return True
+        elif not getattr(key, 'is_subtree_rule', False) or key(object_to_match, *value):
+          return True
+      
+      return False
   
-  def _is_match_all(self, object_to_match):
-    is_match = True
+  def get_match_mask(self, objects, columns):
+    """
+    Return a list of booleans indicating whether each object in `objects`
+    matches the filter. The result is the same as calling `is_match()` for each
+    object.
+    
+    Rules with a bulk rule function (see `bulk_rule`) are evaluated for all
+    objects at once using `columns`, an object with the attributes of `objects`
+    that the bulk rule functions expect. Other rules are evaluated for each
+    object not matched or rejected by the other rules yet.
+    """
+    
+    if not self._filter_items:
+      return [True] * len(objects)
+    
+    if self._match_type == self.MATCH_ALL:
+      combine_masks = operator.and_
+      is_undecided = operator.truth
+    else:
+      combine_masks = operator.or_
+      is_undecided = operator.not_
+    
+    mask = None
+    rules_per_object = []
     
     for key, value in self._filter_items.items():
       if isinstance(value, ObjectFilter):
-        is_match = is_match and value.is_match(object_to_match)
+        rule_mask = value.get_match_mask(objects, columns)
+      elif hasattr(key, 'bulk_rule_func'):
+        rule_mask = key.bulk_rule_func(columns, *value)
       else:
-        # key = rule_func, value = rule_func_args
-        is_match = is_match and key(object_to_match, *value)
-      if not is_match:
-        break
+        rules_per_object.append((key, value))
+        continue
+      
+      mask = map(combine_masks, mask, rule_mask) if mask is not None else list(rule_mask)
+    
+    if rules_per_object:
+      if self._match_type == self.MATCH_ALL:
+        def _is_match_rules(object_to_match):
+          return all(rule_func(object_to_match, *rule_func_args)
+                     for rule_func, rule_func_args in rules_per_object)
+      else:
+        def _is_match_rules(object_to_match):
+          return any(rule_func(object_to_match, *rule_func_args)
+                     for rule_func, rule_func_args in rules_per_object)
+      
+      if mask is None:
+        mask = [bool(_is_match_rules(object_to_match)) for object_to_match in objects]
+      else:
+        mask = [
+          bool(_is_match_rules(object_to_match)) if is_undecided(is_match) else is_match
+          for object_to_match, is_match in zip(objects, mask)]
     
-    return is_match
+    return mask
+  
+  def _update_revision(self):
+    self._revision = next(_revisions)
+    for parent_filter in self._parent_filters:
+      parent_filter._update_revision()
+  
+  def _compile(self):
+    rules_without_args = []
+    rules_with_args = []
+    subfilters = []
+    
+    is_always_match = not self._add_match_funcs(
+      self._match_type, rules_without_args, rules_with_args, subfilters)
+    match_items = rules_without_args + rules_with_args + subfilters
+    
+    if is_always_match or not match_items:
+      return _is_match_always
+    elif len(match_items) == 1:
+      return match_items[0][1]
+    elif self._match_type == self.MATCH_ALL:
+      if self._optimize_rule_order:
+        return self._get_optimized_is_match_all(match_items)
+      
+      match_funcs = [match_func for unused_, match_func in match_items]
+      
+      def _is_match_all(object_to_match):
+        for match_func in match_funcs:
+          if not match_func(object_to_match):
+            return False
+        return True
+      
+      return _is_match_all
+    else:
+      match_funcs = [match_func for unused_, match_func in match_items]
+      
+      def _is_match_any(object_to_match):
+        for match_func in match_funcs:
+          if match_func(object_to_match):
+            return True
+        return False
+      
+      return _is_match_any
   
-  def _is_match_any(self, object_to_match):
-    is_match = False
+  def _get_optimized_is_match_all(self, match_items):
+    """
+    Return a function matching all items in `match_items`, a list of
+    (rule function or subfilter name, match function) tuples. The function
+    measures the match functions for the first `NUM_STATISTICS_SAMPLES` objects
+    and then sorts them by their cost (see `RuleStatistics.cost`).
+    """
+    
+    match_entries = [
+      (match_func, self._rule_statistics.setdefault(key, RuleStatistics()))
+      for key, match_func in match_items]
+    match_entries.sort(key=lambda match_entry: match_entry[1].cost)
+    
+    match_funcs = [match_func for match_func, unused_ in match_entries]
+    num_remaining_samples = [self.NUM_STATISTICS_SAMPLES]
+    
+    def _is_match_all_collect_statistics(object_to_match):
+      is_match = True
+      for match_func, rule_statistics in match_entries:
+        start_time = timeit.default_timer()
+        is_match = match_func(object_to_match)
+        rule_statistics.add(timeit.default_timer() - start_time, not is_match)
+        if not is_match:
+          break
+      
+      num_remaining_samples[0] -= 1
+      if num_remaining_samples[0] <= 0:
+        match_entries.sort(key=lambda match_entry: match_entry[1].cost)
+        match_funcs[:] = [match_func for match_func, unused_ in match_entries]
+      
+      return bool(is_match)
+    
+    def _is_match_all(object_to_match):
+      if num_remaining_samples[0] > 0:
+        return _is_match_all_collect_statistics(object_to_match)
+      
+      for match_func in match_funcs:
+        if not match_func(object_to_match):
+          return False
+      return True
+    
+    return _is_match_all
+  
+  def _add_match_funcs(self, match_type, rules_without_args, rules_with_args, subfilters):
+    """
+    Add (rule function or subfilter name, match function) tuples for the rules
+    and subfilters of this filter to the specified lists. Rules of subfilters
+    with the specified match type are added as if they were part of this filter.
+    
+    Return False if this filter always matches as part of a filter with the
+    specified match type (i.e. an empty subfilter in a `MATCH_ANY` filter),
+    otherwise return True.
+    """
     
     for key, value in self._filter_items.items():
       if isinstance(value, ObjectFilter):
-        is_match = is_match or value.is_match(object_to_match)
+        if not value._filter_items:
+          # An empty subfilter always matches.
+          if match_type == self.MATCH_ANY:
+            return False
+        elif value.match_type == match_type:
+          if not value._add_match_funcs(match_type, rules_without_args, rules_with_args, subfilters):
+            return False
+        else:
+          subfilters.append((key, value.compile()))
       else:
         # key = rule_func, value = rule_func_args
-        is_match = is_match or key(object_to_match, *value)
-      if is_match:
-        break
+        if value:
+          rules_with_args.append((key, _get_rule_func_with_args(key, value)))
+        else:
+          rules_without_args.append((key, key))
     
-    return is_match
+    return True
+
+
+class RuleStatistics(object):
+  
+  """
+  This class stores statistics of a filter rule (or subfilter) collected when
+  matching objects.
+  
+  Attributes:
+  
+  * `num_calls` (read-only) - Number of objects the rule was evaluated for.
+  
+  * `num_rejections` (read-only) - Number of objects not matching the rule.
+  
+  * `total_time` (read-only) - Total time in seconds spent evaluating the rule.
+  
+  * `mean_time` (read-only) - Average time in seconds per evaluation.
+  
+  * `rejection_rate` (read-only) - Fraction of objects not matching the rule.
+  
+  * `cost` (read-only) - Expected time spent evaluating the rule per rejected
+    object. Rules with a lower cost are evaluated first in `MATCH_ALL` filters.
+    Rules that were not evaluated yet have zero cost, rules that never rejected
+    an object have infinite cost.
+  """
+  
+  def __init__(self):
+    self._num_calls = 0
+    self._num_rejections = 0
+    self._total_time = 0.0
+  
+  @property
+  def num_calls(self):
+    return self._num_calls
+  
+  @property
+  def num_rejections(self):
+    return self._num_rejections
+  
+  @property
+  def total_time(self):
+    return self._total_time
+  
+  @property
+  def mean_time(self):
+    return self._total_time / self._num_calls if self._num_calls else 0.0
+  
+  @property
+  def rejection_rate(self):
+    return self._num_rejections / self._num_calls if self._num_calls else 0.0
+  
+  @property
+  def cost(self):
+    if not self._num_calls:
+      return (0.0, 0.0)
+    elif not self._num_rejections:
+      return (float('inf'), self.mean_time)
+    else:
+      return (self.mean_time / self.rejection_rate, self.mean_time)
+  
+  def add(self, elapsed_time, is_rejected):
+    self._num_calls += 1
+    self._num_rejections += int(is_rejected)
+    self._total_time += elapsed_time
+
+#===============================================================================
+
+def _is_match_always(object_to_match):
+  return True
+
+
+def _get_rule_func_with_args(rule_func, rule_func_args):
+  def _rule_func_with_args(object_to_match):
+    return rule_func(object_to_match, *rule_func_args)
+  
+  return _rule_func_with_args
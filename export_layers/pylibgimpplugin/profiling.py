@@ -0,0 +1,287 @@
+#-------------------------------------------------------------------------------
+#
+# This file is part of pylibgimpplugin.
+#
+# Copyright (C) 2014 khalim19 <khalim19@gmail.com>
+#
+# pylibgimpplugin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pylibgimpplugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pylibgimpplugin.  If not, see <http://www.gnu.org/licenses/>.
+#
+#-------------------------------------------------------------------------------
+
+"""
+This module defines a class to measure the wall time and the number of calls of
+named stages of a computation, and proxies to measure and trace GIMP PDB
+procedure calls.
+"""
+
+#===============================================================================
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+str = unicode
+
+#===============================================================================
+
+import timeit
+import json
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+#===============================================================================
+
+class Profiler(object):
+  
+  """
+  This class records the wall time and the number of calls of named stages,
+  grouped into categories (e.g. processing steps and PDB procedures).
+  
+  Statistics are aggregated in total and, optionally, per item (e.g. per layer).
+  
+  Attributes:
+  
+  * `record_per_item` - If True, record statistics per item in addition to the
+    total statistics.
+  
+  * `current_item` - Name of the item that subsequently recorded stages belong
+    to. If None, stages are only recorded in the total statistics.
+  
+  * `stats` (read-only) - Total statistics as a dict:
+    
+      {category: {stage name: {'count': number of calls, 'time': wall time in seconds}}}
+  
+  * `item_stats` (read-only) - Statistics per item as a dict:
+    
+      {item name: {category: {stage name: {'count': ..., 'time': ...}}}}
+  """
+  
+  def __init__(self, record_per_item=False):
+    self.record_per_item = record_per_item
+    self.current_item = None
+    
+    self._stats = OrderedDict()
+    self._item_stats = OrderedDict()
+  
+  @property
+  def stats(self):
+    return self._stats
+  
+  @property
+  def item_stats(self):
+    return self._item_stats
+  
+  def reset(self):
+    """
+    Remove all recorded statistics.
+    """
+    
+    self.current_item = None
+    self._stats = OrderedDict()
+    self._item_stats = OrderedDict()
+  
+  def add(self, category, name, elapsed_time):
+    """
+    Record one call of the stage `name` in the specified category that took
+    `elapsed_time` seconds.
+    """
+    
+    self._add(self._stats, category, name, elapsed_time)
+    
+    if self.record_per_item and self.current_item is not None:
+      if self.current_item not in self._item_stats:
+        self._item_stats[self.current_item] = OrderedDict()
+      self._add(self._item_stats[self.current_item], category, name, elapsed_time)
+  
+  @contextmanager
+  def stage(self, category, name):
+    """
+    Measure the wall time of the enclosing block of code. Use as a context
+    manager:
+      
+      with profiler.stage('stages', 'export'):
+        # do stuff
+    """
+    
+    start_time = timeit.default_timer()
+    try:
+      yield
+    finally:
+      self.add(category, name, timeit.default_timer() - start_time)
+  
+  def wrap(self, category, name, func):
+    """
+    Return a function that calls `func` and records the call as a stage.
+    """
+    
+    def _profiled_func(*args, **kwargs):
+      start_time = timeit.default_timer()
+      try:
+        return func(*args, **kwargs)
+      finally:
+        self.add(category, name, timeit.default_timer() - start_time)
+    
+    return _profiled_func
+  
+  def to_dict(self):
+    profile = OrderedDict([('total', self._stats)])
+    if self.record_per_item:
+      profile['items'] = self._item_stats
+    return profile
+  
+  def to_json(self, **json_kwargs):
+    """
+    Return the statistics as a JSON string. `json_kwargs` are passed to
+    `json.dumps`.
+    """
+    
+    return json.dumps(self.to_dict(), **json_kwargs)
+  
+  def dump(self, filename):
+    """
+    Write the statistics in the JSON format to the specified file.
+    """
+    
+    with open(filename, 'w') as json_file:
+      json.dump(self.to_dict(), json_file, indent=2)
+  
+  def _add(self, stats, category, name, elapsed_time):
+    if category not in stats:
+      stats[category] = OrderedDict()
+    if name not in stats[category]:
+      stats[category][name] = OrderedDict([('count', 0), ('time', 0.0)])
+    
+    stats[category][name]['count'] += 1
+    stats[category][name]['time'] += elapsed_time
+
+#===============================================================================
+
+class ProfilingPDB(object):
+  
+  """
+  This class is a proxy to the GIMP procedural database (PDB) that records each
+  procedure call in a `Profiler` under the specified category.
+  """
+  
+  def __init__(self, pdb, profiler, category='pdb'):
+    self._pdb = pdb
+    self._profiler = profiler
+    self._category = category
+  
+  def __getattr__(self, name):
+    return self._profiler.wrap(self._category, name, getattr(self._pdb, name))
+
+
+class TracingPDB(object):
+  
+  """
+  This class is a proxy to the GIMP procedural database (PDB) that counts and
+  times each procedure call via an internal `Profiler` and optionally logs the
+  call with its arguments.
+  
+  Attributes:
+  
+  * `log_calls` - If True, append each call to `calls`.
+  
+  * `stats` (read-only) - Statistics as a dict:
+    
+      {procedure name: {'count': number of calls, 'time': wall time in seconds}}
+  
+  * `calls` (read-only) - List of logged calls as
+    (procedure name, positional arguments, keyword arguments) tuples.
+  
+  * `num_calls` (read-only) - Total number of procedure calls.
+  """
+  
+  _CATEGORY = 'pdb'
+  
+  def __init__(self, pdb, log_calls=False):
+    self.log_calls = log_calls
+    
+    self._pdb = pdb
+    self._profiler = Profiler()
+    self._calls = []
+    self._num_calls = 0
+  
+  @property
+  def stats(self):
+    return self._profiler.stats.get(self._CATEGORY, OrderedDict())
+  
+  @property
+  def calls(self):
+    return self._calls
+  
+  @property
+  def num_calls(self):
+    return self._num_calls
+  
+  def reset(self):
+    """
+    Remove all recorded statistics and logged calls.
+    """
+    
+    self._profiler.reset()
+    self._calls = []
+    self._num_calls = 0
+  
+  def __getattr__(self, name):
+    profiled_procedure = self._profiler.wrap(self._CATEGORY, name, getattr(self._pdb, name))
+    
+    def _traced_procedure(*args, **kwargs):
+      if self.log_calls:
+        self._calls.append((name, args, kwargs))
+      
+      self._num_calls += 1
+      return profiled_procedure(*args, **kwargs)
+    
+    return _traced_procedure
+
+#===============================================================================
+
+@contextmanager
+def replace_pdb(modules, get_new_pdb):
+  """
+  Temporarily replace the `pdb` attribute in the specified modules. Use as a
+  context manager:
+    
+    with replace_pdb([module1, module2], lambda orig_pdb: TracingPDB(orig_pdb)):
+      # do stuff
+  
+  `get_new_pdb` is a function that takes the original `pdb` attribute of a
+  module and returns the object to replace it with.
+  """
+  
+  orig_pdbs = [module.pdb for module in modules]
+  for module, orig_pdb in zip(modules, orig_pdbs):
+    module.pdb = get_new_pdb(orig_pdb)
+  
+  try:
+    yield
+  finally:
+    for module, orig_pdb in zip(modules, orig_pdbs):
+      module.pdb = orig_pdb
+
+
+def profile_pdb(profiler, modules, category='pdb'):
+  """
+  Temporarily replace the `pdb` attribute in the specified modules with a
+  `ProfilingPDB` proxy. Use as a context manager:
+    
+    with profile_pdb(profiler, [module1, module2]):
+      # do stuff
+  """
+  
+  return replace_pdb(modules, lambda orig_pdb: ProfilingPDB(orig_pdb, profiler, category))
@@ -35,6 +35,7 @@ str = unicode
 
 #===============================================================================
 
+import hashlib
 from contextlib import contextmanager
 
 import gimp
@@ -111,6 +112,45 @@ def is_layer_inside_image(image, layer):
           (-image.height < layer.offsets[1] < image.height))
 
 
+def get_pixel_data(drawable):
+  """
+  Return the pixel data of the entire drawable as a string of bytes.
+  """
+  
+  pixel_region = drawable.get_pixel_rgn(0, 0, drawable.width, drawable.height, False, False)
+  return pixel_region[0:drawable.width, 0:drawable.height]
+
+
+def get_layer_fingerprint(layer):
+  """
+  Return a hexadecimal digest of the specified layer that changes whenever the
+  appearance of the layer changes - its pixel data, layer mask or attributes
+  (size, offsets, mode, opacity, visibility).
+  
+  For layer groups, the digest is computed from the attributes of the group and
+  all of its child layers.
+  """
+  
+  fingerprint = hashlib.sha1()
+  _update_layer_fingerprint(fingerprint, layer)
+  return fingerprint.hexdigest()
+
+
+def _update_layer_fingerprint(fingerprint, layer):
+  fingerprint.update(
+    str((layer.tattoo, layer.width, layer.height, layer.offsets, layer.mode,
+         layer.opacity, layer.visible)).encode('utf-8')
+  )
+  
+  if pdb.gimp_item_is_group(layer):
+    for child in layer.children:
+      _update_layer_fingerprint(fingerprint, child)
+  else:
+    fingerprint.update(get_pixel_data(layer))
+    if layer.mask is not None:
+      fingerprint.update(get_pixel_data(layer.mask))
+
+
 def remove_all_layers(image):
   """
   Remove all layers from the specified image.
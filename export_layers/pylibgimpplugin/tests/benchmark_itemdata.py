@@ -0,0 +1,257 @@
+#-------------------------------------------------------------------------------
+#
+# This file is part of pylibgimpplugin.
+#
+# Copyright (C) 2014 khalim19 <khalim19@gmail.com>
+#
+# pylibgimpplugin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pylibgimpplugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pylibgimpplugin.  If not, see <http://www.gnu.org/licenses/>.
+#
+#-------------------------------------------------------------------------------
+
+"""
+This module benchmarks the `itemdata` module on synthetic item trees of varying
+depth and breadth built from `gimpmocks` objects.
+
+This is not a unit test module. To run the benchmarks, call `run_benchmarks()`
+(e.g. from the GIMP Python-Fu console) or run
+`python -m <package>.pylibgimpplugin.tests.benchmark_itemdata` if the GIMP
+modules can be imported.
+"""
+
+#===============================================================================
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+str = unicode
+
+#===============================================================================
+
+import sys
+import operator
+import timeit
+
+from ..lib import mock
+from . import gimpmocks
+
+from .. import itemdata
+from .. import objectfilter
+
+#===============================================================================
+
+# `__name__` is "__main__" if this module is run as a script (via `python -m`),
+# while `__package__` is set either way (by the relative imports above).
+LIB_NAME = __package__.rpartition('.')[0]
+
+# (description, depth, number of layers per group, number of subgroups per group)
+ITEM_TREE_SHAPES = [
+  ("flat", 1, 10000, 0),
+  ("deep", 1000, 10, 1),
+  ("balanced", 4, 8, 8),
+  ("wide groups", 2, 100, 100),
+]
+
+#===============================================================================
+
+def create_image(depth, num_layers_per_group, num_groups_per_group):
+  """
+  Return a `gimpmocks.MockImage` whose item tree has the specified depth. The
+  image and each group (except those at the deepest level) contain the
+  specified number of layers and subgroups.
+  """
+  
+  image = gimpmocks.MockImage("image")
+  image.layers = []
+  num_items = 0
+  
+  # The tree is built iteratively, since it can be deeper than the recursion limit.
+  groups_to_fill = [(image.layers, None, 1)]
+  while groups_to_fill:
+    items, parent, level = groups_to_fill.pop()
+    
+    for unused_ in range(num_layers_per_group):
+      num_items += 1
+      layer = gimpmocks.MockLayer("Layer " + str(num_items))
+      layer.parent = parent
+      items.append(layer)
+    
+    if level < depth:
+      for unused_ in range(num_groups_per_group):
+        num_items += 1
+        group = gimpmocks.MockLayerGroup("Group " + str(num_items))
+        group.parent = parent
+        items.append(group)
+        groups_to_fill.append((group.layers, group, level + 1))
+  
+  return image
+
+
+def benchmark_fill_item_data(image, number=3):
+  """
+  Return the best time in seconds out of `number` runs to create a `LayerData`
+  instance from the specified image.
+  """
+  
+  return min(timeit.repeat(lambda: itemdata.LayerData(image), number=1, repeat=number))
+
+
+def get_memory_per_element(item_data):
+  """
+  Return the average number of bytes occupied by an `_ItemDataElement` object
+  in the specified item data, including its attribute dictionary (if any). Item
+  names and the wrapped `gimp.Item` objects are not counted.
+  """
+  
+  total_size = 0
+  
+  for item_elem in item_data:
+    total_size += sys.getsizeof(item_elem)
+    if hasattr(item_elem, '__dict__'):
+      total_size += sys.getsizeof(item_elem.__dict__)
+  
+  return total_size / len(item_data)
+
+
+@objectfilter.subtree_rule
+@objectfilter.bulk_rule(lambda columns: columns.path_visible)
+def is_path_visible(item_elem):
+  return item_elem.path_visible
+
+
+@objectfilter.bulk_rule(
+  lambda columns: map(operator.eq, columns.item_types, [columns.ITEM] * len(columns)))
+def is_layer(item_elem):
+  return item_elem.item_type == item_elem.ITEM
+
+
+@objectfilter.bulk_rule(
+  lambda columns: map(operator.not_, map(operator.contains, columns.names, ["."] * len(columns))))
+def has_no_file_extension(item_elem):
+  return "." not in item_elem.name
+
+
+def benchmark_skip_hidden_group(num_hidden_layers, is_lazy, number=3):
+  """
+  Return the best time in seconds out of `number` runs to create a `LayerData`
+  instance and iterate over visible layers of an image with a few visible
+  top-level layers and one hidden group containing `num_hidden_layers` layers.
+  """
+  
+  image = create_image(1, 10, 0)
+  hidden_group = gimpmocks.MockLayerGroup("Hidden group", visible=False)
+  hidden_group.layers = [
+    gimpmocks.MockLayer("Hidden layer " + str(i)) for i in range(num_hidden_layers)]
+  for layer in hidden_group.layers:
+    layer.parent = hidden_group
+  image.layers.append(hidden_group)
+  
+  def _iterate_visible_layers():
+    layer_data = itemdata.LayerData(image, is_filtered=True, is_lazy=is_lazy)
+    layer_data.filter.add_rule(is_path_visible)
+    for unused_ in layer_data:
+      pass
+  
+  return min(timeit.repeat(_iterate_visible_layers, number=1, repeat=number))
+
+
+def benchmark_filter_item_data(image, use_bulk_filtering, number=3):
+  """
+  Return the best time in seconds out of `number` runs to filter the items of
+  the specified image (without obtaining the items themselves) using rules
+  similar to those used when exporting layers.
+  """
+  
+  layer_data = itemdata.LayerData(image, is_filtered=True, use_bulk_filtering=use_bulk_filtering)
+  layer_data.filter.add_rule(is_layer)
+  layer_data.filter.add_rule(is_path_visible)
+  layer_data.filter.add_rule(has_no_file_extension)
+  layer_data.filter.add_subfilter(
+    "top-level", objectfilter.ObjectFilter(objectfilter.ObjectFilter.MATCH_ANY))
+  layer_data.filter["top-level"].add_rule(is_layer)
+  
+  def _filter_item_data():
+    # Invalidate the cached filtered items.
+    layer_data.filter["top-level"].add_rule(is_path_visible)
+    layer_data.filter["top-level"].remove_rule(is_path_visible)
+    len(layer_data)
+  
+  _filter_item_data()
+  
+  return min(timeit.repeat(_filter_item_data, number=1, repeat=number))
+
+
+def benchmark_uniquify_names(num_layers, include_item_path=True, number=3):
+  """
+  Return the best time in seconds out of `number` runs to uniquify the names of
+  `num_layers` top-level layers, all having the same name.
+  """
+  
+  image = gimpmocks.MockImage("image")
+  image.layers = [gimpmocks.MockLayer("Layer #" + str(i)) for i in range(num_layers)]
+  
+  elapsed_times = []
+  for unused_ in range(number):
+    layer_data = itemdata.LayerData(image)
+    
+    start_time = timeit.default_timer()
+    for layer_elem in layer_data:
+      layer_elem.name = "Layer.png"
+      layer_data.uniquify_name(layer_elem, include_item_path, place_before_file_extension=True)
+    elapsed_times.append(timeit.default_timer() - start_time)
+  
+  return min(elapsed_times)
+
+
+@mock.patch(LIB_NAME + '.itemdata.pdb', new=gimpmocks.MockPDB())
+def run_benchmarks(stream=sys.stdout):
+  for description, depth, num_layers_per_group, num_groups_per_group in ITEM_TREE_SHAPES:
+    image = create_image(depth, num_layers_per_group, num_groups_per_group)
+    layer_data = itemdata.LayerData(image)
+    num_items = len(layer_data)
+    
+    elapsed_time = benchmark_fill_item_data(image)
+    print(
+      "{0} (depth {1}, {2} items): {3:.4f} s, {4:.1f} bytes per element".format(
+        description, depth, num_items, elapsed_time, get_memory_per_element(layer_data)),
+      file=stream)
+  
+  for is_lazy in [False, True]:
+    elapsed_time = benchmark_skip_hidden_group(10000, is_lazy)
+    print(
+      "skip hidden group with 10000 layers (lazy: {0}): {1:.4f} s".format(is_lazy, elapsed_time),
+      file=stream)
+  
+  image = create_image(2, 100, 1000)
+  num_items = len(itemdata.LayerData(image))
+  for use_bulk_filtering in [False, True]:
+    elapsed_time = benchmark_filter_item_data(image, use_bulk_filtering)
+    print(
+      "filter {0} items (bulk filtering: {1}): {2:.4f} s".format(
+        num_items, use_bulk_filtering, elapsed_time),
+      file=stream)
+  
+  for num_layers in [1000, 5000]:
+    for include_item_path in [True, False]:
+      elapsed_time = benchmark_uniquify_names(num_layers, include_item_path)
+      print(
+        "uniquify {0} identical names (include item path: {1}): {2:.4f} s".format(
+          num_layers, include_item_path, elapsed_time),
+        file=stream)
+
+#===============================================================================
+
+if __name__ == "__main__":
+  run_benchmarks()
@@ -0,0 +1,167 @@
+#-------------------------------------------------------------------------------
+#
+# This file is part of pylibgimpplugin.
+#
+# Copyright (C) 2014 khalim19 <khalim19@gmail.com>
+#
+# pylibgimpplugin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pylibgimpplugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pylibgimpplugin.  If not, see <http://www.gnu.org/licenses/>.
+#
+#-------------------------------------------------------------------------------
+
+"""
+This module benchmarks matching objects against an `ObjectFilter` containing
+rules and nested subfilters.
+
+This is not a unit test module. To run the benchmarks, call `run_benchmarks()`
+(e.g. from the GIMP Python-Fu console) or run
+`python -m <package>.pylibgimpplugin.tests.benchmark_objectfilter`.
+"""
+
+#===============================================================================
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+str = unicode
+
+#===============================================================================
+
+import sys
+import timeit
+
+from ..objectfilter import ObjectFilter
+
+from .test_objectfilter import FilterableObject
+from .test_objectfilter import has_matching_file_extension, has_red_color, has_green_color
+from .test_objectfilter import is_empty, is_object_id_even
+
+#===============================================================================
+
+def is_not_empty(obj):
+  return not obj.is_empty
+
+
+def create_filter():
+  """
+  Return a `MATCH_ALL` filter with two rules and a `MATCH_ANY` subfilter, which
+  is similar to the filter used to export layers.
+  """
+  
+  filter_ = ObjectFilter(ObjectFilter.MATCH_ALL)
+  filter_.add_rule(is_not_empty)
+  filter_.add_rule(has_matching_file_extension, 'png', True)
+  filter_.add_subfilter('colors', ObjectFilter(ObjectFilter.MATCH_ANY))
+  filter_['colors'].add_rule(has_red_color)
+  filter_['colors'].add_rule(has_green_color)
+  filter_['colors'].add_rule(is_object_id_even)
+  
+  return filter_
+
+
+def has_name_checksum(obj):
+  return sum(ord(char) for char in obj.name) >= 0
+
+
+def create_filter_with_expensive_rule(optimize_rule_order):
+  """
+  Return a `MATCH_ALL` filter with an expensive rule matching every object and
+  a cheap rule rejecting most objects.
+  """
+  
+  filter_ = ObjectFilter(ObjectFilter.MATCH_ALL, optimize_rule_order=optimize_rule_order)
+  filter_.add_rule(has_name_checksum)
+  filter_.add_rule(is_empty)
+  
+  return filter_
+
+
+def create_objects(num_objects):
+  colors = [set(), {"red"}, {"green"}, {"blue"}]
+  file_extensions = ['png', 'jpg']
+  
+  return [
+    FilterableObject(
+      i, "Object {0}.{1}".format(i, file_extensions[i % 2]), is_empty=(i % 7 == 0),
+      colors=colors[i % len(colors)])
+    for i in range(num_objects)]
+
+
+def is_match_without_compiling(filter_, object_to_match):
+  """
+  Return the same result as `filter_.is_match(object_to_match)` by evaluating
+  the rules and subfilters one by one, as the filter did before compiling was
+  introduced.
+  """
+  
+  if not filter_._filter_items:
+    return True
+  
+  if filter_.match_type == ObjectFilter.MATCH_ALL:
+    for key, value in filter_._filter_items.items():
+      if isinstance(value, ObjectFilter):
+        if not is_match_without_compiling(value, object_to_match):
+          return False
+      elif not key(object_to_match, *value):
+        return False
+    return True
+  else:
+    for key, value in filter_._filter_items.items():
+      if isinstance(value, ObjectFilter):
+        if is_match_without_compiling(value, object_to_match):
+          return True
+      elif key(object_to_match, *value):
+        return True
+    return False
+
+
+def benchmark_match(objects, is_match_func, number=3):
+  """
+  Return the best time in seconds out of `number` runs to match all objects
+  using the specified function.
+  """
+  
+  return min(timeit.repeat(lambda: [is_match_func(obj) for obj in objects], number=1, repeat=number))
+
+
+def run_benchmarks(stream=sys.stdout, num_objects=100000):
+  filter_ = create_filter()
+  objects = create_objects(num_objects)
+  
+  is_match_funcs = [
+    ("without compiling", lambda obj: is_match_without_compiling(filter_, obj)),
+    ("is_match()", filter_.is_match),
+    ("compile()", filter_.compile()),
+  ]
+  
+  for description, is_match_func in is_match_funcs:
+    elapsed_time = benchmark_match(objects, is_match_func)
+    print(
+      "{0}: {1:.4f} s, {2:.3f} us per object".format(
+        description, elapsed_time, elapsed_time / num_objects * 1e6),
+      file=stream)
+  
+  for optimize_rule_order in [False, True]:
+    filter_ = create_filter_with_expensive_rule(optimize_rule_order)
+    elapsed_time = benchmark_match(objects, filter_.compile())
+    print(
+      "expensive rule (optimize rule order: {0}): {1:.4f} s, {2:.3f} us per object".format(
+        optimize_rule_order, elapsed_time, elapsed_time / num_objects * 1e6),
+      file=stream)
+
+#===============================================================================
+
+if __name__ == "__main__":
+  run_benchmarks()
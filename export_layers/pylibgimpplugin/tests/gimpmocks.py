@@ -44,7 +44,7 @@ class MockPDB(object):
     self._attr_name = name
     return self._call
   
-  def _call(self, *args):
+  def _call(self, *args, **kwargs):
     return self._attr_name
   
   def gimp_image_new(self, width, height, image_type):
@@ -61,6 +61,57 @@ class MockPDB(object):
   def gimp_image_is_valid(self, image):
     return image.valid
   
+  def gimp_image_duplicate(self, image):
+    image_new = MockImage(image.name.decode())
+    image_new.width = image.width
+    image_new.height = image.height
+    image_new.image_type = image.image_type
+    image_new.layers = [self.gimp_layer_new_from_drawable(layer, image_new) for layer in image.layers]
+    
+    return image_new
+  
+  def gimp_image_insert_layer(self, image, layer, parent, position):
+    layers = parent.layers if parent is not None else image.layers
+    layers.insert(position, layer)
+    layer.parent = parent
+    layer.image = image
+  
+  def gimp_image_remove_layer(self, image, layer):
+    # Like in GIMP, the list of layers must not change while being iterated over.
+    if layer.parent is not None:
+      layer.parent.layers = [layer_ for layer_ in layer.parent.layers if layer_ != layer]
+    else:
+      image.layers = [layer_ for layer_ in image.layers if layer_ != layer]
+  
+  def gimp_image_get_item_position(self, image, item):
+    layers = item.parent.layers if item.parent is not None else image.layers
+    return layers.index(item)
+  
+  def gimp_image_merge_visible_layers(self, image, merge_type):
+    layer = MockLayer(image.layers[0].name.decode() if image.layers else None)
+    image.layers = [layer]
+    layer.image = image
+    
+    return layer
+  
+  def gimp_layer_new_from_drawable(self, drawable, image):
+    layer = type(drawable)(drawable.name.decode(), visible=drawable.visible)
+    layer.width = drawable.width
+    layer.height = drawable.height
+    layer.offsets = drawable.offsets
+    layer.mode = drawable.mode
+    layer.opacity = drawable.opacity
+    layer.pixel_value = drawable.pixel_value
+    if isinstance(drawable, MockLayerGroup):
+      layer.layers = [self.gimp_layer_new_from_drawable(child, image) for child in drawable.layers]
+      for child in layer.layers:
+        child.parent = layer
+    
+    return layer
+  
+  def gimp_layer_copy(self, layer, add_alpha):
+    return self.gimp_layer_new_from_drawable(layer, layer.image)
+  
   def gimp_item_is_group(self, item):
     return type(item) == MockLayerGroup
   
@@ -76,6 +127,8 @@ class MockImage(object):
     self.height = 0
     self.image_type = None
     self.layers = []
+    self.channels = []
+    self.vectors = []
     self.name = name.encode() if name is not None else b""
     self.filename = b""
     self.uri = b""
@@ -86,14 +139,25 @@ class MockItem(object):
   
   def __init__(self, name=None, visible=True):
     self.ID = 0
+    self.tattoo = 0
     self.width = 0
     self.height = 0
     self.valid = True
     self.visible = visible
     self.offsets = (0, 0)
+    self.mode = 0
+    self.opacity = 100.0
+    self.mask = None
+    self.bpp = 4
+    self.is_indexed = False
+    # Value of each byte of the pixel data.
+    self.pixel_value = b"\x00"
     self.name = name.encode() if name is not None else b""
     self.image = None
     self.children = []
+  
+  def get_pixel_rgn(self, x, y, width, height, dirty=True, shadow=False):
+    return MockPixelRegion(self, x, y, width, height)
 
 
 class MockLayer(MockItem):
@@ -118,6 +182,21 @@ class MockLayerGroup(MockLayer):
     self.children = val
 
 
+class MockPixelRegion(object):
+  
+  def __init__(self, drawable, x, y, width, height):
+    self.drawable = drawable
+    self.x = x
+    self.y = y
+    self.w = width
+    self.h = height
+  
+  def __getitem__(self, key):
+    # All pixels have the same value, black and transparent by default.
+    x_slice, y_slice = key
+    return self.drawable.pixel_value * ((x_slice.stop - x_slice.start) * (y_slice.stop - y_slice.start) * self.drawable.bpp)
+
+
 class MockGimpShelf(object):
   
   def __init__(self):
@@ -0,0 +1,112 @@
+#-------------------------------------------------------------------------------
+#
+# This file is part of pylibgimpplugin.
+#
+# Copyright (C) 2014 khalim19 <khalim19@gmail.com>
+#
+# pylibgimpplugin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pylibgimpplugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pylibgimpplugin.  If not, see <http://www.gnu.org/licenses/>.
+#
+#-------------------------------------------------------------------------------
+
+#===============================================================================
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+str = unicode
+
+#===============================================================================
+
+import os
+import shutil
+import struct
+import tempfile
+import zlib
+
+import unittest
+
+from ..lib import mock
+
+from .. import encoders
+
+#===============================================================================
+
+def _parse_png_chunks(png_data):
+  chunks = []
+  position = len(b"\x89PNG\r\n\x1a\n")
+  while position < len(png_data):
+    chunk_length, = struct.unpack(b">I", png_data[position:position + 4])
+    chunk_type = png_data[position + 4:position + 8]
+    chunk_data = png_data[position + 8:position + 8 + chunk_length]
+    crc, = struct.unpack(b">I", png_data[position + 8 + chunk_length:position + 12 + chunk_length])
+    chunks.append((chunk_type, chunk_data, crc == zlib.crc32(chunk_type + chunk_data) & 0xffffffff))
+    position += 12 + chunk_length
+  
+  return chunks
+
+#===============================================================================
+
+class TestEncodePNG(unittest.TestCase):
+  
+  def setUp(self):
+    # 3x2 RGBA image
+    self.pixel_data = b"".join(chr(i) for i in range(3 * 2 * 4))
+  
+  def test_encode_png(self):
+    png_data = encoders.encode_png(self.pixel_data, 3, 2, 4)
+    
+    self.assertTrue(png_data.startswith(b"\x89PNG\r\n\x1a\n"))
+    
+    chunks = _parse_png_chunks(png_data)
+    self.assertEqual([chunk_type for chunk_type, unused_, unused_ in chunks], [b"IHDR", b"IDAT", b"IEND"])
+    self.assertTrue(all(is_crc_valid for unused_, unused_, is_crc_valid in chunks))
+    
+    self.assertEqual(struct.unpack(b">IIBBBBB", chunks[0][1]), (3, 2, 8, 6, 0, 0, 0))
+    self.assertEqual(
+      zlib.decompress(chunks[1][1]),
+      b"\x00" + self.pixel_data[:12] + b"\x00" + self.pixel_data[12:])
+  
+  def test_encode_png_color_types(self):
+    for num_channels, color_type in [(1, 0), (2, 4), (3, 2), (4, 6)]:
+      png_data = encoders.encode_png(self.pixel_data[:3 * 2 * num_channels], 3, 2, num_channels)
+      self.assertEqual(struct.unpack(b">IIBBBBB", _parse_png_chunks(png_data)[0][1])[3], color_type)
+
+
+class TestWriteImageFile(unittest.TestCase):
+  
+  def setUp(self):
+    self.temp_directory = tempfile.mkdtemp()
+  
+  def tearDown(self):
+    shutil.rmtree(self.temp_directory)
+  
+  def test_write_image_file(self):
+    filename = os.path.join(self.temp_directory, "image.data")
+    encoders.write_image_file(filename, encoders.encode_raw, b"\x01\x02\x03", 1, 1, 3)
+    
+    with open(filename, 'rb') as image_file:
+      self.assertEqual(image_file.read(), b"\x01\x02\x03")
+    
+    self.assertEqual(os.listdir(self.temp_directory), ["image.data"])
+  
+  def test_write_image_file_failed(self):
+    filename = os.path.join(self.temp_directory, "image.data")
+    
+    with mock.patch.object(encoders.libfiles, 'replace_file', side_effect=OSError(13, "Permission denied")):
+      with self.assertRaises(OSError):
+        encoders.write_image_file(filename, encoders.encode_raw, b"\x01\x02\x03", 1, 1, 3)
+    
+    self.assertEqual(os.listdir(self.temp_directory), [])
@@ -51,3 +51,16 @@ class TestMockPDB(unittest.TestCase):
     self.assertEqual(self.pdb.plug_in_autocrop(), b"plug_in_autocrop")
     self.assertEqual(self.pdb.plug_in_autocrop("some random args", 1, 2, 3),
                      b"plug_in_autocrop")
+  
+  def test_duplicate_and_remove_layers(self):
+    image = gimpmocks.MockImage()
+    image.layers = [gimpmocks.MockLayer("layer1"), gimpmocks.MockLayer("layer2")]
+    
+    image_copy = self.pdb.gimp_image_duplicate(image)
+    self.assertEqual([layer.name for layer in image_copy.layers], [b"layer1", b"layer2"])
+    self.assertNotEqual(image_copy.layers[0], image.layers[0])
+    
+    for layer in image_copy.layers:
+      self.pdb.gimp_image_remove_layer(image_copy, layer)
+    self.assertEqual(image_copy.layers, [])
+    self.assertEqual(len(image.layers), 2)
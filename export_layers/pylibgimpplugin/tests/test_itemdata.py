@@ -47,6 +47,8 @@ from ..lib import mock
 from . import gimpmocks
 
 from .. import itemdata
+from .. import objectfilter
+from ..objectfilter import ObjectFilter
 
 #===============================================================================
 
@@ -65,12 +67,17 @@ class LayerFilterRules(object):
     return layer_elem.item_type in (layer_elem.ITEM, layer_elem.EMPTY_GROUP)
   
   @staticmethod
+  @objectfilter.subtree_rule
   def is_path_visible(layer_elem):
     return layer_elem.path_visible
   
   @staticmethod
   def has_matching_file_extension(layer_elem, file_extension):
     return layer_elem.name.endswith('.' + file_extension)
+  
+  @staticmethod
+  def is_not_named(layer_elem, name):
+    return layer_elem.orig_name != name
 
 #===============================================================================
 
@@ -164,6 +171,193 @@ class TestLayerData(unittest.TestCase):
     self.layer_data.filter.add_rule(LayerFilterRules.is_layer)
     self.assertEqual(len(self.layer_data), layer_count_only_layers)
   
+  def test_filtered_items_are_cached(self):
+    matched_layer_elems = []
+    
+    def is_layer_counted(layer_elem):
+      matched_layer_elems.append(layer_elem)
+      return LayerFilterRules.is_layer(layer_elem)
+    
+    self.layer_data.is_filtered = True
+    self.layer_data.filter.add_rule(is_layer_counted)
+    
+    self.assertEqual(len(self.layer_data), 13)
+    self.assertEqual(len(list(self.layer_data)), 13)
+    self.assertEqual(len(matched_layer_elems), 20)
+  
+  def test_filtered_items_are_updated_on_filter_change(self):
+    self.layer_data.is_filtered = True
+    self.layer_data.filter.add_rule(LayerFilterRules.is_layer)
+    self.assertEqual(len(self.layer_data), 13)
+    
+    with self.layer_data.filter.add_rule_temp(LayerFilterRules.has_matching_file_extension, 'jpg'):
+      self.assertEqual(len(self.layer_data), 1)
+    self.assertEqual(len(self.layer_data), 13)
+    
+    self.layer_data.filter.add_subfilter(
+      'subfilter', ObjectFilter(ObjectFilter.MATCH_ANY))
+    self.assertEqual(len(self.layer_data), 13)
+    self.layer_data.filter['subfilter'].add_rule(
+      LayerFilterRules.has_matching_file_extension, 'jpg')
+    self.assertEqual(len(self.layer_data), 1)
+  
+  def test_filtered_items_are_updated_on_name_change(self):
+    self.layer_data.is_filtered = True
+    self.layer_data.filter.add_rule(LayerFilterRules.has_matching_file_extension, 'jpg')
+    self.assertEqual(len(self.layer_data), 1)
+    
+    self.layer_data['top-frame'].name = "top-frame.jpg"
+    self.assertEqual(len(self.layer_data), 2)
+  
+  def test_iterate_order(self):
+    self.assertEqual(
+      [layer_elem.orig_name for layer_elem in self.layer_data],
+      ["Corners", "Corners:", "Frames", "main-background.jpg", "main-background.jpg:",
+       "Overlay", "Corners::", "top-left-corner::::", "main-background.jpg::",
+       "top-left-corner", "top-right-corner", "top-left-corner:", "top-left-corner::",
+       "bottom-right-corner", "bottom-right-corner:", "bottom-left-corner",
+       "top-left-corner:::", "top-frame", "alt-frames", "alt-corners"])
+  
+  @mock.patch(LIB_NAME + '.itemdata.pdb', new=gimpmocks.MockPDB())
+  def test_lazy_iterate_order(self):
+    layer_data = itemdata.LayerData(self.layer_data.image, is_lazy=True)
+    self.assertEqual(
+      [layer_elem.orig_name for layer_elem in layer_data],
+      [layer_elem.orig_name for layer_elem in self.layer_data])
+  
+  def test_group_filter(self):
+    self.layer_data.is_filtered = True
+    self.layer_data.group_filter.add_rule(LayerFilterRules.is_not_named, "Corners")
+    
+    self.assertEqual(
+      [layer_elem.orig_name for layer_elem in self.layer_data],
+      ["Corners", "Corners:", "Frames", "main-background.jpg", "main-background.jpg:",
+       "Overlay", "Corners::", "top-left-corner::::", "main-background.jpg::",
+       "top-left-corner:::", "top-frame", "alt-frames", "alt-corners"])
+    
+    self.layer_data.is_filtered = False
+    self.assertEqual(len(self.layer_data), 20)
+  
+  @mock.patch(LIB_NAME + '.itemdata.pdb', new=gimpmocks.MockPDB())
+  def test_lazy_group_filter_skips_children(self):
+    layer_data = itemdata.LayerData(self.layer_data.image, is_filtered=True, is_lazy=True)
+    layer_data.group_filter.add_rule(LayerFilterRules.is_not_named, "Corners")
+    
+    with mock.patch.object(
+           itemdata.LayerData, '_get_children_from_item', autospec=True,
+           side_effect=lambda layer_data, item: item.layers) as get_children_from_item_mock:
+      self.assertEqual(len(layer_data), 13)
+      self.assertNotIn(
+        "Corners", [call_args[0][1].name for call_args in get_children_from_item_mock.call_args_list])
+    
+    self.assertEqual(layer_data['bottom-right-corner'].parent, layer_data['top-left-corner::'])
+    
+    layer_data.is_filtered = False
+    self.assertEqual(
+      [layer_elem.orig_name for layer_elem in layer_data],
+      [layer_elem.orig_name for layer_elem in self.layer_data])
+  
+  @mock.patch(LIB_NAME + '.itemdata.pdb', new=gimpmocks.MockPDB())
+  def test_subtree_rule_skips_children(self):
+    image = self.layer_data.image
+    image.layers[0].visible = False
+    layer_data = itemdata.LayerData(image, is_filtered=True, is_lazy=True)
+    layer_data.filter.add_rule(LayerFilterRules.is_path_visible)
+    
+    with mock.patch.object(
+           itemdata.LayerData, '_get_children_from_item', autospec=True,
+           side_effect=lambda layer_data, item: item.layers) as get_children_from_item_mock:
+      self.assertEqual(len(layer_data), 12)
+      self.assertNotIn(
+        "Corners", [call_args[0][1].name for call_args in get_children_from_item_mock.call_args_list])
+  
+  @mock.patch(LIB_NAME + '.itemdata.pdb', new=gimpmocks.MockPDB())
+  def test_columns(self):
+    image = self.layer_data.image
+    image.layers[0].visible = False
+    layer_elems = list(itemdata.LayerData(image))
+    columns = itemdata.ItemDataColumns(layer_elems)
+    
+    self.assertEqual(len(columns), 20)
+    self.assertEqual(columns.levels, [layer_elem.level for layer_elem in layer_elems])
+    self.assertEqual(columns.item_types, [layer_elem.item_type for layer_elem in layer_elems])
+    self.assertEqual(columns.path_visible, [layer_elem.path_visible for layer_elem in layer_elems])
+    self.assertEqual(columns.names, [layer_elem.name for layer_elem in layer_elems])
+    
+    layer_elems[0].name = "Corners.jpg"
+    self.assertEqual(columns.names[0], "Corners.jpg")
+    self.assertEqual(
+      columns.get_name_attribute_column(lambda name: name.endswith(".jpg")).count(True), 2)
+  
+  @mock.patch(LIB_NAME + '.itemdata.pdb', new=gimpmocks.MockPDB())
+  def test_bulk_filtering(self):
+    @objectfilter.bulk_rule(
+      lambda columns: [item_type == columns.ITEM for item_type in columns.item_types])
+    def is_layer_bulk(layer_elem):
+      return LayerFilterRules.is_layer(layer_elem)
+    
+    image = self.layer_data.image
+    image.layers[0].visible = False
+    
+    layer_data = itemdata.LayerData(image, is_filtered=True)
+    layer_data_bulk = itemdata.LayerData(image, is_filtered=True, use_bulk_filtering=True)
+    
+    for data in [layer_data, layer_data_bulk]:
+      data.filter.add_rule(is_layer_bulk)
+      data.filter.add_subfilter('subfilter', ObjectFilter(ObjectFilter.MATCH_ANY))
+      data.filter['subfilter'].add_rule(LayerFilterRules.is_path_visible)
+      data.filter['subfilter'].add_rule(LayerFilterRules.has_matching_file_extension, 'jpg')
+    
+    self.assertEqual(
+      [layer_elem.orig_name for layer_elem in layer_data_bulk],
+      [layer_elem.orig_name for layer_elem in layer_data])
+    self.assertEqual(len(layer_data_bulk), 8)
+  
+  def test_parents(self):
+    layer_elem = self.layer_data['bottom-right-corner']
+    
+    self.assertEqual(
+      layer_elem.parents, [self.layer_data['Corners'], self.layer_data['top-left-corner::']])
+    self.assertEqual(layer_elem.parent, self.layer_data['top-left-corner::'])
+    self.assertEqual(layer_elem.level, 2)
+    self.assertEqual(self.layer_data['Corners'].parents, [])
+  
+  @mock.patch(LIB_NAME + '.itemdata.pdb', new=gimpmocks.MockPDB())
+  def test_path_visible(self):
+    image = self.layer_data.image
+    image.layers[0].visible = False
+    layer_data = itemdata.LayerData(image)
+    
+    self.assertFalse(layer_data['Corners'].path_visible)
+    self.assertFalse(layer_data['bottom-right-corner'].path_visible)
+    self.assertTrue(layer_data['top-frame'].path_visible)
+  
+  def test_get_name_attribute(self):
+    processed_names = []
+    
+    def get_upper_name(name):
+      processed_names.append(name)
+      return name.upper()
+    
+    layer_elem = self.layer_data['top-frame']
+    self.assertEqual(layer_elem.get_name_attribute(get_upper_name), "TOP-FRAME")
+    self.assertEqual(layer_elem.get_name_attribute(get_upper_name), "TOP-FRAME")
+    self.assertEqual(processed_names, ["top-frame"])
+    
+    layer_elem.name = "bottom-frame"
+    self.assertEqual(layer_elem.get_name_attribute(get_upper_name), "BOTTOM-FRAME")
+    self.assertEqual(processed_names, ["top-frame", "bottom-frame"])
+  
+  def test_get_file_extension_after_name_change(self):
+    layer_elem = self.layer_data['main-background.jpg']
+    self.assertEqual(layer_elem.get_file_extension(), "jpg")
+    
+    layer_elem.set_file_extension("PNG")
+    self.assertEqual(layer_elem.get_file_extension(), "png")
+    
+    layer_elem.set_file_extension(None)
+    self.assertEqual(layer_elem.get_file_extension(), "")
+  
   def test_get_filepath(self):
     output_directory = os.path.join("D:", os.sep, "testgimp")
     
@@ -317,4 +511,45 @@ class TestLayerData(unittest.TestCase):
       self.layer_data.uniquify_name(layer_elem, include_item_path=True,
                                     place_before_file_extension=True)
     self._compare_uniquified_with_parents(self.layer_data, uniquified_names)
+
+  
+  def test_uniquifies_after_renaming_uniquified_items(self):
+    layer_elems = [
+      self.layer_data[name] for name in
+      ["main-background.jpg", "main-background.jpg:", "Corners::", "top-left-corner::::"]]
+    for layer_elem in layer_elems:
+      layer_elem.name = "Layer"
+    
+    for layer_elem in layer_elems[:3]:
+      self.layer_data.uniquify_name(layer_elem)
+    self.assertEqual(
+      [layer_elem.name for layer_elem in layer_elems[:3]], ["Layer", "Layer (1)", "Layer (2)"])
+    
+    layer_elems[1].name = "Background"
+    self.layer_data.uniquify_name(layer_elems[3])
+    self.assertEqual(layer_elems[3].name, "Layer (1)")
+  
+  def test_uniquifies_again_after_removing_uniquified_name(self):
+    layer_elems = [
+      self.layer_data[name] for name in ["main-background.jpg", "main-background.jpg:"]]
+    layer_elems[0].name = "Layer.png"
+    layer_elems[1].name = "Layer.jpg"
+    for layer_elem in layer_elems:
+      self.layer_data.uniquify_name(layer_elem, place_before_file_extension=True)
+    
+    self.layer_data.remove_uniquified_name(layer_elems[1])
+    layer_elems[1].name = "Layer.png"
+    self.layer_data.uniquify_name(layer_elems[1], place_before_file_extension=True)
+    self.assertEqual(layer_elems[1].name, "Layer (1).png")
+  
+  def test_uniquifies_with_reserved_names(self):
+    layer_elems = [
+      self.layer_data[name] for name in ["main-background.jpg", "main-background.jpg:"]]
+    for layer_elem in layer_elems:
+      layer_elem.name = "Layer"
+    
+    self.layer_data.uniquify_name(layer_elems[0], reserved_names=["Layer", "Layer (1)"])
+    self.assertEqual(layer_elems[0].name, "Layer (2)")
+    self.layer_data.uniquify_name(layer_elems[1])
+    self.assertEqual(layer_elems[1].name, "Layer")
   
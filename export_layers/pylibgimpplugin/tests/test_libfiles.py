@@ -31,9 +31,13 @@ str = unicode
 #===============================================================================
 
 import os
+import shutil
+import tempfile
 
 import unittest
 
+from ..lib import mock
+
 from .. import libfiles
 
 #===============================================================================
@@ -58,6 +62,148 @@ class TestUniquifyString(unittest.TestCase):
                                                                  place_before_file_extension=True))
 
 
+class TestDirectoryCache(unittest.TestCase):
+  
+  def setUp(self):
+    self.temp_directory = tempfile.mkdtemp()
+    for filename in ["one.png", "one (1).png", "two.png"]:
+      with open(os.path.join(self.temp_directory, filename), "w"):
+        pass
+    
+    self.directory_cache = libfiles.DirectoryCache()
+  
+  def tearDown(self):
+    shutil.rmtree(self.temp_directory)
+  
+  def _get_path(self, filename):
+    return os.path.join(self.temp_directory, filename)
+  
+  def test_exists(self):
+    self.assertTrue(self.directory_cache.exists(self._get_path("one.png")))
+    self.assertFalse(self.directory_cache.exists(self._get_path("three.png")))
+    self.assertFalse(self.directory_cache.exists(self._get_path(os.path.join("subdir", "one.png"))))
+    self.assertEqual(self.directory_cache.num_listed_directories, 2)
+  
+  def test_exists_does_not_detect_unrecorded_changes(self):
+    self.assertFalse(self.directory_cache.exists(self._get_path("three.png")))
+    with open(self._get_path("three.png"), "w"):
+      pass
+    self.assertFalse(self.directory_cache.exists(self._get_path("three.png")))
+    
+    self.directory_cache.add(self._get_path("three.png"))
+    self.assertTrue(self.directory_cache.exists(self._get_path("three.png")))
+    
+    self.directory_cache.remove(self._get_path("three.png"))
+    self.assertFalse(self.directory_cache.exists(self._get_path("three.png")))
+  
+  def test_rename(self):
+    self.directory_cache.rename(self._get_path("two.png"), self._get_path("three.png"))
+    self.assertFalse(self.directory_cache.exists(self._get_path("two.png")))
+    self.assertTrue(self.directory_cache.exists(self._get_path("three.png")))
+    self.assertTrue(os.path.exists(self._get_path("three.png")))
+  
+  def test_uniquify_filename(self):
+    self.assertEqual(
+      libfiles.uniquify_filename(self._get_path("one.png"), self.directory_cache),
+      self._get_path("one (2).png"))
+    self.assertEqual(
+      libfiles.uniquify_filename(self._get_path("three.png"), self.directory_cache),
+      self._get_path("three.png"))
+    self.assertEqual(
+      libfiles.uniquify_filename(self._get_path("one.png")),
+      libfiles.uniquify_filename(self._get_path("one.png"), self.directory_cache))
+
+
+class TestDirectoryCreator(unittest.TestCase):
+  
+  def setUp(self):
+    self.temp_directory = tempfile.mkdtemp()
+    self.directory_creator = libfiles.DirectoryCreator()
+  
+  def tearDown(self):
+    shutil.rmtree(self.temp_directory)
+  
+  def _get_path(self, *path_components):
+    return os.path.join(self.temp_directory, *path_components)
+  
+  def test_make_dirs(self):
+    with mock.patch.object(libfiles, 'make_dirs', wraps=libfiles.make_dirs) as make_dirs_mock:
+      self.directory_creator.make_dirs(self._get_path("one", "two"))
+      self.directory_creator.make_dirs(self._get_path("one", "two"))
+      self.directory_creator.make_dirs(self._get_path("one"))
+      self.directory_creator.make_dirs(self._get_path("one", "three"))
+    
+    self.assertTrue(os.path.isdir(self._get_path("one", "two")))
+    self.assertTrue(os.path.isdir(self._get_path("one", "three")))
+    self.assertEqual(make_dirs_mock.call_count, 2)
+    self.assertEqual(self.directory_creator.num_avoided_calls, 2)
+  
+  def test_make_all_dirs(self):
+    paths = [
+      self._get_path("one"), self._get_path("one", "two"), self._get_path("one", "two"),
+      self._get_path("one", "three"), self._get_path("four")]
+    
+    with mock.patch.object(libfiles, 'make_dirs', wraps=libfiles.make_dirs) as make_dirs_mock:
+      self.directory_creator.make_all_dirs(paths)
+    
+    for path in paths:
+      self.assertTrue(os.path.isdir(path))
+    self.assertEqual(make_dirs_mock.call_count, 3)
+    self.assertEqual(self.directory_creator.num_avoided_calls, 2)
+
+
+class TestRenameFiles(unittest.TestCase):
+  
+  def setUp(self):
+    self.temp_directory = tempfile.mkdtemp()
+    self.filename = os.path.join(self.temp_directory, "one.png")
+    self.new_filename = os.path.join(self.temp_directory, "two.png")
+    
+    self._write_file(self.filename, "one")
+  
+  def tearDown(self):
+    shutil.rmtree(self.temp_directory)
+  
+  def _write_file(self, filename, contents):
+    with open(filename, "w") as file_:
+      file_.write(contents)
+  
+  def _read_file(self, filename):
+    with open(filename) as file_:
+      return file_.read()
+  
+  def test_get_temp_filename(self):
+    temp_filename = libfiles.get_temp_filename(self.filename)
+    self.assertEqual(os.path.dirname(temp_filename), self.temp_directory)
+    self.assertTrue(os.path.basename(temp_filename).startswith(".one.png.tmp"))
+    self.assertNotEqual(temp_filename, libfiles.get_temp_filename(self.filename))
+    
+    self.assertTrue(libfiles.get_temp_filename(self.filename, "xcf.gz").endswith(".xcf.gz"))
+  
+  def test_replace_file(self):
+    self._write_file(self.new_filename, "two")
+    libfiles.replace_file(self.filename, self.new_filename)
+    
+    self.assertFalse(os.path.exists(self.filename))
+    self.assertEqual(self._read_file(self.new_filename), "one")
+  
+  def test_rename_without_overwriting(self):
+    libfiles.rename_without_overwriting(self.filename, self.new_filename)
+    
+    self.assertFalse(os.path.exists(self.filename))
+    self.assertEqual(self._read_file(self.new_filename), "one")
+  
+  def test_rename_without_overwriting_existing_file(self):
+    self._write_file(self.new_filename, "two")
+    
+    with self.assertRaises(OSError) as context:
+      libfiles.rename_without_overwriting(self.filename, self.new_filename)
+    
+    self.assertEqual(context.exception.errno, os.errno.EEXIST)
+    self.assertEqual(self._read_file(self.filename), "one")
+    self.assertEqual(self._read_file(self.new_filename), "two")
+
+
 class TestGetFileExtension(unittest.TestCase):
   
   def test_get_file_extension(self):
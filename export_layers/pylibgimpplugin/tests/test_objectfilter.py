@@ -33,22 +33,26 @@ str = unicode
 import unittest
 
 from ..objectfilter import ObjectFilter
+from ..objectfilter import subtree_rule
+from ..objectfilter import bulk_rule
 
 #===============================================================================
 
 class FilterableObject(object):
   
-  def __init__(self, object_id, name, is_empty=False, colors=None):
+  def __init__(self, object_id, name, is_empty=False, colors=None, is_visible=True):
     self.object_id = object_id
     self.name = name
     self.is_empty = is_empty
     self.colors = colors if colors is not None else set()
+    self.is_visible = is_visible
 
 
 def has_uppercase_letters(obj):
   return obj.name.lower() != obj.name
 
 
+@bulk_rule(lambda objects: [obj.object_id % 2 == 0 for obj in objects])
 def is_object_id_even(obj):
   return obj.object_id % 2 == 0
 
@@ -60,6 +64,11 @@ def has_matching_file_extension(obj, file_extension, case_sensitive=False):
   return obj.name.endswith('.' + file_extension)
 
 
+def is_object_id_multiple_of(obj, number):
+  return obj.object_id % number == 0
+
+
+@bulk_rule(lambda objects: [obj.is_empty for obj in objects])
 def is_empty(obj):
   return obj.is_empty
 
@@ -72,6 +81,11 @@ def has_green_color(obj):
   return "green" in obj.colors
 
 
+@subtree_rule
+def is_visible(obj):
+  return obj.is_visible
+
+
 def invalid_rule_func():
   pass
 
@@ -181,6 +195,153 @@ class TestObjectFilter(unittest.TestCase):
       self.assertFalse(self.filter.has_subfilter('item_types'))
     self.assertTrue(self.filter.has_subfilter('item_types'))
   
+  def test_revision_changes_with_rules(self):
+    revision = self.filter.revision
+    self.filter.add_rule(has_uppercase_letters)
+    self.assertNotEqual(self.filter.revision, revision)
+    
+    revision = self.filter.revision
+    self.filter.add_rule(has_uppercase_letters)
+    self.assertEqual(self.filter.revision, revision)
+    
+    self.filter.remove_rule(has_uppercase_letters)
+    self.assertNotEqual(self.filter.revision, revision)
+    
+    revision = self.filter.revision
+    with self.filter.add_rule_temp(is_empty):
+      self.assertNotEqual(self.filter.revision, revision)
+      revision_temp = self.filter.revision
+    self.assertNotEqual(self.filter.revision, revision_temp)
+  
+  def test_revision_changes_with_subfilters(self):
+    subfilter = ObjectFilter(ObjectFilter.MATCH_ANY)
+    revision = self.filter.revision
+    self.filter.add_subfilter('subfilter', subfilter)
+    self.assertNotEqual(self.filter.revision, revision)
+    
+    revision = self.filter.revision
+    subfilter.add_rule(has_red_color)
+    self.assertNotEqual(self.filter.revision, revision)
+    
+    revision = self.filter.revision
+    self.filter.remove_subfilter('subfilter')
+    self.assertNotEqual(self.filter.revision, revision)
+  
+  def test_revision_changes_with_nested_subfilters(self):
+    subfilter = ObjectFilter(ObjectFilter.MATCH_ANY)
+    nested_subfilter = ObjectFilter(ObjectFilter.MATCH_ALL)
+    subfilter.add_subfilter('nested_subfilter', nested_subfilter)
+    self.filter.add_subfilter('subfilter', subfilter)
+    
+    revision = self.filter.revision
+    nested_subfilter.add_rule(has_red_color)
+    self.assertNotEqual(self.filter.revision, revision)
+    
+    self.filter.remove_subfilter('subfilter')
+    revision = self.filter.revision
+    nested_subfilter.add_rule(has_green_color)
+    self.assertEqual(self.filter.revision, revision)
+  
+  def test_compile(self):
+    self.filter.add_rule(has_uppercase_letters)
+    is_match = self.filter.compile()
+    self.assertIs(self.filter.compile(), is_match)
+    
+    self.filter.add_rule(is_object_id_even)
+    self.assertIsNot(self.filter.compile(), is_match)
+    self.assertTrue(self.filter.compile()(FilterableObject(2, "Hi There")))
+    self.assertFalse(self.filter.compile()(FilterableObject(1, "Hi There")))
+  
+  def test_compile_with_nested_subfilters(self):
+    self.filter.add_rule(has_matching_file_extension, 'jpg')
+    self.filter.add_subfilter('colors', ObjectFilter(ObjectFilter.MATCH_ANY))
+    self.filter['colors'].add_rule(has_red_color)
+    self.filter['colors'].add_subfilter('green', ObjectFilter(ObjectFilter.MATCH_ALL))
+    self.filter['colors']['green'].add_rule(has_green_color)
+    
+    objects = [
+      FilterableObject(1, "Hi There.jpg", colors={"red"}),
+      FilterableObject(2, "Hi There.jpg", colors={"green"}),
+      FilterableObject(3, "Hi There.jpg", colors={"blue"}),
+      FilterableObject(4, "Hi There.png", colors={"red"})]
+    self.assertEqual([self.filter.is_match(obj) for obj in objects], [True, True, False, False])
+    
+    self.filter['colors']['green'].add_rule(is_empty)
+    self.assertEqual([self.filter.is_match(obj) for obj in objects], [True, False, False, False])
+  
+  def test_compile_with_empty_subfilter(self):
+    self.filter_match_any.add_rule(has_red_color)
+    self.assertFalse(self.filter_match_any.is_match(FilterableObject(1, "Hi There")))
+    
+    self.filter_match_any.add_subfilter('empty_subfilter', ObjectFilter(ObjectFilter.MATCH_ALL))
+    self.assertTrue(self.filter_match_any.is_match(FilterableObject(1, "Hi There")))
+  
+  def test_optimize_rule_order(self):
+    matched_objects = []
+    
+    def is_any_object(obj):
+      matched_objects.append(obj)
+      return True
+    
+    filter_ = ObjectFilter(ObjectFilter.MATCH_ALL, optimize_rule_order=True)
+    filter_.NUM_STATISTICS_SAMPLES = 10
+    filter_.add_rule(is_any_object)
+    filter_.add_rule(is_object_id_multiple_of, 10)
+    
+    objects = [FilterableObject(i, "Hi There") for i in range(100)]
+    self.assertEqual(
+      [obj.object_id for obj in objects if filter_.is_match(obj)], list(range(0, 100, 10)))
+    
+    # After the first 10 objects, `is_any_object` is evaluated only for objects
+    # matching `is_object_id_multiple_of`.
+    self.assertLessEqual(len(matched_objects), 10 + 9)
+    
+    self.assertEqual(filter_.rule_statistics[is_object_id_multiple_of].num_calls, 10)
+    self.assertEqual(filter_.rule_statistics[is_object_id_multiple_of].num_rejections, 9)
+    self.assertEqual(filter_.rule_statistics[is_any_object].num_rejections, 0)
+    self.assertEqual(filter_.rule_statistics[is_any_object].cost[0], float('inf'))
+  
+  def test_optimize_rule_order_with_subfilters(self):
+    filter_ = ObjectFilter(ObjectFilter.MATCH_ALL, optimize_rule_order=True)
+    filter_.NUM_STATISTICS_SAMPLES = 10
+    filter_.add_subfilter('colors', ObjectFilter(ObjectFilter.MATCH_ANY))
+    filter_['colors'].add_rule(has_red_color)
+    filter_['colors'].add_rule(has_green_color)
+    filter_.add_rule(is_object_id_even)
+    
+    colors = [set(), {"red"}, {"green"}]
+    objects = [FilterableObject(i, "Hi There", colors=colors[i % 3]) for i in range(60)]
+    self.assertEqual(
+      [filter_.is_match(obj) for obj in objects],
+      [obj.object_id % 2 == 0 and bool(obj.colors) for obj in objects])
+    self.assertIn('colors', filter_.rule_statistics)
+    self.assertIn(is_object_id_even, filter_.rule_statistics)
+  
+  def test_can_match_descendants(self):
+    self.assertTrue(self.filter.can_match_descendants(FilterableObject(1, "Hidden", is_visible=False)))
+    
+    self.filter.add_rule(has_uppercase_letters)
+    self.filter.add_rule(is_visible)
+    self.assertTrue(self.filter.can_match_descendants(FilterableObject(1, "hidden")))
+    self.assertFalse(self.filter.can_match_descendants(FilterableObject(1, "Hidden", is_visible=False)))
+  
+  def test_can_match_descendants_match_any(self):
+    self.filter_match_any.add_rule(is_visible)
+    self.assertFalse(
+      self.filter_match_any.can_match_descendants(FilterableObject(1, "Hidden", is_visible=False)))
+    
+    self.filter_match_any.add_rule(has_uppercase_letters)
+    self.assertTrue(
+      self.filter_match_any.can_match_descendants(FilterableObject(1, "Hidden", is_visible=False)))
+  
+  def test_can_match_descendants_with_subfilters(self):
+    self.filter.add_subfilter('visibility', ObjectFilter(ObjectFilter.MATCH_ANY))
+    self.filter['visibility'].add_rule(is_visible)
+    self.assertFalse(self.filter.can_match_descendants(FilterableObject(1, "Hidden", is_visible=False)))
+    
+    self.filter['visibility'].add_rule(is_empty)
+    self.assertTrue(self.filter.can_match_descendants(FilterableObject(1, "Hidden", is_visible=False)))
+  
   def test_match_all(self):
     self.filter.add_rule(has_uppercase_letters)
     self.filter.add_rule(is_object_id_even)
@@ -273,3 +434,41 @@ class TestObjectFilter(unittest.TestCase):
     self.assertFalse(self.filter.is_match(
       FilterableObject(1, "", is_empty=True, colors={'red', 'green'})))
     
+  
+  def _get_objects(self):
+    return [
+      FilterableObject(object_id, name, is_empty=is_empty_, colors=colors)
+      for object_id in range(4)
+      for name in ["hi there", "Hi There"]
+      for is_empty_ in [False, True]
+      for colors in [None, {'red'}, {'red', 'green'}]]
+  
+  def _test_get_match_mask(self, filter_):
+    objects = self._get_objects()
+    self.assertEqual(
+      filter_.get_match_mask(objects, objects), [filter_.is_match(obj) for obj in objects])
+  
+  def test_get_match_mask(self):
+    self.filter.add_rule(is_object_id_even)
+    self.filter.add_rule(is_empty)
+    self._test_get_match_mask(self.filter)
+    
+    self.filter.add_rule(has_uppercase_letters)
+    self._test_get_match_mask(self.filter)
+  
+  def test_get_match_mask_match_any(self):
+    self.filter_match_any.add_rule(is_object_id_even)
+    self.filter_match_any.add_rule(has_red_color)
+    self._test_get_match_mask(self.filter_match_any)
+  
+  def test_get_match_mask_empty_filter(self):
+    self._test_get_match_mask(self.filter)
+  
+  def test_get_match_mask_with_subfilters(self):
+    self.filter.add_rule(has_uppercase_letters)
+    self.filter.add_subfilter('obj_properties', ObjectFilter(self.filter.MATCH_ANY))
+    self.filter['obj_properties'].add_rule(is_empty)
+    self.filter['obj_properties'].add_subfilter('colors', ObjectFilter(self.filter.MATCH_ALL))
+    self.filter['obj_properties']['colors'].add_rule(has_red_color)
+    self.filter['obj_properties']['colors'].add_rule(is_object_id_even)
+    self._test_get_match_mask(self.filter)
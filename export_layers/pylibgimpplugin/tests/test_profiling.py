@@ -0,0 +1,169 @@
+#-------------------------------------------------------------------------------
+#
+# This file is part of pylibgimpplugin.
+#
+# Copyright (C) 2014 khalim19 <khalim19@gmail.com>
+#
+# pylibgimpplugin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pylibgimpplugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pylibgimpplugin.  If not, see <http://www.gnu.org/licenses/>.
+#
+#-------------------------------------------------------------------------------
+
+#===============================================================================
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+str = unicode
+
+#===============================================================================
+
+import unittest
+import json
+import types
+
+from . import gimpmocks
+from .. import profiling
+
+#===============================================================================
+
+class TestProfiler(unittest.TestCase):
+  
+  def setUp(self):
+    self.profiler = profiling.Profiler()
+  
+  def test_stage(self):
+    with self.profiler.stage('stages', 'process'):
+      pass
+    with self.profiler.stage('stages', 'process'):
+      pass
+    
+    self.assertEqual(self.profiler.stats['stages']['process']['count'], 2)
+    self.assertGreaterEqual(self.profiler.stats['stages']['process']['time'], 0.0)
+  
+  def test_stage_records_on_exception(self):
+    with self.assertRaises(ValueError):
+      with self.profiler.stage('stages', 'process'):
+        raise ValueError("error")
+    
+    self.assertEqual(self.profiler.stats['stages']['process']['count'], 1)
+  
+  def test_wrap(self):
+    func = self.profiler.wrap('operations', 'add', lambda a, b: a + b)
+    self.assertEqual(func(1, 2), 3)
+    self.assertEqual(self.profiler.stats['operations']['add']['count'], 1)
+  
+  def test_per_item(self):
+    self.profiler.record_per_item = True
+    
+    self.profiler.current_item = "layer1"
+    self.profiler.add('pdb', 'gimp_image_flatten', 0.5)
+    self.profiler.current_item = "layer2"
+    self.profiler.add('pdb', 'gimp_image_flatten', 0.25)
+    self.profiler.add('pdb', 'gimp_image_flatten', 0.25)
+    
+    self.assertEqual(self.profiler.stats['pdb']['gimp_image_flatten'], {'count': 3, 'time': 1.0})
+    self.assertEqual(self.profiler.item_stats['layer1']['pdb']['gimp_image_flatten'],
+                     {'count': 1, 'time': 0.5})
+    self.assertEqual(self.profiler.item_stats['layer2']['pdb']['gimp_image_flatten'],
+                     {'count': 2, 'time': 0.5})
+  
+  def test_per_item_disabled(self):
+    self.profiler.current_item = "layer1"
+    self.profiler.add('pdb', 'gimp_image_flatten', 0.5)
+    
+    self.assertEqual(self.profiler.item_stats, {})
+    self.assertNotIn('items', self.profiler.to_dict())
+  
+  def test_reset(self):
+    self.profiler.add('pdb', 'gimp_image_flatten', 0.5)
+    self.profiler.reset()
+    self.assertEqual(self.profiler.stats, {})
+  
+  def test_to_json(self):
+    self.profiler.record_per_item = True
+    self.profiler.current_item = "layer1"
+    self.profiler.add('pdb', 'gimp_image_flatten', 0.5)
+    
+    self.assertEqual(
+      json.loads(self.profiler.to_json()),
+      {'total': {'pdb': {'gimp_image_flatten': {'count': 1, 'time': 0.5}}},
+       'items': {'layer1': {'pdb': {'gimp_image_flatten': {'count': 1, 'time': 0.5}}}}})
+
+
+class TestProfilePDB(unittest.TestCase):
+  
+  def setUp(self):
+    self.profiler = profiling.Profiler()
+    self.module = types.ModuleType(b'module')
+    self.orig_pdb = gimpmocks.MockPDB()
+    self.module.pdb = self.orig_pdb
+  
+  def test_profile_pdb(self):
+    with profiling.profile_pdb(self.profiler, [self.module]):
+      self.assertEqual(self.module.pdb.plug_in_autocrop(), 'plug_in_autocrop')
+      self.module.pdb.plug_in_autocrop()
+      self.module.pdb.gimp_image_flatten()
+    
+    self.assertEqual(self.module.pdb, self.orig_pdb)
+    self.assertEqual(self.profiler.stats['pdb']['plug_in_autocrop']['count'], 2)
+    self.assertEqual(self.profiler.stats['pdb']['gimp_image_flatten']['count'], 1)
+  
+  def test_profile_pdb_restores_on_exception(self):
+    with self.assertRaises(ValueError):
+      with profiling.profile_pdb(self.profiler, [self.module]):
+        raise ValueError("error")
+    
+    self.assertEqual(self.module.pdb, self.orig_pdb)
+
+
+class TestTracingPDB(unittest.TestCase):
+  
+  def setUp(self):
+    self.pdb = profiling.TracingPDB(gimpmocks.MockPDB())
+  
+  def test_count_calls(self):
+    self.assertEqual(self.pdb.plug_in_autocrop(), 'plug_in_autocrop')
+    self.pdb.plug_in_autocrop()
+    self.pdb.gimp_image_flatten()
+    
+    self.assertEqual(self.pdb.num_calls, 3)
+    self.assertEqual(self.pdb.stats['plug_in_autocrop']['count'], 2)
+    self.assertEqual(self.pdb.stats['gimp_image_flatten']['count'], 1)
+    self.assertEqual(self.pdb.calls, [])
+  
+  def test_log_calls(self):
+    self.pdb.log_calls = True
+    self.pdb.plug_in_autocrop("image", "layer", run_mode=0)
+    
+    self.assertEqual(self.pdb.calls, [('plug_in_autocrop', ("image", "layer"), {'run_mode': 0})])
+  
+  def test_reset(self):
+    self.pdb.plug_in_autocrop()
+    self.pdb.reset()
+    
+    self.assertEqual(self.pdb.num_calls, 0)
+    self.assertEqual(self.pdb.stats, {})
+  
+  def test_replace_pdb(self):
+    module = types.ModuleType(b'module')
+    orig_pdb = gimpmocks.MockPDB()
+    module.pdb = orig_pdb
+    
+    with profiling.replace_pdb([module], lambda orig_pdb: self.pdb):
+      module.pdb.plug_in_autocrop()
+    
+    self.assertEqual(module.pdb, orig_pdb)
+    self.assertEqual(self.pdb.num_calls, 1)
@@ -0,0 +1,99 @@
+#-------------------------------------------------------------------------------
+#
+# This file is part of pylibgimpplugin.
+#
+# Copyright (C) 2014 khalim19 <khalim19@gmail.com>
+#
+# pylibgimpplugin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pylibgimpplugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pylibgimpplugin.  If not, see <http://www.gnu.org/licenses/>.
+#
+#-------------------------------------------------------------------------------
+
+#===============================================================================
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+str = unicode
+
+#===============================================================================
+
+import threading
+
+import unittest
+
+from .. import writebehind
+
+#===============================================================================
+
+class TestWriteBehindQueue(unittest.TestCase):
+  
+  def setUp(self):
+    self.queue = writebehind.WriteBehindQueue(num_threads=2, max_queued_writes=2)
+    self.written = {}
+  
+  def tearDown(self):
+    self.queue.close()
+  
+  def _write(self, key, value):
+    self.written[key] = value
+  
+  def _write_fail(self):
+    raise IOError(13, "Permission denied")
+  
+  def test_put(self):
+    for i in range(10):
+      self.queue.put(i, self._write, i, str(i))
+    self.queue.join()
+    
+    self.assertEqual(self.written, {i: str(i) for i in range(10)})
+    self.assertEqual(
+      sorted(self.queue.get_finished()), [(i, None) for i in range(10)])
+    self.assertEqual(self.queue.get_finished(), [])
+  
+  def test_put_failed_write(self):
+    self.queue.put("one", self._write, "one", 1)
+    self.queue.put("two", self._write_fail)
+    self.queue.join()
+    
+    finished = dict(self.queue.get_finished())
+    self.assertIsNone(finished["one"])
+    self.assertIsInstance(finished["two"], IOError)
+  
+  def test_put_blocks_when_queue_is_full(self):
+    write_event = threading.Event()
+    num_writes = self.queue.num_threads + self.queue.max_queued_writes
+    
+    for i in range(num_writes):
+      self.queue.put(i, write_event.wait)
+    
+    put_thread = threading.Thread(target=self.queue.put, args=(num_writes, write_event.wait))
+    put_thread.start()
+    put_thread.join(0.1)
+    self.assertTrue(put_thread.is_alive())
+    
+    write_event.set()
+    put_thread.join()
+    self.queue.join()
+    self.assertEqual(len(self.queue.get_finished()), num_writes + 1)
+  
+  def test_close(self):
+    self.queue.put("one", self._write, "one", 1)
+    self.queue.close()
+    
+    self.assertEqual(self.written, {"one": 1})
+    self.assertEqual(self.queue.get_finished(), [("one", None)])
+    with self.assertRaises(ValueError):
+      self.queue.put("two", self._write, "two", 2)
@@ -0,0 +1,174 @@
+#-------------------------------------------------------------------------------
+#
+# This file is part of pylibgimpplugin.
+#
+# Copyright (C) 2014 khalim19 <khalim19@gmail.com>
+#
+# pylibgimpplugin is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# pylibgimpplugin is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with pylibgimpplugin.  If not, see <http://www.gnu.org/licenses/>.
+#
+#-------------------------------------------------------------------------------
+
+"""
+This module defines a queue performing writes (such as encoding and saving
+files) in background threads.
+"""
+
+#===============================================================================
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+str = unicode
+
+#===============================================================================
+
+import threading
+import Queue
+
+#===============================================================================
+
+class WriteBehindQueue(object):
+  
+  """
+  This class performs writes in background threads, allowing the caller to
+  continue its work (e.g. processing the next layer) while the data is being
+  written.
+  
+  At most `max_queued_writes` writes may wait for a free thread. While the limit
+  is reached, `put()` blocks, which caps the memory occupied by the data waiting
+  to be written.
+  
+  Exceptions raised by the writes are not propagated to the caller. Instead, the
+  results of finished writes are obtained via `get_finished()` in the thread of
+  the caller, allowing to handle errors for each write separately.
+  
+  The write functions are called from the background threads and therefore must
+  not call GIMP PDB procedures.
+  
+  Attributes:
+  
+  * `num_threads` (read-only) - Number of background threads.
+  
+  * `max_queued_writes` (read-only) - Maximum number of writes waiting for a
+    free thread.
+  
+  Methods:
+  
+  * `put()` - Add a write to the queue.
+  
+  * `get_finished()` - Return the results of writes finished since the last
+    call.
+  
+  * `join()` - Wait until all writes in the queue are finished.
+  
+  * `close()` - Wait until all writes in the queue are finished and stop the
+    background threads.
+  """
+  
+  def __init__(self, num_threads=2, max_queued_writes=4):
+    self._num_threads = num_threads
+    self._max_queued_writes = max_queued_writes
+    
+    self._queue = Queue.Queue(maxsize=max_queued_writes)
+    self._finished = []
+    self._finished_lock = threading.Lock()
+    
+    self._threads = []
+    for unused_ in range(self._num_threads):
+      thread = threading.Thread(target=self._process_writes)
+      # Do not prevent the plug-in from exiting if the queue is not closed.
+      thread.daemon = True
+      thread.start()
+      self._threads.append(thread)
+  
+  @property
+  def num_threads(self):
+    return self._num_threads
+  
+  @property
+  def max_queued_writes(self):
+    return self._max_queued_writes
+  
+  def put(self, key, write_func, *args, **kwargs):
+    """
+    Add a write to the queue. `write_func` is called with the specified
+    arguments in one of the background threads. `key` identifies the write in
+    the results returned by `get_finished()`.
+    
+    If `max_queued_writes` writes are already waiting, block until a thread
+    becomes free.
+    
+    Raises:
+    
+    * `ValueError` - The queue is closed.
+    """
+    
+    if not self._threads:
+      raise ValueError("write-behind queue is closed")
+    
+    self._queue.put((key, write_func, args, kwargs))
+  
+  def get_finished(self):
+    """
+    Return a list of (key, exception) tuples for writes finished since the last
+    call, in the order they finished. `exception` is the exception raised by the
+    write function, or None if the write was successful.
+    """
+    
+    with self._finished_lock:
+      finished = self._finished
+      self._finished = []
+    
+    return finished
+  
+  def join(self):
+    self._queue.join()
+  
+  def close(self):
+    """
+    Wait until all writes in the queue are finished and stop the background
+    threads. Results of the writes are still available via `get_finished()`.
+    Calling `close()` again has no effect.
+    """
+    
+    self._queue.join()
+    
+    for unused_ in self._threads:
+      self._queue.put(None)
+    for thread in self._threads:
+      thread.join()
+    
+    self._threads = []
+  
+  def _process_writes(self):
+    while True:
+      item = self._queue.get()
+      try:
+        if item is None:
+          return
+        
+        key, write_func, args, kwargs = item
+        try:
+          write_func(*args, **kwargs)
+        except Exception as e:
+          exception = e
+        else:
+          exception = None
+        
+        with self._finished_lock:
+          self._finished.append((key, exception))
+      finally:
+        self._queue.task_done()
@@ -0,0 +1,218 @@
+#-------------------------------------------------------------------------------
+#
+# This file is part of Export Layers.
+#
+# Copyright (C) 2013, 2014 khalim19 <khalim19@gmail.com>
+#
+# Export Layers is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Export Layers is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Export Layers.  If not, see <http://www.gnu.org/licenses/>.
+#
+#-------------------------------------------------------------------------------
+
+"""
+This module benchmarks exporting layers via the GIMP file procedures against
+encoding the files in the plug-in process (optionally in background threads)
+on an image containing many small sprites.
+
+The module also benchmarks reusing merged background layers from a
+`BackgroundLayerCache` against merging them in each export, and compares both
+to the time spent computing the fingerprints the cache is keyed on.
+
+This is not a unit test module. The benchmarks require a running GIMP
+instance. To run them, call `run_benchmarks()` from the GIMP Python-Fu console.
+"""
+
+#===============================================================================
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+str = unicode
+
+#===============================================================================
+
+import sys
+import shutil
+import tempfile
+import timeit
+
+import gimp
+import gimpenums
+
+from ..pylibgimpplugin import overwrite
+from ..pylibgimpplugin import pylibgimp
+
+from .. import exportlayers
+from .. import settings_plugin
+
+#===============================================================================
+
+pdb = gimp.pdb
+
+# (description, file extensions encoded in the plug-in process, write-behind)
+EXPORT_BACKENDS = [
+  ("GIMP file procedures", [], False),
+  ("in-process encoding", ["png", "data"], False),
+  ("in-process encoding, write-behind", ["png", "data"], True),
+]
+
+#===============================================================================
+
+def create_sprite_image(num_sprites, sprite_width, sprite_height):
+  """
+  Return a new image containing the specified number of RGBA layers filled
+  with plasma.
+  """
+  
+  image = gimp.Image(sprite_width, sprite_height, gimpenums.RGB)
+  pdb.gimp_image_undo_disable(image)
+  
+  for i in range(num_sprites):
+    layer = gimp.Layer(
+      image, "Sprite " + str(i), sprite_width, sprite_height, gimpenums.RGBA_IMAGE, 100,
+      gimpenums.NORMAL_MODE)
+    pdb.gimp_image_insert_layer(image, layer, None, 0)
+    pdb.plug_in_plasma(image, layer, i, 1.0)
+  
+  return image
+
+
+def add_background_layers(image, num_background_layers):
+  """
+  Insert the specified number of RGBA layers filled with plasma and enclosed in
+  square brackets (i.e. background layers) at the bottom of the image. Return
+  the inserted layers.
+  """
+  
+  background_layers = []
+  
+  for i in range(num_background_layers):
+    layer = gimp.Layer(
+      image, "[Background " + str(i) + "]", image.width, image.height, gimpenums.RGBA_IMAGE, 100,
+      gimpenums.NORMAL_MODE)
+    pdb.gimp_image_insert_layer(image, layer, None, len(image.layers))
+    pdb.plug_in_plasma(image, layer, i, 1.0)
+    background_layers.append(layer)
+  
+  return background_layers
+
+
+def benchmark_export(image, file_extension, in_process_file_extensions, write_behind):
+  """
+  Return the time in seconds to export all layers of the specified image to a
+  temporary directory.
+  """
+  
+  output_directory = tempfile.mkdtemp()
+  
+  main_settings = settings_plugin.MainSettings()
+  main_settings['output_directory'].value = output_directory
+  main_settings['file_extension'].value = file_extension
+  main_settings['use_image_size'].value = True
+  
+  layer_exporter = exportlayers.LayerExporter(
+    gimpenums.RUN_NONINTERACTIVE, image, main_settings,
+    overwrite.NoninteractiveOverwriteChooser(exportlayers.OverwriteHandler.REPLACE), None,
+    in_process_file_extensions=in_process_file_extensions, write_behind=write_behind)
+  
+  try:
+    start_time = timeit.default_timer()
+    layer_exporter.export_layers()
+    return timeit.default_timer() - start_time
+  finally:
+    shutil.rmtree(output_directory, ignore_errors=True)
+
+
+def benchmark_background_layer_cache(image, cache_background_layer, num_exports=3):
+  """
+  Return the average time in seconds to export all layers of the specified
+  image, with layers enclosed in square brackets used as background. The first
+  export, which fills the background layer cache if `cache_background_layer`
+  is True, is not counted.
+  """
+  
+  output_directory = tempfile.mkdtemp()
+  
+  main_settings = settings_plugin.MainSettings()
+  main_settings['output_directory'].value = output_directory
+  main_settings['file_extension'].value = "data"
+  main_settings['use_image_size'].value = True
+  main_settings['square_bracketed_mode'].value = (
+    main_settings['square_bracketed_mode'].options['background'])
+  
+  layer_exporter = exportlayers.LayerExporter(
+    gimpenums.RUN_NONINTERACTIVE, image, main_settings,
+    overwrite.NoninteractiveOverwriteChooser(exportlayers.OverwriteHandler.REPLACE), None,
+    cache_background_layer=cache_background_layer, in_process_file_extensions=["data"])
+  
+  try:
+    layer_exporter.export_layers()
+    
+    start_time = timeit.default_timer()
+    for unused_ in range(num_exports):
+      layer_exporter.export_layers()
+    return (timeit.default_timer() - start_time) / num_exports
+  finally:
+    shutil.rmtree(output_directory, ignore_errors=True)
+
+
+def benchmark_background_fingerprint(background_layers):
+  """
+  Return the time in seconds to compute the fingerprints of the specified
+  background layers, which is spent in each export using the background layer
+  cache.
+  """
+  
+  start_time = timeit.default_timer()
+  for layer in background_layers:
+    pylibgimp.get_layer_fingerprint(layer)
+  return timeit.default_timer() - start_time
+
+
+def run_benchmarks(stream=sys.stdout, num_sprites=1000, sprite_width=32, sprite_height=32,
+                   num_background_layers=4, background_size=1024, num_background_sprites=10):
+  image = create_sprite_image(num_sprites, sprite_width, sprite_height)
+  
+  try:
+    for file_extension in ["png", "data"]:
+      for description, in_process_file_extensions, write_behind in EXPORT_BACKENDS:
+        elapsed_time = benchmark_export(
+          image, file_extension, in_process_file_extensions, write_behind)
+        print(
+          "{0} sprites ({1}x{2}) to \"{3}\" ({4}): {5:.3f} s, {6:.2f} ms per layer".format(
+            num_sprites, sprite_width, sprite_height, file_extension, description,
+            elapsed_time, elapsed_time / num_sprites * 1e3),
+          file=stream)
+  finally:
+    pdb.gimp_image_delete(image)
+  
+  image = create_sprite_image(num_background_sprites, background_size, background_size)
+  background_layers = add_background_layers(image, num_background_layers)
+  
+  try:
+    print(
+      "fingerprints of {0} background layers ({1}x{1}): {2:.3f} s".format(
+        num_background_layers, background_size, benchmark_background_fingerprint(background_layers)),
+      file=stream)
+    
+    for description, cache_background_layer in [("merged", False), ("cached", True)]:
+      elapsed_time = benchmark_background_layer_cache(image, cache_background_layer)
+      print(
+        "{0} layers with {1} background layers ({2}x{2}, {3}): {4:.3f} s per export".format(
+          num_background_sprites, num_background_layers, background_size, description,
+          elapsed_time),
+        file=stream)
+  finally:
+    pdb.gimp_image_delete(image)
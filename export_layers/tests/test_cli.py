@@ -0,0 +1,129 @@
+#-------------------------------------------------------------------------------
+#
+# This file is part of Export Layers.
+#
+# Copyright (C) 2013, 2014 khalim19 <khalim19@gmail.com>
+#
+# Export Layers is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Export Layers is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Export Layers.  If not, see <http://www.gnu.org/licenses/>.
+#
+#-------------------------------------------------------------------------------
+
+#===============================================================================
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+str = unicode
+
+#===============================================================================
+
+import json
+from StringIO import StringIO
+
+import unittest
+
+from ..pylibgimpplugin.lib import mock
+
+from .. import cli
+from .. import exportlayers
+from .. import settings_plugin
+
+#===============================================================================
+
+class TestCommandLineOptions(unittest.TestCase):
+  
+  def setUp(self):
+    self.main_settings = settings_plugin.MainSettings()
+    self.parser = cli.create_argument_parser(self.main_settings)
+  
+  def test_apply_options(self):
+    options = self.parser.parse_args(
+      ['--file-extension', 'jpg', '--output-directory', 'output', '--autocrop',
+       '--overwrite-mode', 'skip', 'image1.xcf', 'image2.xcf'])
+    cli.apply_options(self.main_settings, options)
+    
+    self.assertEqual(options.filenames, ['image1.xcf', 'image2.xcf'])
+    self.assertEqual(self.main_settings['file_extension'].value, 'jpg')
+    self.assertEqual(self.main_settings['output_directory'].value, 'output')
+    self.assertEqual(self.main_settings['autocrop'].value, True)
+    self.assertEqual(self.main_settings['overwrite_mode'].value,
+                     exportlayers.OverwriteHandler.SKIP)
+  
+  def test_apply_options_keeps_unspecified_settings(self):
+    self.main_settings['autocrop'].value = True
+    self.main_settings['use_image_size'].value = True
+    
+    cli.apply_options(self.main_settings, self.parser.parse_args(['--no-use-image-size']))
+    
+    self.assertEqual(self.main_settings['autocrop'].value, True)
+    self.assertEqual(self.main_settings['use_image_size'].value, False)
+  
+  def test_read_queue(self):
+    queue_file = StringIO("image1.xcf\n\n  image2.xcf  \n")
+    self.assertEqual(cli.read_queue(queue_file), ['image1.xcf', 'image2.xcf'])
+
+
+class TestRun(unittest.TestCase):
+  
+  @mock.patch('sys.stderr', new_callable=StringIO)
+  def test_invalid_setting_value(self, mock_stderr):
+    self.assertEqual(cli.run(['--file-extension', '', 'image.xcf']), cli.EXIT_INVALID_ARGUMENTS)
+  
+  @mock.patch('sys.stderr', new_callable=StringIO)
+  def test_invalid_option(self, mock_stderr):
+    self.assertEqual(cli.run(['--autocrop=1']), cli.EXIT_INVALID_ARGUMENTS)
+  
+  @mock.patch('sys.stderr', new_callable=StringIO)
+  def test_write_behind_without_encode_in_process(self, mock_stderr):
+    self.assertEqual(cli.run(['--write-behind', 'image.xcf']), cli.EXIT_INVALID_ARGUMENTS)
+  
+  @mock.patch('sys.stdout', new_callable=StringIO)
+  def test_summary(self, mock_stdout):
+    def _export_images(batch_layer_exporter):
+      result = exportlayers.ImageExportResult("image.xcf", "output")
+      result.exported_layer_names = ["Corners", "Shadow"]
+      batch_layer_exporter.results.append(result)
+    
+    with mock.patch.object(exportlayers.BatchLayerExporter, 'export_images', new=_export_images):
+      status = cli.run(['--file-extension', 'png', 'image.xcf'])
+    
+    self.assertEqual(status, cli.EXIT_SUCCESS)
+    summary = json.loads(mock_stdout.getvalue())
+    self.assertEqual(summary['status'], 'success')
+    self.assertEqual(summary['num_exported_layers'], 2)
+    self.assertEqual(summary['images'][0]['source'], "image.xcf")
+
+
+class TestMain(unittest.TestCase):
+  
+  @mock.patch.object(cli, 'run', return_value=cli.EXIT_SUCCESS)
+  def test_success(self, mock_run):
+    cli.main(['image.xcf'])
+    mock_run.assert_called_once_with(['image.xcf'])
+  
+  @mock.patch.object(cli, 'run', return_value=cli.EXIT_FAILURE)
+  def test_failure(self, mock_run):
+    with self.assertRaises(SystemExit) as context:
+      cli.main(['image.xcf'])
+    
+    self.assertEqual(context.exception.code, cli.EXIT_FAILURE)
+  
+  @mock.patch('sys.stderr', new_callable=StringIO)
+  def test_invalid_arguments(self, mock_stderr):
+    with self.assertRaises(SystemExit) as context:
+      cli.main(['--autocrop=1'])
+    
+    self.assertEqual(context.exception.code, cli.EXIT_INVALID_ARGUMENTS)
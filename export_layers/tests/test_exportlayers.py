@@ -31,6 +31,24 @@ str = unicode
 #===============================================================================
 
 import os
+import shutil
+import tempfile
+
+import unittest
+
+from ..pylibgimpplugin.lib import mock
+from ..pylibgimpplugin.tests import gimpmocks
+
+from ..pylibgimpplugin import pylibgimp
+from ..pylibgimpplugin import itemdata
+from ..pylibgimpplugin import libfiles
+from ..pylibgimpplugin import overwrite
+from ..pylibgimpplugin import profiling
+from ..pylibgimpplugin import encoders
+
+from .. import constants
+from .. import exportlayers
+from .. import settings_plugin
 
 #===============================================================================
 
@@ -55,3 +73,791 @@ def test_export_layers(layer_exporter, main_settings):
     main_settings['file_extension'].value = file_extension
     main_settings['output_directory'].value = os.path.join(orig_output_directory, file_extension)
     layer_exporter.export_layers()
+
+#===============================================================================
+
+def assert_max_pdb_calls_per_layer(test_case, layer_exporter, max_num_calls_per_layer,
+                                   pdb=None):
+  """
+  Perform the export with `layer_exporter` and make `test_case` fail if the
+  number of PDB calls per exported layer exceeds `max_num_calls_per_layer`.
+  
+  PDB calls are made to `pdb`, `gimpmocks.MockPDB` by default, wrapped in
+  `profiling.TracingPDB`. Return the `TracingPDB` instance.
+  """
+  
+  tracing_pdb = profiling.TracingPDB(pdb if pdb is not None else gimpmocks.MockPDB())
+  
+  with profiling.replace_pdb([exportlayers, pylibgimp, itemdata], lambda orig_pdb: tracing_pdb):
+    layer_exporter.export_layers()
+  
+  num_exported_layers = len(layer_exporter.exported_layers)
+  test_case.assertGreater(num_exported_layers, 0)
+  
+  num_calls_per_layer = tracing_pdb.num_calls / num_exported_layers
+  test_case.assertLessEqual(
+    num_calls_per_layer, max_num_calls_per_layer,
+    "{0} PDB calls per layer exceed the budget of {1}; calls: {2}".format(
+      num_calls_per_layer, max_num_calls_per_layer,
+      {name: stats['count'] for name, stats in tracing_pdb.stats.items()}))
+  
+  return tracing_pdb
+
+#===============================================================================
+
+@mock.patch(__name__.split('.')[0] + '.pylibgimpplugin.libfiles.replace_file')
+@mock.patch(__name__.split('.')[0] + '.pylibgimpplugin.libfiles.make_dirs')
+class TestLayerExporterPDBCalls(unittest.TestCase):
+  
+  def setUp(self):
+    self.image = gimpmocks.MockImage()
+    self.image.width = 100
+    self.image.height = 100
+    
+    layer_group = gimpmocks.MockLayerGroup("Body")
+    layer_group.layers = [gimpmocks.MockLayer("Left Hand"), gimpmocks.MockLayer("Right Hand")]
+    for layer in layer_group.layers:
+      layer.parent = layer_group
+    
+    self.image.layers = [
+      gimpmocks.MockLayer("Corners"), layer_group,
+      gimpmocks.MockLayer("Hidden", visible=False), gimpmocks.MockLayer("Shadow")]
+    
+    self.main_settings = settings_plugin.MainSettings()
+    self.main_settings['output_directory'].value = "output"
+    self.main_settings['file_extension'].value = "png"
+    
+    self.layer_exporter = exportlayers.LayerExporter(
+      0, self.image, self.main_settings, overwrite.NoninteractiveOverwriteChooser(0), None,
+      cache_background_layer=False)
+  
+  def test_default_settings(self, mock_make_dirs, mock_replace_file):
+    assert_max_pdb_calls_per_layer(self, self.layer_exporter, 9)
+  
+  def test_autocrop(self, mock_make_dirs, mock_replace_file):
+    self.main_settings['autocrop'].value = True
+    assert_max_pdb_calls_per_layer(self, self.layer_exporter, 10)
+  
+  def test_use_image_size(self, mock_make_dirs, mock_replace_file):
+    self.main_settings['use_image_size'].value = True
+    assert_max_pdb_calls_per_layer(self, self.layer_exporter, 9)
+  
+  def test_layer_groups_as_directories(self, mock_make_dirs, mock_replace_file):
+    self.main_settings['layer_groups_as_directories'].value = True
+    assert_max_pdb_calls_per_layer(self, self.layer_exporter, 9)
+  
+  def test_merge_layer_groups_invisible_group(self, mock_make_dirs, mock_replace_file):
+    self.main_settings['merge_layer_groups'].value = True
+    self.image.layers = [self.image.layers[1]]
+    self.image.layers[0].visible = False
+    
+    tracing_pdb = profiling.TracingPDB(gimpmocks.MockPDB())
+    with profiling.replace_pdb([exportlayers, pylibgimp, itemdata], lambda orig_pdb: tracing_pdb):
+      self.layer_exporter.export_layers()
+    
+    self.assertEqual(tracing_pdb.stats['gimp_item_set_visible']['count'], 1)
+
+
+@mock.patch(__name__.split('.')[0] + '.exportlayers.pdb', new=gimpmocks.MockPDB())
+@mock.patch(__name__.split('.')[0] + '.pylibgimpplugin.pylibgimp.pdb', new=gimpmocks.MockPDB())
+@mock.patch(__name__.split('.')[0] + '.pylibgimpplugin.itemdata.pdb', new=gimpmocks.MockPDB())
+class TestLayerExporterExportPlan(unittest.TestCase):
+  
+  def setUp(self):
+    self.image = gimpmocks.MockImage()
+    self.image.width = 100
+    self.image.height = 100
+    
+    layer_group = gimpmocks.MockLayerGroup("Body")
+    layer_group.layers = [gimpmocks.MockLayer("Left Hand")]
+    for layer in layer_group.layers:
+      layer.parent = layer_group
+    
+    self.image.layers = [
+      gimpmocks.MockLayer("Corners"), layer_group, gimpmocks.MockLayer("Hidden", visible=False),
+      gimpmocks.MockLayer("[Background]")]
+    
+    self.main_settings = settings_plugin.MainSettings()
+    self.main_settings['output_directory'].value = "output"
+    self.main_settings['file_extension'].value = "png"
+    
+    self.layer_exporter = exportlayers.LayerExporter(
+      0, self.image, self.main_settings, overwrite.NoninteractiveOverwriteChooser(0), None,
+      dry_run=True, cache_background_layer=False)
+  
+  def _get_operations(self):
+    self.layer_exporter.export_layers()
+    return {job.layer_elem.orig_name: job.operations for job in self.layer_exporter.export_plan}
+  
+  def _set_background(self):
+    self.main_settings['square_bracketed_mode'].value = (
+      self.main_settings['square_bracketed_mode'].options['background'])
+  
+  def test_default_settings(self):
+    operations = self._get_operations()
+    
+    self.assertEqual(operations["Corners"], [
+      exportlayers.ExportJob.COPY_LAYER, exportlayers.ExportJob.RESIZE_IMAGE_TO_LAYERS])
+    self.assertEqual(operations["Hidden"], [
+      exportlayers.ExportJob.COPY_LAYER, exportlayers.ExportJob.SHOW_LAYER,
+      exportlayers.ExportJob.RESIZE_IMAGE_TO_LAYERS])
+  
+  def test_ignore_invisible(self):
+    self.main_settings['ignore_invisible'].value = True
+    self.assertNotIn("Hidden", self._get_operations())
+  
+  def test_autocrop(self):
+    self.main_settings['autocrop'].value = True
+    self.assertEqual(self._get_operations()["Corners"], [
+      exportlayers.ExportJob.COPY_LAYER, exportlayers.ExportJob.RESIZE_IMAGE_TO_LAYERS,
+      exportlayers.ExportJob.SET_ACTIVE_LAYER, exportlayers.ExportJob.AUTOCROP])
+  
+  def test_autocrop_use_image_size(self):
+    self.main_settings['autocrop'].value = True
+    self.main_settings['use_image_size'].value = True
+    self.assertEqual(self._get_operations()["Corners"], [
+      exportlayers.ExportJob.COPY_LAYER, exportlayers.ExportJob.SET_ACTIVE_LAYER,
+      exportlayers.ExportJob.AUTOCROP_LAYER, exportlayers.ExportJob.RESIZE_LAYER_TO_IMAGE])
+  
+  def test_background(self):
+    self._set_background()
+    operations = self._get_operations()
+    
+    self.assertNotIn("[Background]", operations)
+    self.assertEqual(operations["Corners"], [
+      exportlayers.ExportJob.INSERT_BACKGROUND, exportlayers.ExportJob.COPY_LAYER,
+      exportlayers.ExportJob.RESIZE_IMAGE_TO_LAYERS, exportlayers.ExportJob.MERGE_BACKGROUND])
+  
+  def test_background_autocrop(self):
+    self._set_background()
+    self.main_settings['autocrop'].value = True
+    self.assertEqual(self._get_operations()["Corners"], [
+      exportlayers.ExportJob.INSERT_BACKGROUND, exportlayers.ExportJob.COPY_LAYER,
+      exportlayers.ExportJob.RESIZE_IMAGE_TO_LAYERS, exportlayers.ExportJob.SET_ACTIVE_LAYER,
+      exportlayers.ExportJob.AUTOCROP, exportlayers.ExportJob.MERGE_BACKGROUND])
+  
+  def test_background_autocrop_crop_to_background(self):
+    self._set_background()
+    self.main_settings['autocrop'].value = True
+    self.main_settings['crop_to_background'].value = True
+    self.assertEqual(self._get_operations()["Corners"], [
+      exportlayers.ExportJob.INSERT_BACKGROUND, exportlayers.ExportJob.COPY_LAYER,
+      exportlayers.ExportJob.RESIZE_IMAGE_TO_LAYERS, exportlayers.ExportJob.MERGE_BACKGROUND,
+      exportlayers.ExportJob.SET_ACTIVE_LAYER, exportlayers.ExportJob.AUTOCROP])
+  
+  def test_background_autocrop_crop_to_background_use_image_size(self):
+    self._set_background()
+    self.main_settings['autocrop'].value = True
+    self.main_settings['crop_to_background'].value = True
+    self.main_settings['use_image_size'].value = True
+    self.assertEqual(self._get_operations()["Corners"], [
+      exportlayers.ExportJob.INSERT_BACKGROUND, exportlayers.ExportJob.COPY_LAYER,
+      exportlayers.ExportJob.AUTOCROP_BACKGROUND, exportlayers.ExportJob.MERGE_BACKGROUND,
+      exportlayers.ExportJob.RESIZE_LAYER_TO_IMAGE])
+  
+  def test_merge_layer_groups(self):
+    self.main_settings['merge_layer_groups'].value = True
+    operations = self._get_operations()
+    
+    self.assertNotIn("Left Hand", operations)
+    self.assertEqual(operations["Body"], [
+      exportlayers.ExportJob.COPY_LAYER, exportlayers.ExportJob.MERGE_LAYER_GROUP,
+      exportlayers.ExportJob.RESIZE_IMAGE_TO_LAYERS])
+  
+  def test_merge_layer_groups_invisible_group(self):
+    self.main_settings['merge_layer_groups'].value = True
+    self.image.layers[1].visible = False
+    operations = self._get_operations()
+    
+    self.assertEqual(operations["Body"], [
+      exportlayers.ExportJob.COPY_LAYER, exportlayers.ExportJob.SHOW_LAYER,
+      exportlayers.ExportJob.MERGE_LAYER_GROUP, exportlayers.ExportJob.RESIZE_IMAGE_TO_LAYERS])
+  
+  def test_ignore_layer_modes(self):
+    self.main_settings['ignore_layer_modes'].value = True
+    self.assertEqual(self._get_operations()["Corners"], [
+      exportlayers.ExportJob.COPY_LAYER, exportlayers.ExportJob.IGNORE_LAYER_MODE,
+      exportlayers.ExportJob.RESIZE_IMAGE_TO_LAYERS])
+  
+  def test_layer_data_options_do_not_change_export_plan(self):
+    self.main_settings['ignore_invisible'].value = True
+    operations = self._get_operations()
+    
+    self.layer_exporter.lazy_layer_data = False
+    self.layer_exporter.use_bulk_filtering = False
+    self.assertEqual(self._get_operations(), operations)
+
+
+class MockPDBWithImageList(gimpmocks.MockPDB):
+  
+  """
+  This class tracks images created via `gimp_image_new` in `images`, which can
+  be used as a replacement for `gimp.image_list()`.
+  """
+  
+  def __init__(self, images):
+    super(MockPDBWithImageList, self).__init__()
+    
+    self.images = images
+  
+  def gimp_image_new(self, width, height, image_type):
+    image = super(MockPDBWithImageList, self).gimp_image_new(width, height, image_type)
+    image.ID = max(image_.ID for image_ in self.images) + 1 if self.images else 1
+    self.images.append(image)
+    return image
+  
+  def gimp_image_delete(self, image):
+    super(MockPDBWithImageList, self).gimp_image_delete(image)
+    if image in self.images:
+      self.images.remove(image)
+
+
+@mock.patch(__name__.split('.')[0] + '.exportlayers.gimpshelf.shelf', new_callable=gimpmocks.MockGimpShelf)
+class TestBackgroundLayerCache(unittest.TestCase):
+  
+  def setUp(self):
+    self.image = gimpmocks.MockImage()
+    self.image.ID = 1
+    self.image.base_type = 0
+    
+    self.other_image = gimpmocks.MockImage()
+    self.other_image.ID = 2
+    self.other_image.base_type = 0
+    
+    self.pdb = MockPDBWithImageList([self.image, self.other_image])
+    
+    self.patchers = [
+      mock.patch(__name__.split('.')[0] + '.exportlayers.pdb', new=self.pdb),
+      mock.patch(__name__.split('.')[0] + '.pylibgimpplugin.pylibgimp.pdb', new=self.pdb),
+      mock.patch(__name__.split('.')[0] + '.pylibgimpplugin.itemdata.pdb', new=self.pdb),
+      mock.patch(__name__.split('.')[0] + '.pylibgimpplugin.libfiles.make_dirs'),
+      mock.patch(__name__.split('.')[0] + '.pylibgimpplugin.libfiles.replace_file'),
+      mock.patch(
+        __name__.split('.')[0] + '.exportlayers.gimp.image_list', new=lambda: list(self.pdb.images),
+        create=True),
+    ]
+    for patcher in self.patchers:
+      patcher.start()
+    
+    self.background_layer = gimpmocks.MockLayer("Background")
+    self.cache = exportlayers.BackgroundLayerCache()
+  
+  def tearDown(self):
+    for patcher in self.patchers:
+      patcher.stop()
+  
+  def test_get_empty(self, mock_shelf):
+    self.assertIsNone(self.cache.get(self.image, "key"))
+  
+  def test_get_hit(self, mock_shelf):
+    self.cache.set(self.image, "key", self.background_layer)
+    
+    cached_layer = exportlayers.BackgroundLayerCache().get(self.image, "key")
+    self.assertIsNotNone(cached_layer)
+    self.assertEqual(cached_layer.name, b"Background")
+    self.assertIsNot(cached_layer, self.background_layer)
+  
+  def test_get_miss_different_key(self, mock_shelf):
+    self.cache.set(self.image, "key", self.background_layer)
+    self.assertIsNone(self.cache.get(self.image, "other key"))
+  
+  def test_get_miss_different_image(self, mock_shelf):
+    self.cache.set(self.image, "key", self.background_layer)
+    self.assertIsNone(self.cache.get(self.other_image, "key"))
+  
+  def test_set_replaces_cached_layer(self, mock_shelf):
+    self.cache.set(self.image, "key", self.background_layer)
+    self.cache.set(self.image, "new key", gimpmocks.MockLayer("New Background"))
+    
+    self.assertIsNone(self.cache.get(self.image, "key"))
+    self.assertEqual(self.cache.get(self.image, "new key").name, b"New Background")
+    self.assertEqual(len(self.pdb.images), 3)
+  
+  def test_closed_image_invalidates_cached_layer(self, mock_shelf):
+    self.cache.set(self.image, "key", self.background_layer)
+    self.pdb.images.remove(self.image)
+    
+    self.assertIsNone(self.cache.get(self.image, "key"))
+    self.assertEqual(self.pdb.images, [self.other_image])
+  
+  def _create_layer_exporter(self, **kwargs):
+    self.image.width = 100
+    self.image.height = 100
+    self.image.layers = [gimpmocks.MockLayer("Corners"), gimpmocks.MockLayer("[Background]")]
+    for layer in self.image.layers:
+      layer.width = 10
+      layer.height = 5
+    
+    main_settings = settings_plugin.MainSettings()
+    main_settings['output_directory'].value = "output"
+    main_settings['file_extension'].value = "png"
+    main_settings['square_bracketed_mode'].value = (
+      main_settings['square_bracketed_mode'].options['background'])
+    
+    return exportlayers.LayerExporter(
+      0, self.image, main_settings, overwrite.NoninteractiveOverwriteChooser(0), None, **kwargs)
+  
+  def test_layer_exporter_merges_background_only_if_changed(self, mock_shelf):
+    layer_exporter = self._create_layer_exporter(cache_background_layer=True)
+    
+    with mock.patch.object(exportlayers.BackgroundLayerCache, 'set', autospec=True,
+                           side_effect=exportlayers.BackgroundLayerCache.set) as mock_set:
+      layer_exporter.export_layers()
+      self.assertEqual(mock_set.call_count, 1)
+      
+      layer_exporter.export_layers()
+      self.assertEqual(mock_set.call_count, 1)
+      
+      self.image.layers[1].pixel_value = b"\xff"
+      layer_exporter.export_layers()
+      self.assertEqual(mock_set.call_count, 2)
+  
+  def test_layer_exporter_cache_disabled_by_default(self, mock_shelf):
+    self._create_layer_exporter().export_layers()
+    self.assertFalse(mock_shelf.has_key(exportlayers.BackgroundLayerCache._SHELF_KEY))
+    self.assertEqual(self.pdb.images, [self.image, self.other_image])
+
+
+class TestOverwriteHandler(unittest.TestCase):
+  
+  def setUp(self):
+    self.temp_directory = tempfile.mkdtemp()
+    self.filename = os.path.join(self.temp_directory, "image.png")
+    self.uniq_filename = os.path.join(self.temp_directory, "image (1).png")
+    with open(self.filename, "w"):
+      pass
+    
+    self.directory_cache = libfiles.DirectoryCache()
+  
+  def tearDown(self):
+    shutil.rmtree(self.temp_directory)
+  
+  def _handle(self, overwrite_mode, **kwargs):
+    return exportlayers.OverwriteHandler.handle(
+      self.filename, overwrite.NoninteractiveOverwriteChooser(overwrite_mode),
+      directory_cache=self.directory_cache, **kwargs)
+  
+  def test_rename_new(self):
+    self.assertEqual(
+      self._handle(exportlayers.OverwriteHandler.RENAME_NEW), (False, self.uniq_filename))
+    self.assertFalse(os.path.exists(self.uniq_filename))
+  
+  def test_rename_existing(self):
+    self.assertEqual(
+      self._handle(exportlayers.OverwriteHandler.RENAME_EXISTING), (False, self.filename))
+    self.assertTrue(os.path.exists(self.uniq_filename))
+    self.assertFalse(self.directory_cache.exists(self.filename))
+    self.assertTrue(self.directory_cache.exists(self.uniq_filename))
+  
+  def test_rename_existing_does_not_overwrite_new_files(self):
+    self.directory_cache.exists(self.filename)
+    # Create a file unknown to the directory cache.
+    with open(self.uniq_filename, "w") as file_:
+      file_.write("new")
+    
+    self._handle(exportlayers.OverwriteHandler.RENAME_EXISTING)
+    
+    with open(self.uniq_filename) as file_:
+      self.assertEqual(file_.read(), "new")
+    self.assertFalse(os.path.exists(self.filename))
+    self.assertTrue(os.path.exists(os.path.join(self.temp_directory, "image (2).png")))
+    self.assertTrue(self.directory_cache.exists(os.path.join(self.temp_directory, "image (2).png")))
+  
+  def test_rename_existing_dry_run(self):
+    self._handle(exportlayers.OverwriteHandler.RENAME_EXISTING, dry_run=True)
+    self.assertFalse(os.path.exists(self.uniq_filename))
+    self.assertTrue(self.directory_cache.exists(self.filename))
+  
+  def test_nonexistent_file(self):
+    self.filename = os.path.join(self.temp_directory, "other.png")
+    self.assertEqual(self._handle(exportlayers.OverwriteHandler.SKIP), (False, self.filename))
+
+
+class TestExportManifest(unittest.TestCase):
+  
+  def setUp(self):
+    self.temp_directory = tempfile.mkdtemp()
+    self.filename = os.path.join(self.temp_directory, "subdirectory", "image.png")
+    os.mkdir(os.path.dirname(self.filename))
+    with open(self.filename, "w"):
+      pass
+    
+    self.directory_cache = libfiles.DirectoryCache()
+    self.manifest = exportlayers.ExportManifest(self.temp_directory, self.directory_cache)
+  
+  def tearDown(self):
+    shutil.rmtree(self.temp_directory)
+  
+  def test_save_load(self):
+    self.manifest.update(self.filename, "abc")
+    self.manifest.save()
+    
+    manifest = exportlayers.ExportManifest(self.temp_directory, libfiles.DirectoryCache())
+    manifest.load()
+    self.assertTrue(manifest.is_up_to_date(self.filename, "abc"))
+    self.assertFalse(manifest.is_up_to_date(self.filename, "def"))
+  
+  def test_load_nonexistent_manifest(self):
+    self.manifest.load()
+    self.assertFalse(self.manifest.is_up_to_date(self.filename, "abc"))
+  
+  def test_load_invalid_manifest(self):
+    with open(self.manifest.filename, "w") as manifest_file:
+      manifest_file.write("[not a manifest")
+    
+    self.manifest.load()
+    self.assertFalse(self.manifest.is_up_to_date(self.filename, "abc"))
+  
+  def test_is_up_to_date_file_removed(self):
+    self.manifest.update(self.filename, "abc")
+    self.directory_cache.remove(self.filename)
+    self.assertFalse(self.manifest.is_up_to_date(self.filename, "abc"))
+  
+  def test_remove(self):
+    self.manifest.update(self.filename, "abc")
+    self.manifest.remove(self.filename)
+    self.assertFalse(self.manifest.is_up_to_date(self.filename, "abc"))
+
+
+@mock.patch(__name__.split('.')[0] + '.exportlayers.pdb', new=gimpmocks.MockPDB())
+@mock.patch(__name__.split('.')[0] + '.pylibgimpplugin.pylibgimp.pdb', new=gimpmocks.MockPDB())
+@mock.patch(__name__.split('.')[0] + '.pylibgimpplugin.itemdata.pdb', new=gimpmocks.MockPDB())
+class TestLayerExporterFileWriting(unittest.TestCase):
+  
+  def setUp(self):
+    self.temp_directory = tempfile.mkdtemp()
+    
+    self.image = gimpmocks.MockImage()
+    self.image.layers = [gimpmocks.MockLayer(layer_name) for layer_name in ["Corners", "Shadow"]]
+    for layer in self.image.layers:
+      layer.width = 10
+      layer.height = 5
+    
+    self.main_settings = settings_plugin.MainSettings()
+    self.main_settings['output_directory'].value = self.temp_directory
+    self.main_settings['file_extension'].value = "data"
+    self.main_settings['use_image_size'].value = True
+    
+    self.layer_exporter = exportlayers.LayerExporter(
+      0, self.image, self.main_settings, overwrite.NoninteractiveOverwriteChooser(0), None,
+      cache_background_layer=False, in_process_file_extensions=["data", "png"])
+  
+  def tearDown(self):
+    shutil.rmtree(self.temp_directory)
+  
+  def _get_output_filenames(self, file_extension):
+    return [os.path.join(self.temp_directory, layer_name + "." + file_extension)
+            for layer_name in ["Corners", "Shadow"]]
+  
+  def test_export_layers(self):
+    self.layer_exporter.export_layers()
+    
+    for filename in self._get_output_filenames("data"):
+      self.assertEqual(os.path.getsize(filename), 10 * 5 * 4)
+    self.assertEqual(len(self.layer_exporter.exported_layers), 2)
+  
+  def test_export_layers_png(self):
+    self.main_settings['file_extension'].value = "png"
+    self.layer_exporter.export_layers()
+    
+    for filename in self._get_output_filenames("png"):
+      with open(filename, 'rb') as png_file:
+        self.assertTrue(png_file.read().startswith(b"\x89PNG"))
+  
+  def test_export_layers_not_in_process(self):
+    def _save_empty_file(image, layer, filename, raw_filename, run_mode):
+      with open(filename, 'wb'):
+        pass
+    
+    self.layer_exporter.in_process_file_extensions = ["png"]
+    with mock.patch.object(exportlayers.pdb, 'file_raw_save', new=_save_empty_file, create=True):
+      self.layer_exporter.export_layers()
+    
+    for filename in self._get_output_filenames("data"):
+      self.assertEqual(os.path.getsize(filename), 0)
+  
+  def test_export_layers_file_procedure_creates_no_file(self):
+    self.layer_exporter.in_process_file_extensions = ["png"]
+    with self.assertRaises(exportlayers.ExportLayersError):
+      self.layer_exporter.export_layers()
+    
+    self.assertEqual(os.listdir(self.temp_directory), [])
+    self.assertEqual(self.layer_exporter.exported_layers, [])
+  
+  def test_export_layers_writes_to_temp_files(self):
+    saved_filenames = []
+    
+    def _save_file(image, layer, filename, raw_filename, run_mode):
+      saved_filenames.append(filename.decode())
+      with open(filename, 'wb'):
+        pass
+    
+    self.layer_exporter.in_process_file_extensions = []
+    with mock.patch.object(exportlayers.pdb, 'file_raw_save', new=_save_file, create=True):
+      self.layer_exporter.export_layers()
+    
+    self.assertEqual(sorted(os.listdir(self.temp_directory)), ["Corners.data", "Shadow.data"])
+    for saved_filename, output_filename in zip(saved_filenames, self._get_output_filenames("data")):
+      self.assertNotEqual(saved_filename, output_filename)
+      self.assertEqual(os.path.dirname(saved_filename), self.temp_directory)
+      self.assertTrue(saved_filename.endswith(".data"))
+  
+  def test_export_layers_does_not_leave_temp_files(self):
+    self.layer_exporter.export_layers()
+    self.assertEqual(sorted(os.listdir(self.temp_directory)), ["Corners.data", "Shadow.data"])
+
+  def test_export_layers_default_file_extension_does_not_overwrite_other_layer(self):
+    def _save_file(image, layer, filename, raw_filename, run_mode):
+      if raw_filename.endswith(b".foo"):
+        raise RuntimeError("unsupported file format")
+      with open(filename, 'wb'):
+        pass
+
+    self.image.layers[0].name = b"Corners.foo"
+    self.image.layers[1].name = b"Corners"
+    self.main_settings['file_extension'].value = "png"
+    self.main_settings['layer_groups_as_directories'].value = True
+    self.main_settings['file_ext_mode'].value = (
+      self.main_settings['file_ext_mode'].options['use_as_file_extensions'])
+
+    self.layer_exporter.in_process_file_extensions = []
+    with mock.patch.object(exportlayers.pdb, 'gimp_file_save', new=_save_file, create=True):
+      self.layer_exporter.export_layers()
+
+    self.assertEqual(
+      sorted(job.output_filename for job in self.layer_exporter.export_plan),
+      [os.path.join(self.temp_directory, "Corners (1).png"),
+       os.path.join(self.temp_directory, "Corners.png")])
+    self.assertEqual(sorted(os.listdir(self.temp_directory)), ["Corners (1).png", "Corners.png"])
+  
+  def test_export_layers_failed_write(self):
+    with mock.patch.object(encoders, 'write_image_file', side_effect=IOError(13, "Permission denied")):
+      with self.assertRaises(exportlayers.ExportLayersError) as context:
+        self.layer_exporter.export_layers()
+    
+    self.assertIn("Permission denied", str(context.exception))
+    self.assertIn("Corners.data", str(context.exception))
+  
+  def test_export_layers_write_behind(self):
+    self.layer_exporter.write_behind = True
+    self.layer_exporter.export_layers()
+    
+    for filename in self._get_output_filenames("data"):
+      self.assertEqual(os.path.getsize(filename), 10 * 5 * 4)
+    self.assertEqual(len(self.layer_exporter.exported_layers), 2)
+  
+  def test_export_layers_write_behind_failed_write(self):
+    self.layer_exporter.write_behind = True
+    with mock.patch.object(encoders, 'write_image_file', side_effect=IOError(13, "Permission denied")):
+      with self.assertRaises(exportlayers.ExportLayersError) as context:
+        self.layer_exporter.export_layers()
+    
+    self.assertIn("Permission denied", str(context.exception))
+    self.assertIn("Corners.data", str(context.exception))
+  
+  def _export_layers_write_behind_failed_write(self, failed_layer_name):
+    orig_write_image_file = encoders.write_image_file
+    
+    def _write_image_file(filename, *args, **kwargs):
+      if os.path.basename(filename).startswith(failed_layer_name):
+        raise IOError(13, "Permission denied")
+      else:
+        orig_write_image_file(filename, *args, **kwargs)
+    
+    self.layer_exporter.write_behind = True
+    with mock.patch.object(encoders, 'write_image_file', side_effect=_write_image_file):
+      with self.assertRaises(exportlayers.ExportLayersError) as context:
+        self.layer_exporter.export_layers()
+    
+    return context.exception
+  
+  def test_export_layers_write_behind_failed_write_removes_layer(self):
+    exception = self._export_layers_write_behind_failed_write("Shadow")
+    
+    self.assertTrue(str(exception).startswith("Shadow: "))
+    self.assertEqual(
+      [layer.name for layer in self.layer_exporter.exported_layers], [b"Corners"])
+    self.assertFalse(os.path.exists(self._get_output_filenames("data")[1]))
+  
+  def test_export_layers_write_behind_failed_write_first_layer(self):
+    exception = self._export_layers_write_behind_failed_write("Corners")
+    
+    self.assertTrue(str(exception).startswith("Corners: "))
+    self.assertNotIn(b"Corners", [layer.name for layer in self.layer_exporter.exported_layers])
+  
+  def test_export_layers_write_behind_without_in_process_file_extensions(self):
+    self.layer_exporter.in_process_file_extensions = ["jpg"]
+    self.layer_exporter.write_behind = True
+    with self.assertRaises(ValueError):
+      self.layer_exporter.export_layers()
+  
+  def _export_layers_incremental(self):
+    self.layer_exporter.incremental = True
+    with mock.patch.object(encoders, 'write_image_file', wraps=encoders.write_image_file) as mock_write:
+      self.layer_exporter.export_layers()
+    
+    return [os.path.basename(write_args[0]) for write_args, unused_ in mock_write.call_args_list]
+  
+  def test_incremental_skips_unchanged_layers(self):
+    self.assertEqual(self._export_layers_incremental(), ["Corners.data", "Shadow.data"])
+    self.assertEqual(self._export_layers_incremental(), [])
+    self.assertEqual(len(self.layer_exporter.exported_layers), 2)
+  
+  def test_incremental_pixels_changed(self):
+    self._export_layers_incremental()
+    self.image.layers[1].pixel_value = b"\xff"
+    self.assertEqual(self._export_layers_incremental(), ["Shadow.data"])
+    
+    with open(self._get_output_filenames("data")[1], 'rb') as file_:
+      self.assertEqual(file_.read(), b"\xff" * 10 * 5 * 4)
+  
+  def test_incremental_settings_changed(self):
+    self._export_layers_incremental()
+    self.main_settings['ignore_layer_modes'].value = True
+    self.assertEqual(self._export_layers_incremental(), ["Corners.data", "Shadow.data"])
+  
+  def test_incremental_encoder_changed(self):
+    def _save_empty_file(image, layer, filename, raw_filename, run_mode):
+      with open(filename, 'wb'):
+        pass
+    
+    self.layer_exporter.in_process_file_extensions = []
+    with mock.patch.object(exportlayers.pdb, 'file_raw_save', new=_save_empty_file, create=True):
+      self._export_layers_incremental()
+    
+    self.layer_exporter.in_process_file_extensions = ["data"]
+    self.assertEqual(self._export_layers_incremental(), ["Corners.data", "Shadow.data"])
+  
+  def test_incremental_file_removed(self):
+    self._export_layers_incremental()
+    os.remove(self._get_output_filenames("data")[0])
+    self.assertEqual(self._export_layers_incremental(), ["Corners.data"])
+  
+  def test_incremental_manifest_not_saved_on_error(self):
+    with mock.patch.object(encoders, 'write_image_file', side_effect=IOError(13, "Permission denied")):
+      with self.assertRaises(exportlayers.ExportLayersError):
+        self._export_layers_incremental()
+    
+    self.assertFalse(os.path.exists(os.path.join(
+      self.temp_directory, constants.EXPORT_MANIFEST_FILENAME)))
+  
+  def _get_dry_run_and_real_output_filenames(self, overwrite_mode):
+    self.image.layers[1].name = "Corners (1)"
+    with open(os.path.join(self.temp_directory, "Corners.data"), 'wb') as file_:
+      file_.write(b"existing")
+    
+    self.layer_exporter.overwrite_chooser = overwrite.NoninteractiveOverwriteChooser(overwrite_mode)
+    
+    self.layer_exporter.dry_run = True
+    self.layer_exporter.export_layers()
+    dry_run_output_filenames = [job.output_filename for job in self.layer_exporter.export_plan]
+    dry_run_overwrite_modes = [job.overwrite_mode for job in self.layer_exporter.export_plan]
+    
+    self.layer_exporter.dry_run = False
+    self.layer_exporter.export_layers()
+    output_filenames = [job.output_filename for job in self.layer_exporter.export_plan]
+    
+    return dry_run_output_filenames, dry_run_overwrite_modes, output_filenames
+  
+  def test_dry_run_rename_new(self):
+    dry_run_output_filenames, unused_, output_filenames = (
+      self._get_dry_run_and_real_output_filenames(exportlayers.OverwriteHandler.RENAME_NEW))
+    
+    self.assertEqual(dry_run_output_filenames, output_filenames)
+    self.assertEqual(
+      output_filenames,
+      [os.path.join(self.temp_directory, "Corners (1).data"),
+       os.path.join(self.temp_directory, "Corners (1) (1).data")])
+  
+  def test_dry_run_rename_existing(self):
+    dry_run_output_filenames, dry_run_overwrite_modes, output_filenames = (
+      self._get_dry_run_and_real_output_filenames(exportlayers.OverwriteHandler.RENAME_EXISTING))
+    
+    self.assertEqual(dry_run_output_filenames, output_filenames)
+    self.assertEqual(
+      dry_run_overwrite_modes,
+      [exportlayers.OverwriteHandler.RENAME_EXISTING, exportlayers.OverwriteHandler.RENAME_EXISTING])
+    self.assertEqual(
+      sorted(os.listdir(self.temp_directory)),
+      ["Corners (1) (1).data", "Corners (1).data", "Corners.data"])
+  
+  def test_dry_run_does_not_let_user_choose(self):
+    with open(os.path.join(self.temp_directory, "Corners.data"), 'wb') as file_:
+      file_.write(b"existing")
+    
+    overwrite_chooser = mock.Mock(spec=overwrite.OverwriteChooser)
+    overwrite_chooser.overwrite_mode = exportlayers.OverwriteHandler.RENAME_NEW
+    self.layer_exporter.overwrite_chooser = overwrite_chooser
+    
+    self.layer_exporter.dry_run = True
+    self.layer_exporter.export_layers()
+    
+    self.assertFalse(overwrite_chooser.choose.called)
+    self.assertEqual(
+      [job.output_filename for job in self.layer_exporter.export_plan],
+      [os.path.join(self.temp_directory, "Corners (1).data"),
+       os.path.join(self.temp_directory, "Shadow.data")])
+    self.assertEqual(
+      [job.overwrite_mode for job in self.layer_exporter.export_plan],
+      [exportlayers.OverwriteHandler.RENAME_NEW, None])
+
+
+@mock.patch(__name__.split('.')[0] + '.pylibgimpplugin.libfiles.replace_file')
+@mock.patch(__name__.split('.')[0] + '.pylibgimpplugin.libfiles.make_dirs')
+@mock.patch(__name__.split('.')[0] + '.exportlayers.pdb', new=gimpmocks.MockPDB())
+@mock.patch(__name__.split('.')[0] + '.pylibgimpplugin.pylibgimp.pdb', new=gimpmocks.MockPDB())
+@mock.patch(__name__.split('.')[0] + '.pylibgimpplugin.itemdata.pdb', new=gimpmocks.MockPDB())
+class TestBatchLayerExporter(unittest.TestCase):
+  
+  def setUp(self):
+    self.images = []
+    for layer_names in [["Corners", "Shadow"], ["Corners"], ["Frame"]]:
+      image = gimpmocks.MockImage("image.xcf")
+      image.layers = [gimpmocks.MockLayer(layer_name) for layer_name in layer_names]
+      self.images.append(image)
+    self.images[2].name = b"other.xcf"
+    
+    self.main_settings = settings_plugin.MainSettings()
+    self.main_settings['output_directory'].value = "output"
+    self.main_settings['file_extension'].value = "png"
+    
+    self.batch_layer_exporter = exportlayers.BatchLayerExporter(
+      0, self.images, self.main_settings, overwrite.NoninteractiveOverwriteChooser(0), None,
+      cache_background_layer=False)
+  
+  def test_export_images(self, mock_make_dirs, mock_replace_file):
+    self.batch_layer_exporter.export_images()
+    
+    results = self.batch_layer_exporter.results
+    self.assertEqual([result.output_directory for result in results],
+                     [os.path.join("output", "image"), os.path.join("output", "image (1)"),
+                      os.path.join("output", "other")])
+    self.assertEqual([result.exported_layer_names for result in results],
+                     [["Corners", "Shadow"], ["Corners"], ["Frame"]])
+    self.assertEqual([result.error for result in results], [None, None, None])
+    self.assertEqual(self.main_settings['output_directory'].value, "output")
+  
+  def test_export_images_without_subdirectories(self, mock_make_dirs, mock_replace_file):
+    self.batch_layer_exporter.use_image_subdirectories = False
+    self.batch_layer_exporter.export_images()
+    
+    self.assertEqual([result.output_directory for result in self.batch_layer_exporter.results],
+                     ["output", "output", "output"])
+  
+  def test_export_images_continues_on_error(self, mock_make_dirs, mock_replace_file):
+    with mock.patch.object(self.batch_layer_exporter.layer_exporter, '_export_layers',
+                           side_effect=exportlayers.ExportLayersError("error")):
+      self.batch_layer_exporter.export_images()
+    
+    self.assertEqual([result.error for result in self.batch_layer_exporter.results],
+                     ["error", "error", "error"])
+  
+  def test_export_images_stop_on_error(self, mock_make_dirs, mock_replace_file):
+    self.batch_layer_exporter.stop_on_error = True
+    with mock.patch.object(self.batch_layer_exporter.layer_exporter, '_export_layers',
+                           side_effect=exportlayers.ExportLayersError("error")):
+      with self.assertRaises(exportlayers.ExportLayersError):
+        self.batch_layer_exporter.export_images()
+    
+    self.assertEqual(len(self.batch_layer_exporter.results), 1)
+    self.assertEqual(self.main_settings['output_directory'].value, "output")
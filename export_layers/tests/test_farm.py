@@ -0,0 +1,281 @@
+#-------------------------------------------------------------------------------
+#
+# This file is part of Export Layers.
+#
+# Copyright (C) 2013, 2014 khalim19 <khalim19@gmail.com>
+#
+# Export Layers is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# Export Layers is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with Export Layers.  If not, see <http://www.gnu.org/licenses/>.
+#
+#-------------------------------------------------------------------------------
+
+#===============================================================================
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import unicode_literals
+from __future__ import division
+
+str = unicode
+
+#===============================================================================
+
+import os
+import json
+import shutil
+import tempfile
+
+import unittest
+
+from ..pylibgimpplugin.lib import mock
+from ..pylibgimpplugin.tests import gimpmocks
+
+from ..pylibgimpplugin import overwrite
+
+from .. import exportlayers
+from .. import farm
+from .. import settings_plugin
+
+#===============================================================================
+
+LIB_NAME = __name__.split('.')[0]
+
+#===============================================================================
+
+def _create_image():
+  image = gimpmocks.MockImage("image.xcf")
+  image.width = 100
+  image.height = 100
+  
+  layer_group = gimpmocks.MockLayerGroup("Body")
+  layer_group.layers = [gimpmocks.MockLayer("Left Hand"), gimpmocks.MockLayer("Right Hand")]
+  for layer in layer_group.layers:
+    layer.parent = layer_group
+  
+  image.layers = [
+    gimpmocks.MockLayer("Corners"), layer_group, gimpmocks.MockLayer("Shadow"),
+    gimpmocks.MockLayer("Frame"), gimpmocks.MockLayer("Frame.png")]
+  
+  for tattoo, layer in enumerate(image.layers + layer_group.layers, start=1):
+    layer.tattoo = tattoo
+  
+  return image
+
+#===============================================================================
+
+@mock.patch(LIB_NAME + '.pylibgimpplugin.libfiles.replace_file')
+@mock.patch(LIB_NAME + '.pylibgimpplugin.libfiles.make_dirs')
+@mock.patch(LIB_NAME + '.exportlayers.pdb', new=gimpmocks.MockPDB())
+@mock.patch(LIB_NAME + '.pylibgimpplugin.pylibgimp.pdb', new=gimpmocks.MockPDB())
+@mock.patch(LIB_NAME + '.pylibgimpplugin.itemdata.pdb', new=gimpmocks.MockPDB())
+class TestFarmCoordinator(unittest.TestCase):
+  
+  def setUp(self):
+    self.image = _create_image()
+    
+    self.main_settings = settings_plugin.MainSettings()
+    self.main_settings['output_directory'].value = "output"
+    self.main_settings['file_extension'].value = "png"
+    self.main_settings['strip_mode'].value = self.main_settings['strip_mode'].options['always']
+    
+    self.coordinator = farm.FarmCoordinator("image.xcf", self.main_settings, 2)
+  
+  def test_create_shards(self, mock_make_dirs, mock_replace_file):
+    shards = self.coordinator.create_shards(self.coordinator.create_export_plan(self.image))
+    
+    self.assertEqual(len(shards), 2)
+    self.assertEqual([tattoo for tattoo, unused_ in shards[0]], [1, 4, 6])
+    self.assertEqual([tattoo for tattoo, unused_ in shards[1]], [3, 5, 7])
+    
+    self.assertEqual(dict(shards[0] + shards[1])[5], os.path.abspath("output/Frame (1).png"))
+  
+  def test_create_shards_more_workers_than_layers(self, mock_make_dirs, mock_replace_file):
+    self.coordinator.num_workers = 10
+    shards = self.coordinator.create_shards(self.coordinator.create_export_plan(self.image))
+    
+    self.assertEqual(len(shards), 6)
+  
+  def test_layer_assignments(self, mock_make_dirs, mock_replace_file):
+    shards = self.coordinator.create_shards(self.coordinator.create_export_plan(self.image))
+    
+    for shard in shards:
+      layer_exporter = exportlayers.LayerExporter(
+        0, _create_image(), self.main_settings, overwrite.NoninteractiveOverwriteChooser(0), None,
+        cache_background_layer=False, layer_assignments=dict(shard))
+      layer_exporter.export_layers()
+      
+      self.assertEqual(
+        [(job.layer_elem.item.tattoo, job.output_filename) for job in layer_exporter.export_plan],
+        shard)
+  
+  @mock.patch(LIB_NAME + '.farm.subprocess.Popen')
+  @mock.patch(LIB_NAME + '.farm.pdb')
+  def test_export_layers_worker_without_result(self, mock_pdb, mock_popen, mock_make_dirs, mock_replace_file):
+    mock_pdb.gimp_file_load.return_value = self.image
+    mock_popen.return_value.wait.return_value = 1
+    
+    with self.assertRaises(exportlayers.ExportLayersError):
+      self.coordinator.export_layers()
+    
+    self.assertEqual(mock_popen.call_count, 2)
+    self.assertEqual(len(self.coordinator.errors), 2)
+    self.assertEqual(self.coordinator.exported_layer_names, [])
+
+
+class MockPDBFailingSave(gimpmocks.MockPDB):
+  
+  def gimp_file_save(self, image, layer, filename, raw_filename, run_mode=None):
+    raise RuntimeError("file format not supported")
+
+
+@mock.patch(LIB_NAME + '.exportlayers.pdb', new=MockPDBFailingSave())
+@mock.patch(LIB_NAME + '.pylibgimpplugin.pylibgimp.pdb', new=gimpmocks.MockPDB())
+@mock.patch(LIB_NAME + '.pylibgimpplugin.itemdata.pdb', new=gimpmocks.MockPDB())
+class TestFarmCoordinatorExistingFiles(unittest.TestCase):
+  
+  def setUp(self):
+    self.temp_directory = tempfile.mkdtemp()
+    with open(os.path.join(self.temp_directory, "Corners.data"), 'w') as file_:
+      file_.write("existing")
+    
+    self.image = gimpmocks.MockImage("image.xcf")
+    self.image.layers = [gimpmocks.MockLayer("Corners"), gimpmocks.MockLayer("Corners (1)")]
+    for tattoo, layer in enumerate(self.image.layers, start=1):
+      layer.tattoo = tattoo
+    
+    self.main_settings = settings_plugin.MainSettings()
+    self.main_settings['output_directory'].value = self.temp_directory
+    self.main_settings['file_extension'].value = "data"
+    
+    self.coordinator = farm.FarmCoordinator("image.xcf", self.main_settings, 2)
+  
+  def tearDown(self):
+    shutil.rmtree(self.temp_directory)
+  
+  def _set_overwrite_mode(self, overwrite_mode):
+    self.main_settings['overwrite_mode'].value = overwrite_mode
+  
+  def _get_output_filenames(self, shards):
+    return [os.path.basename(output_filename)
+            for shard in shards for unused_, output_filename in shard]
+  
+  def test_create_shards_rename_new(self):
+    self._set_overwrite_mode(exportlayers.OverwriteHandler.RENAME_NEW)
+    shards = self.coordinator.create_shards(self.coordinator.create_export_plan(self.image))
+    
+    # The second layer must not be exported to the file the first layer is
+    # renamed to.
+    self.assertEqual(len(shards), 2)
+    self.assertEqual(self._get_output_filenames(shards), ["Corners (1).data", "Corners (1) (1).data"])
+  
+  def test_create_shards_skip(self):
+    self._set_overwrite_mode(exportlayers.OverwriteHandler.SKIP)
+    shards = self.coordinator.create_shards(self.coordinator.create_export_plan(self.image))
+    
+    self.assertEqual(self._get_output_filenames(shards), ["Corners (1).data"])
+  
+  def test_create_shards_cancel(self):
+    self._set_overwrite_mode(exportlayers.OverwriteHandler.CANCEL)
+    with self.assertRaises(exportlayers.ExportLayersCancelError):
+      self.coordinator.create_export_plan(self.image)
+  
+  def test_rename_existing_files(self):
+    self._set_overwrite_mode(exportlayers.OverwriteHandler.RENAME_EXISTING)
+    export_plan = self.coordinator.create_export_plan(self.image)
+    self.coordinator.rename_existing_files(export_plan)
+    
+    self.assertEqual(
+      self._get_output_filenames(self.coordinator.create_shards(export_plan)),
+      ["Corners.data", "Corners (1).data"])
+    self.assertEqual(os.listdir(self.temp_directory), ["Corners (1) (1).data"])
+  
+  def test_layer_assignments_keep_output_filenames(self):
+    output_filename = os.path.join(self.temp_directory, "Corners.data")
+    
+    layer_exporter = exportlayers.LayerExporter(
+      0, self.image, self.main_settings,
+      overwrite.NoninteractiveOverwriteChooser(exportlayers.OverwriteHandler.RENAME_NEW), None,
+      layer_assignments={1: output_filename}, in_process_file_extensions=["data"])
+    layer_exporter.export_layers()
+    
+    self.assertEqual(layer_exporter.export_plan[0].output_filename, output_filename)
+    self.assertEqual(os.listdir(self.temp_directory), ["Corners.data"])
+  
+  def test_layer_assignments_do_not_use_default_file_extension(self):
+    self.main_settings['file_ext_mode'].value = (
+      self.main_settings['file_ext_mode'].options['use_as_file_extensions'])
+    self.image.layers[1].name = b"Corners.jpg"
+    output_filename = os.path.join(self.temp_directory, "Corners.jpg")
+    
+    layer_exporter = exportlayers.LayerExporter(
+      0, self.image, self.main_settings,
+      overwrite.NoninteractiveOverwriteChooser(exportlayers.OverwriteHandler.REPLACE), None,
+      layer_assignments={2: output_filename})
+    
+    with self.assertRaises(exportlayers.ExportLayersError):
+      layer_exporter.export_layers()
+    
+    self.assertEqual(layer_exporter.export_plan[0].output_filename, output_filename)
+
+
+@mock.patch(LIB_NAME + '.pylibgimpplugin.libfiles.replace_file')
+@mock.patch(LIB_NAME + '.pylibgimpplugin.libfiles.make_dirs')
+@mock.patch(LIB_NAME + '.exportlayers.pdb', new=gimpmocks.MockPDB())
+@mock.patch(LIB_NAME + '.pylibgimpplugin.pylibgimp.pdb', new=gimpmocks.MockPDB())
+@mock.patch(LIB_NAME + '.pylibgimpplugin.itemdata.pdb', new=gimpmocks.MockPDB())
+class TestRunWorker(unittest.TestCase):
+  
+  def setUp(self):
+    self.temp_directory = tempfile.mkdtemp()
+    
+    main_settings = settings_plugin.MainSettings()
+    main_settings['output_directory'].value = "output"
+    main_settings['file_extension'].value = "png"
+    
+    self.settings_filename = os.path.join(self.temp_directory, "settings.json")
+    farm.settings.JSONFileSettingStream(self.settings_filename).write(main_settings)
+    
+    self.job_filename = os.path.join(self.temp_directory, "worker_0.json")
+    self.result_filename = os.path.join(self.temp_directory, "worker_0_result.json")
+    with open(self.job_filename, 'w') as job_file:
+      json.dump({
+        'filename': "image.xcf",
+        'settings_filename': self.settings_filename,
+        'result_filename': self.result_filename,
+        'layer_assignments': [[3, "output/Shadow.png"], [6, "output/Hand.png"]]}, job_file)
+  
+  def tearDown(self):
+    shutil.rmtree(self.temp_directory)
+  
+  @mock.patch(LIB_NAME + '.farm.pdb')
+  def test_run_worker(self, mock_pdb, mock_make_dirs, mock_replace_file):
+    mock_pdb.gimp_file_load.return_value = _create_image()
+    
+    farm.run_worker(self.job_filename)
+    
+    with open(self.result_filename, 'r') as result_file:
+      result = json.load(result_file)
+    
+    self.assertEqual(result, {'exported_layer_names': ["Shadow", "Left Hand"], 'error': None})
+    self.assertEqual(mock_pdb.gimp_image_delete.call_count, 1)
+  
+  @mock.patch(LIB_NAME + '.farm.pdb')
+  def test_run_worker_image_load_failure(self, mock_pdb, mock_make_dirs, mock_replace_file):
+    mock_pdb.gimp_file_load.side_effect = RuntimeError("could not open image")
+    
+    farm.run_worker(self.job_filename)
+    
+    with open(self.result_filename, 'r') as result_file:
+      result = json.load(result_file)
+    
+    self.assertEqual(result, {'exported_layer_names': [], 'error': "could not open image"})